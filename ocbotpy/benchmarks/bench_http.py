@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BotHttp/BotAPI 的压测脚本，使用 botpy.ext.mock_openapi 在本地模拟 OpenAPI，不需要机器人账号
+
+    python benchmarks/bench_http.py
+    python benchmarks/bench_http.py --requests 5000 --concurrency 200 --latency 0.02 --rate-limit 0.01
+    python benchmarks/bench_http.py --scenario send --tracemalloc
+
+每个场景输出 请求数/秒、耗时分位数(p50/p90/p99)、429 与错误次数，以及内存占用
+(进程最大常驻内存；开启 --tracemalloc 时另外输出 Python 分配的峰值内存)。
+"""
+
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botpy.api import BotAPI  # noqa: E402
+from botpy.cache import MediaCache  # noqa: E402
+from botpy.ext.mock_openapi import MockOpenAPI  # noqa: E402
+from botpy.http import BotHttp  # noqa: E402
+from botpy.logging import configure_logging  # noqa: E402
+
+# 上传场景使用的文件大小
+UPLOAD_SIZE = 256 * 1024
+
+
+async def _send(api: BotAPI, i: int):
+    return await api.post_group_message("group%s" % (i % 16), content="hello %s" % i, msg_id="msg%s" % i)
+
+
+async def _upload(api: BotAPI, i: int):
+    # 每个请求上传不同的内容，避免命中 MediaCache
+    data = base64.b64encode(i.to_bytes(8, "big") * (UPLOAD_SIZE // 8)).decode()
+    return await api.post_group_file("group%s" % (i % 16), file_type=1, file_data=data)
+
+
+async def _upload_bytes(api: BotAPI, i: int):
+    # 直接传入 bytes，由 SDK 在发送时按块编码为 base64
+    data = i.to_bytes(8, "big") * (UPLOAD_SIZE // 8)
+    return await api.post_group_file("group%s" % (i % 16), file_type=1, file_data=data)
+
+
+async def _upload_multipart(api: BotAPI, i: int):
+    data = i.to_bytes(8, "big") * (UPLOAD_SIZE // 8)
+    return await api.post_message("channel%s" % (i % 16), content="image", file_image=data)
+
+
+async def _get(api: BotAPI, i: int):
+    return await api.get_guild_members("guild%s" % (i % 16), after=str(i % 500), limit=100)
+
+
+SCENARIOS = {
+    "send": (_send, "POST /v2/groups/{group_openid}/messages"),
+    "upload": (_upload, "POST /v2/groups/{group_openid}/files"),
+    "upload-bytes": (_upload_bytes, "POST /v2/groups/{group_openid}/files"),
+    "multipart": (_upload_multipart, "POST /channels/{channel_id}/messages"),
+    "get": (_get, "GET /guilds/{guild_id}/members"),
+}
+
+
+def _percentile(latencies, q: float) -> float:
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+def _max_rss_mb() -> float:
+    # Linux 下 ru_maxrss 的单位是 KB，macOS 下是字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+async def run_scenario(name: str, args) -> dict:
+    call, template = SCENARIOS[name]
+    async with MockOpenAPI(
+        latency=args.latency, jitter=args.jitter, rate_limit_ratio=args.rate_limit, error_ratio=args.error, seed=1
+    ) as server:
+        http = BotHttp(timeout=10, app_id="mock", secret="mock")
+        api = BotAPI(http, media_cache=MediaCache())
+        # 预热：获取 access_token 并建立连接
+        await api.me()
+        http.metrics.reset()
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+        failures = 0
+
+        async def one(i: int):
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await call(api, i)
+                except Exception:
+                    failures += 1
+                latencies.append(time.perf_counter() - start)
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        if args.tracemalloc:
+            tracemalloc.stop()
+
+        await http.close()
+        latencies.sort()
+        route = http.metrics.routes.get(template)
+        return {
+            "scenario": name,
+            "requests": args.requests,
+            "elapsed": elapsed,
+            "rps": args.requests / elapsed if elapsed else 0.0,
+            "p50": _percentile(latencies, 0.5),
+            "p90": _percentile(latencies, 0.9),
+            "p99": _percentile(latencies, 0.99),
+            "failures": failures,
+            "rate_limited": route.rate_limited if route else 0,
+            "retries": route.retries if route else 0,
+            "server_hits": sum(server.counts.values()),
+            "received_mb": server.received_bytes / (1024 * 1024),
+            "max_rss_mb": _max_rss_mb(),
+            "traced_peak_mb": peak / (1024 * 1024) if peak is not None else None,
+        }
+
+
+def report(result: dict) -> None:
+    line = (
+        "{scenario:<12} {requests:>6} req  {rps:>9.1f} req/s  "
+        "p50 {p50_ms:>7.2f}ms  p90 {p90_ms:>7.2f}ms  p99 {p99_ms:>7.2f}ms  "
+        "429 {rate_limited:>4}  retries {retries:>4}  failed {failures:>4}  "
+        "sent {received_mb:>7.1f}MB  rss {max_rss_mb:>7.1f}MB"
+    ).format(p50_ms=result["p50"] * 1000, p90_ms=result["p90"] * 1000, p99_ms=result["p99"] * 1000, **result)
+    if result["traced_peak_mb"] is not None:
+        line += "  py-peak {:>7.1f}MB".format(result["traced_peak_mb"])
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="botpy HTTP benchmark against a local mock OpenAPI")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append", help="默认运行所有场景")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.005, help="服务端基础延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="服务端延迟波动(秒)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--error", type=float, default=0.0, help="返回 503 的比例")
+    parser.add_argument("--tracemalloc", action="store_true", help="统计 Python 分配的峰值内存(会降低吞吐)")
+    args = parser.parse_args()
+
+    # 注入 429 时每次限频都会输出警告，压测时只保留错误日志
+    configure_logging(level=logging.ERROR)
+    for name in args.scenario or ["send", "upload", "upload-bytes", "multipart", "get"]:
+        report(asyncio.run(run_scenario(name, args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,15 @@
 
 # 异步api
 
-from io import BufferedReader
-from typing import Any, List, Union, BinaryIO, Dict
+import asyncio
+import mmap
+import os
+from typing import Any, AsyncIterable, List, Union, BinaryIO, Dict, Optional, Tuple, Type
 
+from .cache import MediaCache, ResponseCache, TTLCache
 from .flags import Permission
 from .http import BotHttp, Route
+from . import codec, models, paginator
 from .types import (
     guild,
     user,
@@ -31,14 +35,35 @@ class BotAPI:
         - 如果要直接使用api，可以通过client的内部成员变量，通过`self.api.xx`来使用
         - 设置超时时间: Client(timeout=5)
         - API当前返回的所有自定义类型数据为字典数据，通过TypedDict进行类型提示
+        - 设置 response_models=True 时，频道、成员、子频道等只读接口返回 botpy.models 中的轻量视图
     """
 
-    def __init__(self, http: BotHttp):
+    # 被动回复的有效期，超过后不再保留 msg_id 对应的 msg_seq
+    MSG_SEQ_TTL = 300
+
+    def __init__(self, http: BotHttp, media_cache: MediaCache = None, response_models: bool = False):
         """
         Args:
           http (BotHttp): 用于发送请求的 http 客户端。
+          media_cache (MediaCache): 富媒体上传结果的缓存，为空时不缓存。
+          response_models (bool): 是否把只读接口的返回值包装为 botpy.models 中按需转换字段的视图。. Defaults to False
         """
         self._http = http
+        self.media_cache = media_cache
+        self.response_models = response_models
+        # msg_id -> 下一个可用的 msg_seq，只按过期时间清理：按条数淘汰后再回复同一个 msg_id 会从 1 开始，
+        # 被服务端当作重复消息。条目数为 MSG_SEQ_TTL 秒内回复过的 msg_id 数
+        self._msg_seqs = TTLCache(maxsize=None, ttl=self.MSG_SEQ_TTL)
+        # 正在上传的富媒体，相同内容同时上传时共享同一个请求
+        self._media_inflight: Dict[Tuple, asyncio.Future] = {}
+
+    def _model(self, model: Type[models.Model], data: Any) -> Any:
+        return models.wrap(model, data) if self.response_models else data
+
+    @property
+    def cache(self) -> Optional[ResponseCache]:
+        """只读接口的响应缓存，未开启时为 None"""
+        return self._http.cache
 
     # 频道相关接口
     async def get_guild(self, guild_id: str) -> guild.GuildPayload:
@@ -52,7 +77,7 @@ class BotAPI:
           GuildPayload (字典数据)
         """
         route = Route("GET", "/guilds/{guild_id}", guild_id=guild_id)
-        return await self._http.request(route)
+        return self._model(models.Guild, await self._http.request(route))
 
     # 频道身份组相关接口
     async def get_guild_roles(self, guild_id: str) -> guild.GuildRoles:
@@ -66,7 +91,7 @@ class BotAPI:
           GuildRolesPayload
         """
         route = Route("GET", "/guilds/{guild_id}/roles", guild_id=guild_id)
-        return await self._http.request(route)
+        return self._model(models.GuildRoles, await self._http.request(route))
 
     async def create_guild_role(self, guild_id: str, **fields: Any) -> guild.GuildRole:
         """
@@ -192,7 +217,7 @@ class BotAPI:
             guild_id=guild_id,
             user_id=user_id,
         )
-        return await self._http.request(route)
+        return self._model(models.Member, await self._http.request(route))
 
     async def get_delete_member(
         self,
@@ -246,7 +271,7 @@ class BotAPI:
             "/guilds/{guild_id}/members",
             guild_id=guild_id,
         )
-        return await self._http.request(route, params=params)
+        return self._model(models.Member, await self._http.request(route, params=params))
 
     async def get_guild_role_members(
         self, guild_id: str, role_id: str, start_index: str = "0", limit: int = 1
@@ -273,7 +298,45 @@ class BotAPI:
             guild_id=guild_id,
             role_id=role_id,
         )
-        return await self._http.request(route, params=params)
+        return self._model(models.RoleMembers, await self._http.request(route, params=params))
+
+    def iter_guild_members(
+        self, guild_id: str, after: str = "0", limit: int = None, page_size: int = 400
+    ) -> paginator.Paginator:
+        """
+        分页遍历频道成员，迭代当前页时预取下一页，并按 user id 去除翻页时重复返回的成员。
+
+        注意:该接口为私域机器人权限, 需要在管理端申请权限
+
+        Args:
+          guild_id (str): 频道 ID。
+          after (str): 从该用户 ID 之后开始遍历，可以传入上一个迭代器的 cursor 继续遍历。. Defaults to 0
+          limit (int): 最多返回的成员数，为空时遍历全部成员。
+          page_size (int): 每页的成员数，1-400。. Defaults to 400
+
+        Returns:
+          user.Member 的异步迭代器。
+        """
+        return paginator.Paginator(paginator.guild_members_fetcher(self, guild_id, page_size), after, limit)
+
+    def iter_guild_role_members(
+        self, guild_id: str, role_id: str, start_index: str = "0", limit: int = None, page_size: int = 400
+    ) -> paginator.Paginator:
+        """
+        分页遍历频道身份组成员，迭代当前页时预取下一页。
+
+        Args:
+          guild_id (str): 频道 ID。
+          role_id (str): 身份组 ID。
+          start_index (str): 起始的分页参数，可以传入上一个迭代器的 cursor 继续遍历。. Defaults to 0
+          limit (int): 最多返回的成员数，为空时遍历全部成员。
+          page_size (int): 每页的成员数，1-400。. Defaults to 400
+
+        Returns:
+          user.Member 的异步迭代器。
+        """
+        fetch = paginator.guild_role_members_fetcher(self, guild_id, role_id, page_size)
+        return paginator.Paginator(fetch, start_index, limit)
 
     async def get_voice_members(self, channel_id: str) -> List[user.Member]:
         """
@@ -290,7 +353,7 @@ class BotAPI:
           user.Member 对象的列表。
         """
         route = Route("GET", "/channels/{channel_id}/voice/members", channel_id=channel_id)
-        return await self._http.request(route)
+        return self._model(models.Member, await self._http.request(route))
 
     # 子频道相关接口
     async def get_channel(self, channel_id: str) -> channel.ChannelPayload:
@@ -308,7 +371,7 @@ class BotAPI:
             "/channels/{channel_id}",
             channel_id=channel_id,
         )
-        return await self._http.request(route)
+        return self._model(models.Channel, await self._http.request(route))
 
     async def get_channels(self, guild_id: str) -> List[channel.ChannelPayload]:
         """
@@ -325,7 +388,7 @@ class BotAPI:
             "/guilds/{guild_id}/channels",
             guild_id=guild_id,
         )
-        return await self._http.request(route)
+        return self._model(models.Channel, await self._http.request(route))
 
     async def create_channel(
         self, guild_id: str, name: str, type: channel.ChannelType, sub_type: channel.ChannelSubType, **fields
@@ -502,7 +565,7 @@ class BotAPI:
         ark: message.Ark = None,
         message_reference: message.Reference = None,
         image: str = None,
-        file_image: Union[bytes, BinaryIO, str] = None,
+        file_image: Union[bytes, BinaryIO, str, os.PathLike, AsyncIterable[bytes]] = None,
         msg_id: str = None,
         event_id: str = None,
         markdown: message.MarkdownPayload = None,
@@ -514,6 +577,7 @@ class BotAPI:
         注意:
         - 要求操作人在该子频道具有发送消息的权限。
         - 发送成功之后，会触发一个创建消息的事件。
+        - 不变的 ark、markdown、keyboard 等可以用 codec.Fragment 预先编码，发送时直接拼接到请求体中
         - 被动回复消息有效期为 5 分钟
         - 主动推送消息每日每个子频道限 2 条
         - 发送消息接口要求机器人接口需要链接到websocket gateway 上保持在线状态
@@ -525,7 +589,7 @@ class BotAPI:
           ark (message.Ark): ark 模版消息
           message_reference (message.Reference): 对消息的引用。
           image (str): 要发送的图像的 URL。
-          file_image (bytes): 要发送的本地图像的本地路径或数据。
+          file_image (bytes): 要发送的本地图像的本地路径、文件对象、异步字节迭代器或数据。
           msg_id (str): 您要回复的消息的 ID。您可以从 AT_CREATE_MESSAGE 事件中获取此 ID。
           event_id (str): 您要回复的消息的事件 ID。
           markdown (message.MarkdownPayload): markdown 消息
@@ -534,14 +598,8 @@ class BotAPI:
         Returns:
           message.Message: 一个消息字典对象。
         """
-        if isinstance(file_image, BufferedReader):
-            file_image = file_image.read()
-        elif isinstance(file_image, str):
-            with open(file_image, "rb") as img:
-                file_image = img.read()
-        payload = locals()
-        payload.pop("self", None)
-        payload.pop("img", None)
+        # 本地文件不在这里读取，由 BotHttp 在发送时流式写入 multipart 请求体
+        payload = codec.compact(locals())
         route = Route("POST", "/channels/{channel_id}/messages", channel_id=channel_id)
         return await self._http.request(route, json=payload)
 
@@ -638,8 +696,7 @@ class BotAPI:
         Returns:
           message.Message: 一个消息字典对象。
         """
-        payload = locals()
-        payload.pop("self", None)
+        payload = codec.compact(locals())
         route = Route(
             "PATCH",
             "/channels/{channel_id}/messages/{patch_msg_id}",
@@ -674,7 +731,7 @@ class BotAPI:
         ark: message.Ark = None,
         message_reference: message.Reference = None,
         image: str = None,
-        file_image: Union[bytes, BinaryIO, str] = None,
+        file_image: Union[bytes, BinaryIO, str, os.PathLike, AsyncIterable[bytes]] = None,
         msg_id: str = None,
         event_id: str = None,
         markdown: message.MarkdownPayload = None,
@@ -686,6 +743,7 @@ class BotAPI:
         注意:
         - 要求操作人在该子频道具有发送消息的权限。
         - 发送成功之后，会触发一个创建消息的事件。
+        - 不变的 ark、markdown、keyboard 等可以用 codec.Fragment 预先编码，发送时直接拼接到请求体中
         - 被动回复消息有效期为 5 分钟
         - 主动推送消息每日每个子频道限 2 条
         - 发送消息接口要求机器人接口需要链接到websocket gateway 上保持在线状态
@@ -697,7 +755,7 @@ class BotAPI:
           ark (message.Ark): ark 模版消息
           message_reference (message.Reference): 对消息的引用。
           image (str): 要发送的图像的 URL。
-          file_image (bytes): 本地图片
+          file_image (bytes): 本地图片的路径、文件对象、异步字节迭代器或数据。
           msg_id (str): 您要回复的消息的 ID。您可以从 AT_CREATE_MESSAGE 事件中获取此 ID。
           event_id (str): 您要回复的消息的事件 ID。
           markdown (message.MarkdownPayload): markdown 消息
@@ -706,14 +764,8 @@ class BotAPI:
         Returns:
           message.Message: 一个消息字典对象。
         """
-        if isinstance(file_image, BufferedReader):
-            file_image = file_image.read()
-        elif isinstance(file_image, str):
-            with open(file_image, "rb") as img:
-                file_image = img.read()
-        payload = locals()
-        payload.pop("self", None)
-        payload.pop("img", None)
+        # 本地文件不在这里读取，由 BotHttp 在发送时流式写入 multipart 请求体
+        payload = codec.compact(locals())
         route = Route("POST", "/dms/{guild_id}/messages", guild_id=guild_id)
         return await self._http.request(route, json=payload)
 
@@ -778,7 +830,7 @@ class BotAPI:
           一个用户对象。字典类型数据
         """
         route = Route("GET", "/users/@me")
-        return await self._http.request(route)
+        return self._model(models.User, await self._http.request(route))
 
     async def me_guilds(self, guild_id: str = None, limit: int = 100, desc: bool = False) -> List[guild.GuildPayload]:
         """
@@ -799,7 +851,24 @@ class BotAPI:
             params["after"] = guild_id
 
         route = Route("GET", "/users/@me/guilds")
-        return await self._http.request(route, params=params)
+        return self._model(models.Guild, await self._http.request(route, params=params))
+
+    def iter_me_guilds(
+        self, guild_id: str = None, desc: bool = False, limit: int = None, page_size: int = 100
+    ) -> paginator.Paginator:
+        """
+        分页遍历当前用户已加入的频道，迭代当前页时预取下一页。
+
+        Args:
+          guild_id (str): 起始频道 ID，可以传入上一个迭代器的 cursor 继续遍历。
+          desc (bool): 如果为 True，则按频道 ID 往前遍历。. Defaults to False
+          limit (int): 最多返回的频道数，为空时遍历全部频道。
+          page_size (int): 每页的频道数，1-100。. Defaults to 100
+
+        Returns:
+          guild.GuildPayload 的异步迭代器。
+        """
+        return paginator.Paginator(paginator.me_guilds_fetcher(self, desc, page_size), guild_id, limit)
 
     # WebsocketAPI
     async def get_ws_url(self):
@@ -1237,6 +1306,34 @@ class BotAPI:
         params = {"limit": limit, "cookie": cookie} if cookie else {"limit": limit}
         return await self._http.request(route, params=params)
 
+    def iter_reaction_users(
+        self,
+        channel_id: str,
+        message_id: str,
+        emoji_type: emoji.EmojiType,
+        emoji_id: str,
+        cookie: str = None,
+        limit: int = None,
+        page_size: int = 100,
+    ) -> paginator.Paginator:
+        """
+        分页遍历表情表态用户，迭代当前页时预取下一页。
+
+        Args:
+          channel_id (str): 消息所在子频道的 ID。
+          message_id (str): 要从中获取表情表态的消息的 ID。
+          emoji_type (emoji.EmojiType): 表情符号的类型。1: 系统表情, 2: emoji表情
+          emoji_id (str): 表情符号的 ID。
+          cookie (str): 起始的分页参数，可以传入上一个迭代器的 cursor 继续遍历。
+          limit (int): 最多返回的用户数，为空时遍历全部用户。
+          page_size (int): 每页的用户数，1-100。. Defaults to 100
+
+        Returns:
+          User 的异步迭代器。
+        """
+        fetch = paginator.reaction_users_fetcher(self, channel_id, message_id, emoji_type, emoji_id, page_size)
+        return paginator.Paginator(fetch, cookie, limit)
+
     # 精华消息API
     async def put_pin(self, channel_id: str, message_id: str) -> pins_message.PinsMessage:
         """
@@ -1387,7 +1484,7 @@ class BotAPI:
         message_reference: message.Reference = None,
         media: message.Media = None,
         msg_id: str = None,
-        msg_seq: int = 1,
+        msg_seq: int = None,
         event_id: str = None,
         markdown: message.MarkdownPayload = None,
         keyboard: message.Keyboard = None,
@@ -1398,6 +1495,7 @@ class BotAPI:
         注意:
         - 要求操作人在该群具有发送消息的权限。
         - 发送成功之后，会触发一个创建消息的事件。
+        - 不变的 ark、markdown、keyboard 等可以用 codec.Fragment 预先编码，发送时直接拼接到请求体中
         - 被动回复消息有效期为 5 分钟
         - 发送消息接口要求机器人接口需要链接到websocket gateway 上保持在线状态
 
@@ -1410,7 +1508,8 @@ class BotAPI:
           message_reference (message.Reference): 对消息的引用。
           media (message.Media): 富媒体消息
           msg_id (str): 您要回复的消息的 ID。
-          msg_seq (int): 回复消息的序号，与 msg_id 联合使用，默认是1。相同的 msg_id + msg_seq 重复发送会失败。
+          msg_seq (int): 回复消息的序号，与 msg_id 联合使用，为空时按 msg_id(或 event_id)自动分配。
+            相同的 msg_id + msg_seq 重复发送会失败。
           event_id (str): 您要回复的消息的事件 ID。
           markdown (message.MarkdownPayload): markdown 消息
           keyboard (message.Keyboard): keyboard 消息
@@ -1418,8 +1517,8 @@ class BotAPI:
         Returns:
           message.Message: 一个消息字典对象。
         """
-        payload = locals()
-        payload.pop("self", None)
+        msg_seq = self._claim_msg_seq(msg_id or event_id, msg_seq)
+        payload = codec.compact(locals())
         route = Route("POST", "/v2/groups/{group_openid}/messages", group_openid=group_openid)
         return await self._http.request(route, json=payload)
 
@@ -1433,7 +1532,7 @@ class BotAPI:
         message_reference: message.Reference = None,
         media: message.Media = None,
         msg_id: str = None,
-        msg_seq: str = 1,
+        msg_seq: int = None,
         event_id: str = None,
         markdown: message.MarkdownPayload = None,
         keyboard: message.Keyboard = None,
@@ -1444,6 +1543,7 @@ class BotAPI:
         注意:
         - 要求操作人具有发送消息的权限。
         - 发送成功之后，会触发一个创建消息的事件。
+        - 不变的 ark、markdown、keyboard 等可以用 codec.Fragment 预先编码，发送时直接拼接到请求体中
         - 被动回复消息有效期为 5 分钟
         - 发送消息接口要求机器人接口需要链接到websocket gateway 上保持在线状态
 
@@ -1456,7 +1556,8 @@ class BotAPI:
           message_reference (message.Reference): 对消息的引用。
           media (message.Media): 富媒体消息
           msg_id (str): 您要回复的消息的 ID。
-          msg_seq (int): 回复消息的序号，与 msg_id 联合使用，默认是1。相同的 msg_id + msg_seq 重复发送会失败。
+          msg_seq (int): 回复消息的序号，与 msg_id 联合使用，为空时按 msg_id(或 event_id)自动分配。
+            相同的 msg_id + msg_seq 重复发送会失败。
           event_id (str): 您要回复的消息的事件 ID。
           markdown (message.MarkdownPayload): markdown 消息
           keyboard (message.Keyboard): keyboard 消息
@@ -1464,16 +1565,138 @@ class BotAPI:
         Returns:
           message.Message: 一个消息字典对象。
         """
-        payload = locals()
-        payload.pop("self", None)
+        msg_seq = self._claim_msg_seq(msg_id or event_id, msg_seq)
+        payload = codec.compact(locals())
         route = Route("POST", "/v2/users/{openid}/messages", openid=openid)
         return await self._http.request(route, json=payload)
 
+    def next_msg_seq(self, msg_id: str, count: int = 1) -> int:
+        """
+        为同一条被动消息分配 count 个连续的 msg_seq，返回第一个。
+
+        Args:
+          msg_id (str): 回复的消息 ID(或事件 ID)，为空时固定返回 1
+          count (int): 需要的序号个数
+
+        Returns:
+          第一个可用的 msg_seq
+        """
+        if not msg_id:
+            return 1
+        start = self._msg_seqs.get(msg_id, 1)
+        self._msg_seqs.set(msg_id, start + count)
+        return start
+
+    def _claim_msg_seq(self, msg_id: str, msg_seq: Optional[int]) -> Optional[int]:
+        # 未指定时分配下一个序号；显式传入的序号同样记录下来，之后分配的序号不会与其重复
+        if not msg_id:
+            return msg_seq
+        if msg_seq is None:
+            return self.next_msg_seq(msg_id)
+        if msg_seq >= self._msg_seqs.get(msg_id, 1):
+            self._msg_seqs.set(msg_id, msg_seq + 1)
+        return msg_seq
+
+    async def _post_batch(
+        self,
+        post,
+        target: str,
+        parts: List[Union[str, dict]],
+        msg_id: str,
+        event_id: str,
+        interval: float,
+        ordered: bool,
+    ) -> List[Union[message.Message, Exception]]:
+        parts = [{"msg_type": 0, "content": part} if isinstance(part, str) else part for part in parts]
+        first_seq = self.next_msg_seq(msg_id or event_id, len(parts))
+
+        async def send(index: int, part: dict):
+            kwargs = dict(part)
+            kwargs.setdefault("msg_id", msg_id)
+            kwargs.setdefault("event_id", event_id)
+            kwargs["msg_seq"] = first_seq + index
+            return await post(target, **kwargs)
+
+        if ordered:
+            # 上一条被服务端接受(或最终失败)后才发出下一条，某条限频或重试时后面的消息不会先到达
+            results = []
+            for index, part in enumerate(parts):
+                try:
+                    results.append(await send(index, part))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+        async def staggered(index: int, part: dict):
+            # 按 interval 错开发出，不等待上一条返回
+            if index and interval > 0:
+                await asyncio.sleep(index * interval)
+            return await send(index, part)
+
+        return await asyncio.gather(*(staggered(i, part) for i, part in enumerate(parts)), return_exceptions=True)
+
+    async def post_group_messages(
+        self,
+        group_openid: str,
+        parts: List[Union[str, dict]],
+        msg_id: str = None,
+        event_id: str = None,
+        interval: float = 0.05,
+        ordered: bool = True,
+    ) -> List[Union[message.Message, Exception]]:
+        """
+        批量发送多条群消息，如把一个回答拆成多段文本和图片发送。
+
+        各条消息的 msg_seq 自动分配。默认按顺序发送：上一条被服务端接受(或最终失败)后才发出下一条，
+        某条消息触发限频或重试时后面的消息会等待，到达顺序与 parts 一致，总耗时为各条请求耗时之和。
+        ordered=False 时请求按 interval 依次错开后并发发出(仍受限频控制)，总耗时约为一次请求的耗时
+        加上 (条数-1)*interval，但不保证到达顺序：某条消息触发限频或重试时，会在其后的消息之后才到达。
+
+        Args:
+          group_openid (str): 您要将消息发送到的群的 ID。
+          parts (List[Union[str, dict]]): 消息列表，str 为文本消息，dict 为 post_group_message 的参数(不含 group_openid)
+          msg_id (str): 您要回复的消息的 ID。
+          event_id (str): 您要回复的消息的事件 ID。
+          interval (float): ordered=False 时相邻两条消息发出的间隔秒数，为 0 时同时发出
+          ordered (bool): 是否保证消息按 parts 的顺序到达。. Defaults to True
+
+        Returns:
+          与 parts 一一对应的列表，发送成功为消息字典对象，失败为对应的异常。
+        """
+        return await self._post_batch(
+            self.post_group_message, group_openid, parts, msg_id, event_id, interval, ordered
+        )
+
+    async def post_c2c_messages(
+        self,
+        openid: str,
+        parts: List[Union[str, dict]],
+        msg_id: str = None,
+        event_id: str = None,
+        interval: float = 0.05,
+        ordered: bool = True,
+    ) -> List[Union[message.Message, Exception]]:
+        """
+        批量发送多条单聊消息，参数和返回值同 post_group_messages。
+
+        Args:
+          openid (str): 您要将消息发送到的用户的 ID。
+          parts (List[Union[str, dict]]): 消息列表，str 为文本消息，dict 为 post_c2c_message 的参数(不含 openid)
+          msg_id (str): 您要回复的消息的 ID。
+          event_id (str): 您要回复的消息的事件 ID。
+          interval (float): ordered=False 时相邻两条消息发出的间隔秒数，为 0 时同时发出
+          ordered (bool): 是否保证消息按 parts 的顺序到达。. Defaults to True
+
+        Returns:
+          与 parts 一一对应的列表，发送成功为消息字典对象，失败为对应的异常。
+        """
+        return await self._post_batch(self.post_c2c_message, openid, parts, msg_id, event_id, interval, ordered)
+
     async def post_group_file(
         self,
         group_openid: str,
         file_type: int,
-        file_data: str,
+        file_data: Union[str, bytes, bytearray, memoryview, mmap.mmap, os.PathLike, BinaryIO],
         srv_send_msg: bool = False,
     ) -> message.Media:
         """
@@ -1482,20 +1705,21 @@ class BotAPI:
         Args:
           group_openid (str): 您要将消息发送到的群的 ID
           file_type (int): 媒体类型：1 图片png/jpg，2 视频mp4，3 语音silk，4 文件（暂不开放）
-          url (str): 需要发送媒体资源的url
+          file_data: 媒体内容。str 为已经编码好的 base64；bytes、memoryview、mmap、文件路径(os.PathLike)
+            和文件对象会在发送时按块编码为 base64 直接写入请求体，不需要自行编码
           srv_send_msg (bool): 设置 true 会直接发送消息到目标端，且会占用主动消息频次
         """
-        payload = locals()
-        payload.pop("self", None)
+        payload = codec.compact(locals())
         route = Route("POST", "/v2/groups/{group_openid}/files", group_openid=group_openid)
-        return await self._http.request(route, json=payload)
+        return await self._post_file(route, "group", group_openid, payload, file_data)
 
     async def post_c2c_file(
         self,
         openid: str,
         file_type: int,
-        url: str,
+        url: str = None,
         srv_send_msg: bool = False,
+        file_data: Union[str, bytes, bytearray, memoryview, mmap.mmap, os.PathLike, BinaryIO] = None,
     ) -> message.Media:
         """
         上传/发送c2c图片
@@ -1503,10 +1727,32 @@ class BotAPI:
         Args:
           openid (str): 您要将消息发送到的用户的 ID
           file_type (int): 媒体类型：1 图片png/jpg，2 视频mp4，3 语音silk，4 文件（暂不开放）
-          url (str): 需要发送媒体资源的url
+          url (str): 需要发送媒体资源的url，与 file_data 二选一
           srv_send_msg (bool): 设置 true 会直接发送消息到目标端，且会占用主动消息频次
+          file_data: 媒体内容，与 url 二选一，支持的类型同 post_group_file
         """
-        payload = locals()
-        payload.pop("self", None)
+        payload = codec.compact(locals())
         route = Route("POST", "/v2/users/{openid}/files", openid=openid)
-        return await self._http.request(route, json=payload)
+        return await self._post_file(route, "c2c", openid, payload, url if file_data is None else file_data)
+
+    async def _post_file(self, route: Route, scope: str, target: str, payload: dict, content: str) -> message.Media:
+        cache = self.media_cache
+        # srv_send_msg 会直接发出消息，不能用缓存代替；文件路径和文件对象不读取内容计算哈希，不缓存
+        if cache is None or payload.get("srv_send_msg") or not content or not cache.hashable(content):
+            return await self._http.request(route, json=payload)
+        key = cache.key(scope, target, payload["file_type"], content)
+        media = cache.get(key)
+        if media is not None:
+            return media
+        future = self._media_inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._http.request(route, json=payload))
+            self._media_inflight[key] = future
+
+            def _done(f: asyncio.Future):
+                self._media_inflight.pop(key, None)
+                if not f.cancelled() and f.exception() is None:
+                    cache.set(key, f.result())
+
+            future.add_done_callback(_done)
+        return await asyncio.shield(future)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+本地缓存
+
+- TTLCache: 带过期时间、按 LRU 淘汰的通用缓存
+- ResponseCache: 位于 BotAPI 与 BotHttp 之间的只读接口响应缓存，默认不启用，
+  通过 ``Client(response_cache=ResponseCache())`` 开启
+- MediaCache: 富媒体上传结果的缓存，相同内容重复上传到同一个群/用户时直接复用 file_info，
+  通过 ``Client(media_cache=MediaCache())`` 开启
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, Union
+
+from . import logging
+
+_log = logging.get_logger()
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存
+
+    Args:
+      maxsize (int): 最多缓存的条目数，超出后淘汰最久未使用的条目。
+        为 None 时不限条数、只按过期时间清理，条目按写入顺序排列，写入时移除开头已经过期的条目
+      ttl (float): 默认的过期秒数
+    """
+
+    def __init__(self, maxsize: Optional[int] = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (过期时间, 值)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        if item[0] <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        if self.maxsize is not None:
+            self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        if self.maxsize is None:
+            now = time.monotonic()
+            while self._data:
+                first = next(iter(self._data))
+                if self._data[first][0] > now:
+                    break
+                del self._data[first]
+            return
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def items(self):
+        """未过期的 (key, value)"""
+        now = time.monotonic()
+        return [(key, item[1]) for key, item in self._data.items() if item[0] > now]
+
+    def expire(self) -> int:
+        """清理已过期的条目，返回清理的数量"""
+        now = time.monotonic()
+        expired = [key for key, item in self._data.items() if item[0] <= now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# 默认缓存的只读接口及过期秒数，key 为 "请求方式 路径模板"
+DEFAULT_RESPONSE_TTLS: Dict[str, float] = {
+    "GET /users/@me": 300,
+    "GET /guilds/{guild_id}": 300,
+    "GET /guilds/{guild_id}/roles": 60,
+    "GET /guilds/{guild_id}/channels": 60,
+    "GET /guilds/{guild_id}/members/{user_id}": 60,
+    "GET /channels/{channel_id}": 60,
+    "GET /channels/{channel_id}/members/{user_id}/permissions": 30,
+    "GET /channels/{channel_id}/roles/{role_id}/permissions": 30,
+}
+
+# 写接口调用成功后需要失效的缓存接口，按两者共有的路由参数匹配
+WRITE_INVALIDATIONS: Dict[str, Tuple[str, ...]] = {
+    "POST /guilds/{guild_id}/roles": ("GET /guilds/{guild_id}/roles",),
+    "PATCH /guilds/{guild_id}/roles/{role_id}": ("GET /guilds/{guild_id}/roles",),
+    "DELETE /guilds/{guild_id}/roles/{role_id}": ("GET /guilds/{guild_id}/roles",),
+    "PUT /guilds/{guild_id}/members/{user_id}/roles/{role_id}": ("GET /guilds/{guild_id}/members/{user_id}",),
+    "DELETE /guilds/{guild_id}/members/{user_id}/roles/{role_id}": ("GET /guilds/{guild_id}/members/{user_id}",),
+    "DELETE /guilds/{guild_id}/members/{user_id}": ("GET /guilds/{guild_id}/members/{user_id}",),
+    "POST /guilds/{guild_id}/channels": ("GET /guilds/{guild_id}/channels",),
+    "PATCH /channels/{channel_id}": ("GET /channels/{channel_id}", "GET /guilds/{guild_id}/channels"),
+    "DELETE /channels/{channel_id}": ("GET /channels/{channel_id}", "GET /guilds/{guild_id}/channels"),
+    "PUT /channels/{channel_id}/members/{user_id}/permissions": (
+        "GET /channels/{channel_id}/members/{user_id}/permissions",
+    ),
+    "PUT /channels/{channel_id}/roles/{role_id}/permissions": (
+        "GET /channels/{channel_id}/roles/{role_id}/permissions",
+    ),
+}
+
+
+class ResponseCache:
+    """只读接口的响应缓存
+
+    按路由模板配置过期时间，只有配置了过期时间的 GET 接口会被缓存；
+    缓存命中时返回的是同一个对象，请勿直接修改。
+    对应实体的 websocket 事件(如 CHANNEL_UPDATE、GUILD_MEMBER_UPDATE)和写接口会自动失效相关的缓存。
+
+    Args:
+      ttls (Dict[str, float]): 路由模板 -> 过期秒数。. Defaults to DEFAULT_RESPONSE_TTLS
+      maxsize (int): 最多缓存的响应数。. Defaults to 2048
+    """
+
+    def __init__(self, ttls: Dict[str, float] = None, maxsize: int = 2048):
+        self.ttls: Dict[str, float] = dict(DEFAULT_RESPONSE_TTLS if ttls is None else ttls)
+        self._cache = TTLCache(maxsize=maxsize)
+        # 路由模板 -> [命中次数, 未命中次数]
+        self._template_stats: Dict[str, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def cacheable(self, template: str) -> bool:
+        return template in self.ttls
+
+    @staticmethod
+    def _key(url: str, params: Optional[dict]) -> Tuple[str, Tuple]:
+        return url, tuple(sorted(params.items())) if params else ()
+
+    def get(self, template: str, url: str, params: dict = None) -> Any:
+        """返回缓存的响应，未命中时返回 None (值为 None 的响应不会被缓存)"""
+        entry = self._cache.get(self._key(url, params))
+        counter = self._template_stats.setdefault(template, [0, 0])
+        if entry is None:
+            counter[1] += 1
+            return None
+        counter[0] += 1
+        return entry[2]
+
+    def set(self, template: str, url: str, parameters: Dict[str, Any], params: dict, value: Any) -> None:
+        ttl = self.ttls.get(template)
+        if ttl is None or value is None:
+            return
+        self._cache.set(self._key(url, params), (template, parameters, value), ttl)
+
+    def invalidate(self, template: str = None, **parameters: Any) -> int:
+        """失效匹配的缓存，返回失效的条目数
+
+        Args:
+          template (str): 只失效该路由模板的缓存，为空则不限制
+          parameters: 路由参数，只比较缓存条目也具有的参数，如 ``invalidate(channel_id="123")``；
+            不指定 template 时，缓存条目至少要有一个相同的参数才会失效
+        """
+        keys = []
+        for key, (entry_template, entry_parameters, _) in self._cache.items():
+            if template is not None and entry_template != template:
+                continue
+            shared = [k for k in parameters if k in entry_parameters]
+            if template is None and not shared:
+                continue
+            if all(str(entry_parameters[k]) == str(parameters[k]) for k in shared):
+                keys.append(key)
+        for key in keys:
+            self._cache.pop(key)
+        if keys:
+            _log.debug("[botpy] 失效缓存 %s 条, 模板: %s, 参数: %s", len(keys), template, parameters)
+        return len(keys)
+
+    def invalidate_for_write(self, template: str, parameters: Dict[str, Any]) -> int:
+        """写接口调用成功后失效相关的缓存"""
+        return sum(self.invalidate(cached, **parameters) for cached in WRITE_INVALIDATIONS.get(template, ()))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats["templates"] = {
+            template: {"hits": hits, "misses": misses} for template, (hits, misses) in self._template_stats.items()
+        }
+        return stats
+
+
+class MediaCache:
+    """富媒体上传结果的缓存
+
+    key 为 (上传范围, 群/用户 openid, file_type, 内容的 sha256)，
+    按接口返回的 ttl 过期(提前 margin 秒失效，ttl 为 0 表示长期有效，此时按 max_ttl 过期)，
+    超出 maxsize 后淘汰最久未使用的条目。命中时返回首次上传时的结果。
+
+    Args:
+      maxsize (int): 最多缓存的上传结果数。. Defaults to 1024
+      max_ttl (float): 最长缓存秒数。. Defaults to 86400
+      margin (float): 提前失效的秒数，避免发送时 file_info 刚好过期。. Defaults to 30
+    """
+
+    def __init__(self, maxsize: int = 1024, max_ttl: float = 86400.0, margin: float = 30.0):
+        self.max_ttl = max_ttl
+        self.margin = margin
+        self._cache = TTLCache(maxsize=maxsize, ttl=max_ttl)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @staticmethod
+    def hashable(content: Any) -> bool:
+        """str 和 bytes、memoryview、mmap 等内存中的内容可以直接计算哈希"""
+        if isinstance(content, str):
+            return True
+        try:
+            memoryview(content)
+        except TypeError:
+            return False
+        return True
+
+    @staticmethod
+    def key(scope: str, target: str, file_type: int, content: Union[str, bytes]) -> Tuple[str, str, int, str]:
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        # hashlib 直接读取 bytes-like 对象的缓冲区，不复制内容
+        return scope, target, file_type, hashlib.sha256(content).hexdigest()
+
+    def get(self, key: Tuple) -> Optional[dict]:
+        return self._cache.get(key)
+
+    def set(self, key: Tuple, media: dict) -> None:
+        if not isinstance(media, dict) or not media.get("file_info"):
+            return
+        ttl = media.get("ttl")
+        if ttl is None:
+            return
+        ttl = self.max_ttl if ttl == 0 else min(float(ttl) - self.margin, self.max_ttl)
+        if ttl > 0:
+            self._cache.set(key, media, ttl)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
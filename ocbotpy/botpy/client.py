@@ -5,10 +5,12 @@ from typing import Any, Callable, Coroutine, Dict, List, Tuple, Optional, Union,
 
 from . import logging
 from .api import BotAPI
+from .cache import MediaCache, ResponseCache
 from .connection import ConnectionSession
 from .flags import Intents
-from .gateway import BotWebSocket
-from .http import BotHttp
+from .gateway import COMPRESSIONS, BotWebSocket, GatewayStats
+from .http import BotHttp, CircuitBreaker, ConnectionPool, DeadlineFallback, HedgePolicy, RetryPolicy
+from .metrics import Metrics
 from .robot import Robot, Token
 
 _log = logging.get_logger()
@@ -37,6 +39,17 @@ class Client:
         log_level: int = None,
         bot_log: Union[bool, None] = True,
         ext_handlers: Union[dict, List[dict], bool] = True,
+        retry_policy: RetryPolicy = None,
+        connection_pool: ConnectionPool = None,
+        coalesce_requests: bool = False,
+        response_cache: ResponseCache = None,
+        media_cache: MediaCache = None,
+        max_concurrency: int = None,
+        circuit_breaker: CircuitBreaker = None,
+        hedge_policy: HedgePolicy = None,
+        deadline_fallback: DeadlineFallback = None,
+        response_models: bool = False,
+        gateway_compress: str = None,
     ):
         """
         Args:
@@ -49,18 +62,52 @@ class Client:
           log_level: 控制台输出level。Default to None(不做更改),
           bot_log: bot_log: bot_log: 是否启用bot日志 True/启用 None/禁用拓展 False/禁用拓展+控制台输出
           ext_handlers: ext_handlers: 额外的handler，格式参考 logging.DEFAULT_FILE_HANDLER。Default to True(使用默认追加handler)
+          retry_policy (RetryPolicy): HTTP 请求的重试策略。Default to None(使用默认的 RetryPolicy)
+          connection_pool (ConnectionPool): HTTP 请求、获取 token 和 websocket 共用的长连接池配置。Default to None(使用默认的 ConnectionPool)
+          coalesce_requests (bool): 是否合并同时发起的相同 GET 请求。Default to False
+          response_cache (ResponseCache): 只读接口的响应缓存，如 ResponseCache()。Default to None(不缓存)
+          media_cache (MediaCache): 富媒体上传结果的缓存，如 MediaCache()。Default to None(不缓存)
+          max_concurrency (int): 同时发出的 HTTP 请求数上限，超出时按优先级排队(被动回复优先)。
+            Default to None(BotHttp.DEFAULT_MAX_CONCURRENCY，且不超过连接池连接数上限的一半)
+          circuit_breaker (CircuitBreaker): 按接口熔断的配置，熔断中的接口直接抛出 CircuitOpenError。
+            Default to None(使用默认的 CircuitBreaker)
+          hedge_policy (HedgePolicy): GET 请求的对冲策略，慢请求超过历史耗时分位数后再发出一个相同请求，
+            以先返回的为准，如 HedgePolicy(routes=["GET /channels/{channel_id}"])。Default to None(不对冲)
+          deadline_fallback (DeadlineFallback): 请求超过截止时间(如 message.reply 超过被动回复有效期)后的处理，
+            如 botpy.http.send_as_active 改为发送主动消息。Default to None(不发送，抛出 DeadlineExceededError)
+          response_models (bool): 频道、成员、子频道等只读接口是否返回 botpy.models 中按需转换字段的轻量视图，
+            视图兼容按 dict 读取。Default to False(返回 dict)
+          gateway_compress (str): websocket 网关的压缩方式，"zlib-stream" 或 "deflate"(permessage-deflate)，
+            收发统计见 client.gateway_stats。Default to None(不压缩)
         """
         self.intents: int = intents.value
         self.ret_coro: bool = False
         # TODO loop的整体梳理 @veehou
         self.loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
-        self.http: BotHttp = BotHttp(timeout=timeout, is_sandbox=is_sandbox)
-        self.api: BotAPI = BotAPI(http=self.http)
+        self.http: BotHttp = BotHttp(
+            timeout=timeout,
+            is_sandbox=is_sandbox,
+            retry_policy=retry_policy,
+            pool=connection_pool,
+            coalesce_requests=coalesce_requests,
+            cache=response_cache,
+            max_concurrency=max_concurrency,
+            circuit_breaker=circuit_breaker,
+            hedge_policy=hedge_policy,
+            deadline_fallback=deadline_fallback,
+        )
+        self.api: BotAPI = BotAPI(http=self.http, media_cache=media_cache, response_models=response_models)
 
         self._connection: Optional[ConnectionSession] = None
         self._closed: bool = False
         self._listeners: Dict[str, List[Tuple[asyncio.Future, Callable[..., bool]]]] = {}
         self._ws_ap: Dict = {}
+        # shard_id -> 当前的 websocket 连接
+        self._websockets: Dict[int, BotWebSocket] = {}
+        if gateway_compress not in COMPRESSIONS:
+            raise ValueError("不支持的网关压缩方式: %s" % gateway_compress)
+        self.gateway_compress = gateway_compress
+        self.gateway_stats = GatewayStats()
 
         logging.configure_logging(
             config=log_config,
@@ -90,6 +137,22 @@ class Client:
     def robot(self):
         return self._connection.state.robot
 
+    @property
+    def metrics(self) -> Metrics:
+        """按路由模板统计的 HTTP 请求指标，可以导出为 dict 或 Prometheus 文本格式"""
+        return self.http.metrics
+
+    @property
+    def latencies(self) -> Dict[int, Optional[float]]:
+        """各分片最近一次心跳从发送到收到 ACK 的耗时(秒)，还没有收到 ACK 的分片为 None"""
+        return {shard_id: ws.latency for shard_id, ws in sorted(self._websockets.items())}
+
+    @property
+    def latency(self) -> Optional[float]:
+        """所有分片心跳耗时的平均值(秒)，还没有收到任何 ACK 时为 None"""
+        latencies = [latency for latency in self.latencies.values() if latency is not None]
+        return sum(latencies) / len(latencies) if latencies else None
+
     async def close(self) -> None:
         """关闭client相关的连接"""
 
@@ -188,7 +251,7 @@ class Client:
         session_interval = round(5 / concurrency)
 
         # 根据限制建立分片的并发链接数
-        _log.debug(f'[botpy] 会话间隔: {session_interval}, 分片: {self._ws_ap["shards"]}, 事件代码: {self.intents}')
+        _log.debug("[botpy] 会话间隔: %s, 分片: %s, 事件代码: %s", session_interval, self._ws_ap["shards"], self.intents)
         return await self._pool_init(token.bot_token(), session_interval)
 
     async def _pool_init(self, token, session_interval):
@@ -241,7 +304,11 @@ class Client:
         """
         _log.info("[botpy] 会话启动中...")
 
-        client = BotWebSocket(session, self._connection)
+        # websocket 与 OpenAPI 请求、获取 token 共用同一个连接池
+        client = BotWebSocket(
+            session, self._connection, pool=self.http.pool, compress=self.gateway_compress, stats=self.gateway_stats
+        )
+        self._websockets[session["shards"]["shard_id"]] = client
         try:
             await client.ws_connect()
         except (Exception, KeyboardInterrupt, SystemExit) as e:
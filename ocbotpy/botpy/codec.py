@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+JSON 编解码
+
+HTTP 请求/响应、websocket 网关消息和事件模型统一通过这里编解码。
+安装了 orjson 或 ujson 时优先使用(``pip install qq-botpy[speedups]``)，否则回退到标准库 json。
+``dumps`` 直接返回 utf-8 编码的 bytes，可以作为请求体发送而不需要构造中间的 str；
+``loads`` 同时接受 bytes 和 str。
+请求体通过 ``dumps_payload`` 编码，其中的 :class:`Fragment` 字段会直接拼接预先编码好的 bytes。
+"""
+
+import json
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+# 各个实现抛出的解码异常都是 ValueError 的子类
+DecodeError = ValueError
+
+_std_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _std_dumps(obj: Any) -> bytes:
+    return _std_encoder.encode(obj).encode("utf-8")
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson 不支持的类型(如超过64位的整数)交给标准库处理
+            return _std_dumps(obj)
+
+    loads = orjson.loads
+
+elif ujson is not None:
+    BACKEND = "ujson"
+
+    def dumps(obj: Any) -> bytes:
+        try:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+        except (TypeError, OverflowError):
+            return _std_dumps(obj)
+
+    loads = ujson.loads
+
+else:
+    BACKEND = "json"
+    dumps = _std_dumps
+    loads = json.loads
+
+
+def dumps_str(obj: Any) -> str:
+    """编码为 str，用于只能发送文本帧的场景"""
+    return dumps(obj).decode("utf-8")
+
+
+class Fragment:
+    """
+    预先编码好的 JSON 片段
+
+    键盘、ark、markdown 模版等每次发送都相同的内容可以只编码一次，
+    作为请求参数传入后会把编码好的 bytes 直接拼接到请求体中::
+
+        KEYBOARD = codec.Fragment({"id": "101_keyboard"})
+        await api.post_group_message(group_openid, msg_type=2, markdown=markdown, keyboard=KEYBOARD)
+
+    只在请求体的第一层字段中生效，创建后请勿修改 value。
+
+    Args:
+      value: 要编码的内容
+    """
+
+    __slots__ = ("value", "data")
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.data = dumps(value)
+
+    def __repr__(self) -> str:
+        return "<Fragment %s>" % self.data.decode("utf-8", "replace")
+
+
+def compact(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉值为 None 的字段，用于由 ``locals()`` 构造的请求体(同时去掉其中的 self)"""
+    return {k: v for k, v in payload.items() if v is not None and k != "self"}
+
+
+def dumps_payload(payload: Dict[str, Any]) -> bytes:
+    """编码请求体，其中的 :class:`Fragment` 字段直接拼接预先编码好的 bytes"""
+    for value in payload.values():
+        if value.__class__ is Fragment:
+            break
+    else:
+        return dumps(payload)
+    rest = {}
+    parts = []
+    for k, v in payload.items():
+        if v.__class__ is Fragment:
+            parts.append(dumps(k) + b":" + v.data)
+        else:
+            rest[k] = v
+    body = dumps(rest)
+    if len(body) > 2:
+        parts.insert(0, body[1:-1])
+    return b"{" + b",".join(parts) + b"}"
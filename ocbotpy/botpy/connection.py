@@ -57,7 +57,7 @@ class ConnectionSession:
         while len(session_list) > 0:
             _log.debug("[botpy] 会话列表循环运行")
             time_interval = session_interval * (index + 1)
-            _log.info("[botpy] 最大并发连接数: %s, 启动会话数: %s" % (self._max_async, len(session_list)))
+            _log.info("[botpy] 最大并发连接数: %s, 启动会话数: %s", self._max_async, len(session_list))
             for i in range(self._max_async):
                 if len(session_list) == 0:
                     break
@@ -90,6 +90,20 @@ class ConnectionState:
         self._dispatch = dispatch
         self.api = api
 
+    def _invalidate(self, template: str = None, **parameters: Any) -> None:
+        """实体变更事件到达时失效对应的接口缓存"""
+        cache = self.api.cache if self.api is not None else None
+        if cache is not None:
+            cache.invalidate(template, **parameters)
+
+    def _invalidate_member(self, member: Member) -> None:
+        user_id = member.user.id
+        if user_id is None:
+            return
+        self._invalidate("GET /guilds/{guild_id}/members/{user_id}", guild_id=member.guild_id, user_id=user_id)
+        # 成员的身份组变化会影响其在子频道中的权限
+        self._invalidate("GET /channels/{channel_id}/members/{user_id}/permissions", user_id=user_id)
+
     def parse_ready(self, payload):
         self._dispatch("ready")
 
@@ -103,22 +117,29 @@ class ConnectionState:
 
     def parse_guild_update(self, payload):
         _guild = Guild(self.api, payload.get('id', None), payload.get('d', {}))
+        self._invalidate("GET /guilds/{guild_id}", guild_id=_guild.id)
         self._dispatch("guild_update", _guild)
 
     def parse_guild_delete(self, payload):
         _guild = Guild(self.api, payload.get('id', None), payload.get('d', {}))
+        self._invalidate(guild_id=_guild.id)
         self._dispatch("guild_delete", _guild)
 
     def parse_channel_create(self, payload):
         _channel = Channel(self.api, payload.get('id', None), payload.get('d', {}))
+        self._invalidate("GET /guilds/{guild_id}/channels", guild_id=_channel.guild_id)
         self._dispatch("channel_create", _channel)
 
     def parse_channel_update(self, payload):
         _channel = Channel(self.api, payload.get('id', None), payload.get('d', {}))
+        self._invalidate(channel_id=_channel.id)
+        self._invalidate("GET /guilds/{guild_id}/channels", guild_id=_channel.guild_id)
         self._dispatch("channel_update", _channel)
 
     def parse_channel_delete(self, payload):
         _channel = Channel(self.api, payload.get('id', None), payload.get('d', {}))
+        self._invalidate(channel_id=_channel.id)
+        self._invalidate("GET /guilds/{guild_id}/channels", guild_id=_channel.guild_id)
         self._dispatch("channel_delete", _channel)
 
     # botpy.flags.Intents.guild_members
@@ -128,10 +149,12 @@ class ConnectionState:
 
     def parse_guild_member_update(self, payload):
         _member = Member(self.api, payload.get('id', None), payload.get('d', {}))
+        self._invalidate_member(_member)
         self._dispatch("guild_member_update", _member)
 
     def parse_guild_member_remove(self, payload):
         _member = Member(self.api, payload.get('id', None), payload.get('d', {}))
+        self._invalidate_member(_member)
         self._dispatch("guild_member_remove", _member)
 
     # botpy.flags.Intents.guild_messages
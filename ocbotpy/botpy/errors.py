@@ -49,6 +49,40 @@ class ForbiddenError(RuntimeError):
         return self.msgs
 
 
+class CircuitOpenError(RuntimeError):
+    """接口熔断中，请求没有发出"""
+
+    def __init__(self, msg, retry_after: float = 0.0):
+        self.msgs = msg
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return self.msgs
+
+
+class DeadlineExceededError(RuntimeError):
+    """请求已超过截止时间(如被动回复超过有效期)，请求没有发出"""
+
+    def __init__(self, msg, deadline: float = None):
+        self.msgs = msg
+        self.deadline = deadline
+
+    def __str__(self):
+        return self.msgs
+
+
+class RequestFailedError(RuntimeError):
+    """请求超时或连接异常，且重试次数已用完或不能安全重试，请求可能已经到达服务端"""
+
+    def __init__(self, msg, url: str = None, retries: int = 0):
+        self.msgs = msg
+        self.url = url
+        self.retries = retries
+
+    def __str__(self):
+        return self.msgs
+
+
 HttpErrorDict = {
     401: AuthenticationFailedError,
     404: NotFoundError,
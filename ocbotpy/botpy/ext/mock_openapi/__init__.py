@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟的 OpenAPI 服务端(api.sgroup.qq.com 与 bots.qq.com)
+
+用于在没有机器人账号、不访问真实服务的情况下测试和压测 BotHttp/BotAPI::
+
+    async with MockOpenAPI(latency=0.02, rate_limit_ratio=0.01) as server:
+        http = BotHttp(timeout=5, app_id="mock", secret="mock")
+        api = BotAPI(http)
+        await api.post_group_message("group", content="hello", msg_id="m")
+        print(server.counts)
+
+启动后会把 Route 和 Token 的请求地址指向本地服务，关闭时恢复。
+"""
+
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+from botpy import codec
+from botpy.http import Route
+from botpy.robot import Token
+
+
+class MockOpenAPI:
+    """
+    本地模拟的 OpenAPI 服务端
+
+    Args:
+      latency (float): 每个请求的基础延迟(秒)。. Defaults to 0
+      jitter (float): 延迟的随机波动范围(秒)，实际延迟为 latency ± jitter。. Defaults to 0
+      rate_limit_ratio (float): 返回 429 的请求比例。. Defaults to 0
+      error_ratio (float): 返回 503 的请求比例。. Defaults to 0
+      retry_after (float): 429 返回的 Retry-After(秒)。. Defaults to 0.01
+      member_count (int): 模拟频道的成员数，用于成员列表分页。. Defaults to 1000
+      seed (int): 随机数种子，便于复现
+      host (str): 监听地址。. Defaults to 127.0.0.1
+      port (int): 监听端口，为 0 时随机分配。. Defaults to 0
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit_ratio: float = 0.0,
+        error_ratio: float = 0.0,
+        retry_after: float = 0.01,
+        member_count: int = 1000,
+        seed: int = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.retry_after = retry_after
+        self.member_count = member_count
+        self.host = host
+        self.port = port
+        # "请求方式 路径" -> 请求次数
+        self.counts: Counter = Counter()
+        # 返回码 -> 次数
+        self.statuses: Counter = Counter()
+        # 收到的请求体字节数
+        self.received_bytes = 0
+
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self._patched: Optional[Dict[str, Any]] = None
+
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_post("/app/getAppAccessToken", self._token)
+        self.app.router.add_get("/users/@me", self._me)
+        self.app.router.add_get("/gateway/bot", self._gateway)
+        self.app.router.add_get("/guilds/{guild_id}/members", self._members)
+        for path in (
+            "/channels/{channel_id}/messages",
+            "/dms/{guild_id}/messages",
+            "/v2/groups/{group_openid}/messages",
+            "/v2/users/{openid}/messages",
+        ):
+            self.app.router.add_post(path, self._message)
+        self.app.router.add_post("/v2/groups/{group_openid}/files", self._file)
+        self.app.router.add_post("/v2/users/{openid}/files", self._file)
+        self.app.router.add_route("*", "/{tail:.*}", self._default)
+
+    @property
+    def url(self) -> str:
+        return "http://%s:%s" % (self.host, self.port)
+
+    async def start(self, install: bool = True) -> "MockOpenAPI":
+        """启动服务，install 为 True 时把 botpy 的请求地址指向本服务"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        if install:
+            self.install()
+        return self
+
+    async def close(self) -> None:
+        self.uninstall()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "MockOpenAPI":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def install(self) -> None:
+        """把 Route 和 Token 的请求地址指向本服务"""
+        if self._patched is None:
+            self._patched = {
+                "SCHEME": Route.SCHEME,
+                "DOMAIN": Route.DOMAIN,
+                "SANDBOX_DOMAIN": Route.SANDBOX_DOMAIN,
+                "TOKEN_URL": Token.TOKEN_URL,
+            }
+        domain = "%s:%s" % (self.host, self.port)
+        Route.SCHEME = "http"
+        Route.DOMAIN = domain
+        Route.SANDBOX_DOMAIN = domain
+        Token.TOKEN_URL = self.url + "/app/getAppAccessToken"
+
+    def uninstall(self) -> None:
+        if self._patched is None:
+            return
+        Route.SCHEME = self._patched["SCHEME"]
+        Route.DOMAIN = self._patched["DOMAIN"]
+        Route.SANDBOX_DOMAIN = self._patched["SANDBOX_DOMAIN"]
+        Token.TOKEN_URL = self._patched["TOKEN_URL"]
+        self._patched = None
+
+    def _json(self, data: Any, status: int = 200, headers: Dict[str, str] = None) -> web.Response:
+        self.statuses[status] += 1
+        return web.Response(body=codec.dumps(data), status=status, headers=headers, content_type="application/json")
+
+    async def _simulate(self, request: web.Request) -> Optional[web.Response]:
+        """统计请求、模拟延迟和注入异常，返回不为空时直接作为响应"""
+        self.counts["%s %s" % (request.method, request.match_info.route.resource.canonical)] += 1
+        delay = self.latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.rate_limit_ratio and self._random.random() < self.rate_limit_ratio:
+            return self._json(
+                {"code": 22009, "message": "msg limit exceed"}, 429, {"Retry-After": str(self.retry_after)}
+            )
+        if self.error_ratio and self._random.random() < self.error_ratio:
+            return self._json({"code": 500, "message": "mock server error"}, 503)
+        return None
+
+    async def _read_body(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type.startswith("multipart/"):
+            fields = {}
+            async for part in await request.multipart():
+                data = await part.read()
+                self.received_bytes += len(data)
+                fields[part.name] = data if part.name == "file_image" else data.decode("utf-8")
+            return fields
+        body = await request.read()
+        self.received_bytes += len(body)
+        return codec.loads(body) if body else {}
+
+    async def _token(self, request: web.Request) -> web.Response:
+        body = await self._read_body(request)
+        if not body.get("appId") or not body.get("clientSecret"):
+            return self._json({"code": 100016, "message": "invalid appid or secret"})
+        return self._json({"access_token": "mock-token-%s" % next(self._ids), "expires_in": "7200"})
+
+    async def _me(self, request: web.Request) -> web.Response:
+        return await self._simulate(request) or self._json({"id": "10000", "username": "mock-bot", "bot": True})
+
+    async def _gateway(self, request: web.Request) -> web.Response:
+        return await self._simulate(request) or self._json(
+            {
+                "url": "ws://%s:%s/websocket" % (self.host, self.port),
+                "shards": 1,
+                "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1},
+            }
+        )
+
+    async def _members(self, request: web.Request) -> web.Response:
+        response = await self._simulate(request)
+        if response is not None:
+            return response
+        after = int(request.query.get("after", "0"))
+        limit = int(request.query.get("limit", "1"))
+        ids = range(after + 1, min(after + limit, self.member_count) + 1)
+        return self._json([{"user": {"id": str(i), "username": "user%s" % i}, "roles": ["1"]} for i in ids])
+
+    async def _message(self, request: web.Request) -> web.Response:
+        response = await self._simulate(request)
+        if response is not None:
+            return response
+        await self._read_body(request)
+        return self._json({"id": "mock-%s" % next(self._ids), "timestamp": int(time.time())})
+
+    async def _file(self, request: web.Request) -> web.Response:
+        response = await self._simulate(request)
+        if response is not None:
+            return response
+        await self._read_body(request)
+        file_id = next(self._ids)
+        return self._json({"file_uuid": "uuid-%s" % file_id, "file_info": "info-%s" % file_id, "ttl": 3600})
+
+    async def _default(self, request: web.Request) -> web.Response:
+        response = await self._simulate(request)
+        if response is not None:
+            return response
+        await self._read_body(request)
+        return self._json({})
@@ -1,6 +1,5 @@
-from json import loads
-
 from .api import BotAPI
+from .codec import loads
 from .types import forum
 
 
@@ -1,19 +1,80 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import json
+import time
 import traceback
-from typing import Optional
+import zlib
+from typing import TYPE_CHECKING, Optional
 
 from aiohttp import WSMessage, ClientWebSocketResponse, TCPConnector, ClientSession, WSMsgType
 from ssl import SSLContext
+from yarl import URL
 
-from . import logging
+from . import codec, logging
 from .connection import ConnectionSession
 from .types import gateway
 from .types.session import Session
 
+if TYPE_CHECKING:  # pragma: no cover
+    from .http import ConnectionPool
+
 _log = logging.get_logger()
 
+# 网关压缩方式：zlib-stream 为整个连接共用一个 zlib 上下文的二进制帧，deflate 为 permessage-deflate 扩展
+COMPRESS_ZLIB_STREAM = "zlib-stream"
+COMPRESS_DEFLATE = "deflate"
+COMPRESSIONS = (None, COMPRESS_ZLIB_STREAM, COMPRESS_DEFLATE)
+
+
+class GatewayStats:
+    """
+    网关收到的消息数与压缩节省的字节数，多个分片和断线重连共用同一个统计
+
+    字节数只在 zlib-stream 下统计：permessage-deflate 在 aiohttp 内部解压，拿不到压缩前的大小。
+    """
+
+    __slots__ = ("messages", "wire_bytes", "payload_bytes")
+
+    def __init__(self):
+        self.messages = 0
+        # 收到的压缩数据字节数
+        self.wire_bytes = 0
+        # 解压后的 JSON 字节数
+        self.payload_bytes = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.payload_bytes - self.wire_bytes
+
+    def as_dict(self):
+        return {
+            "messages": self.messages,
+            "wire_bytes": self.wire_bytes,
+            "payload_bytes": self.payload_bytes,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+class _ZlibStream:
+    """zlib-stream 的流式解压，整个连接复用同一个解压上下文"""
+
+    SUFFIX = b"\x00\x00\xff\xff"
+
+    def __init__(self):
+        self._inflator = zlib.decompressobj()
+        # 一条消息被拆成多个帧时暂存前面的帧
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> Optional[bytes]:
+        """输入一个二进制帧，收到完整的消息时返回解压后的内容，否则返回 None"""
+        if not data.endswith(self.SUFFIX):
+            self._buffer += data
+            return None
+        if self._buffer:
+            self._buffer += data
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        return self._inflator.decompress(data)
+
 
 class BotWebSocket:
     """Bot的Websocket实现
@@ -38,22 +99,56 @@ class BotWebSocket:
     WS_HELLO = 10
     WS_HEARTBEAT_ACK = 11
 
-    def __init__(self, session: Session, _connection: ConnectionSession):
+    # HELLO 中没有下发 heartbeat_interval 时使用的心跳间隔(秒)
+    DEFAULT_HEARTBEAT_INTERVAL = 30.0
+    # 发送心跳后等待 ACK 的时间(秒)，超时记为一次丢失，并提前发送下一次心跳
+    HEARTBEAT_ACK_TIMEOUT = 10.0
+    # 连续丢失多少次 ACK 后认为连接已经失效，主动断开并重连
+    MAX_MISSED_ACKS = 2
+    # 主动断开时等待关闭握手的时间(秒)，失效的连接收不到对端的关闭帧
+    CLOSE_TIMEOUT = 5.0
+    # 心跳超时主动断开时使用的关闭码，不在无法重连的返回码中，断开后会 resume
+    HEARTBEAT_TIMEOUT_CLOSE_CODE = 4999
+
+    def __init__(
+        self,
+        session: Session,
+        _connection: ConnectionSession,
+        pool: "ConnectionPool" = None,
+        compress: str = None,
+        stats: GatewayStats = None,
+    ):
+        if compress not in COMPRESSIONS:
+            raise ValueError("不支持的网关压缩方式: %s" % compress)
         self._conn: Optional[ClientWebSocketResponse] = None
+        # 网关压缩方式，为空时不压缩
+        self.compress = compress
+        self.stats = stats if stats is not None else GatewayStats()
+        # 与 OpenAPI 请求共用的连接池，为空时每次连接创建独立的 ClientSession
+        self._pool = pool
         self._session = session
         self._connection = _connection
         self._parser = _connection.parser
         self._can_reconnect = True
         self._INVALID_RECONNECT_CODE = [9001, 9005]
         self._AUTH_FAIL_CODE = [4004]
+        # 心跳间隔(秒)，收到 HELLO 后按服务端下发的值更新
+        self.heartbeat_interval = self.DEFAULT_HEARTBEAT_INTERVAL
+        # 最近一次心跳从发送到收到 ACK 的耗时(秒)，还没有收到 ACK 时为 None
+        self.latency: Optional[float] = None
+        # 连续没有收到 ACK 的心跳次数
+        self.missed_acks = 0
+        self._heartbeat_sent: Optional[float] = None
+        self._heartbeat_acked = asyncio.Event()
+        self._heartbeat_task: Optional[asyncio.Task] = None
 
     async def on_error(self, exception: BaseException):
-        _log.error("[botpy] websocket连接: %s, 异常信息 : %s" % (self._conn, exception))
+        _log.error("[botpy] websocket连接: %s, 异常信息 : %s", self._conn, exception)
         traceback.print_exc()
         self._connection.add(self._session)
 
     async def on_closed(self, close_status_code, close_msg):
-        _log.info("[botpy] 关闭, 返回码: %s" % close_status_code + ", 返回信息: %s" % close_msg)
+        _log.info("[botpy] 关闭, 返回码: %s, 返回信息: %s", close_status_code, close_msg)
         if close_status_code in self._AUTH_FAIL_CODE:
             _log.info("[botpy] 鉴权失败，重置token...")
             self._session["token"].access_token = None
@@ -66,8 +161,9 @@ class BotWebSocket:
         self._connection.add(self._session)
 
     async def on_message(self, ws, message):
-        _log.debug("[botpy] 接收消息: %s" % message)
-        msg = json.loads(message)
+        if logging.payload_enabled(_log):
+            _log.debug("[botpy] 接收消息: %s", logging.Payload(message))
+        msg = codec.loads(message)
 
         if await self._is_system_event(msg, ws):
             return
@@ -80,13 +176,13 @@ class BotWebSocket:
 
         if event == "READY":
             # 心跳检查
-            self._connection.loop.create_task(self._send_heart(interval=30))
+            self._start_heartbeat()
             ready = await self._ready_handler(msg)
-            _log.info(f"[botpy] 机器人「{ready['user']['username']}」启动成功！")
+            _log.info("[botpy] 机器人「%s」启动成功！", ready["user"]["username"])
 
         if event == "RESUMED":
             # 心跳检查
-            self._connection.loop.create_task(self._send_heart(interval=30))
+            self._start_heartbeat()
             _log.info("[botpy] 机器人重连成功! ")
 
         if event and opcode == self.WS_DISPATCH_EVENT:
@@ -117,22 +213,65 @@ class BotWebSocket:
         if not ws_url:
             raise Exception("[botpy] 会话url为空")
 
+        if self._pool is not None:
+            if self._pool.shut_down:
+                # Client 已经关闭，不再重连
+                _log.info("[botpy] 连接池已关闭, 停止连接")
+                return
+            # 共用连接池的会话由 Client 关闭，重连时只新建 websocket 连接
+            await self._receive(self._pool.session())
+            return
         # adding SSLContext-containing connector to prevent SSL certificate verify failed error
         async with ClientSession(connector=TCPConnector(limit=10, ssl=SSLContext())) as session:
-            async with session.ws_connect(self._session["url"]) as ws_conn:
+            await self._receive(session)
+
+    async def _receive(self, session: ClientSession):
+        url = self._session["url"]
+        kwargs = {}
+        stream = None
+        if self.compress == COMPRESS_ZLIB_STREAM:
+            url = URL(url).update_query(compress=COMPRESS_ZLIB_STREAM)
+            stream = _ZlibStream()
+        elif self.compress == COMPRESS_DEFLATE:
+            kwargs["compress"] = 15
+        stats = self.stats
+        try:
+            async with session.ws_connect(url, **kwargs) as ws_conn:
+                # 是否已经把 session 交还给 ConnectionSession 重连
+                handed_over = False
                 while True:
                     msg: WSMessage
                     msg = await ws_conn.receive()
                     if msg.type == WSMsgType.TEXT:
+                        stats.messages += 1
                         await self.on_message(ws_conn, msg.data)
+                    elif msg.type == WSMsgType.BINARY and stream is not None:
+                        stats.wire_bytes += len(msg.data)
+                        data = stream.feed(msg.data)
+                        if data is not None:
+                            stats.messages += 1
+                            stats.payload_bytes += len(data)
+                            await self.on_message(ws_conn, data)
                     elif msg.type == WSMsgType.ERROR:
                         await self.on_error(ws_conn.exception())
+                        handed_over = True
                         await ws_conn.close()
                     elif msg.type == WSMsgType.CLOSED or msg.type == WSMsgType.CLOSE:
                         await self.on_closed(ws_conn.close_code, msg.extra)
-                    if ws_conn.closed:
+                        handed_over = True
+                    # CLOSING 表示连接正在由本端(心跳超时)关闭
+                    if ws_conn.closed or msg.type == WSMsgType.CLOSING:
+                        if not handed_over:
+                            if self.missed_acks >= self.MAX_MISSED_ACKS:
+                                await self.on_closed(self.HEARTBEAT_TIMEOUT_CLOSE_CODE, "heartbeat ack timeout")
+                            else:
+                                await self.on_closed(ws_conn.close_code, None)
                         _log.info("[botpy] ws关闭, 停止接收消息!")
                         break
+        finally:
+            if self._heartbeat_task is not None:
+                self._heartbeat_task.cancel()
+                self._heartbeat_task = None
 
     async def ws_identify(self):
         """websocket鉴权"""
@@ -153,7 +292,7 @@ class BotWebSocket:
             },
         }
 
-        await self.send_msg(json.dumps(payload))
+        await self.send_msg(codec.dumps_str(payload))
 
     async def send_msg(self, event_json):
         """
@@ -161,10 +300,11 @@ class BotWebSocket:
         :param event_json:
         """
         send_msg = event_json
-        _log.debug("[botpy] 发送消息: %s" % send_msg)
+        if logging.payload_enabled(_log):
+            _log.debug("[botpy] 发送消息: %s", logging.Payload(send_msg))
         if isinstance(self._conn, ClientWebSocketResponse):
             if self._conn.closed:
-                _log.debug("[botpy] ws连接已关闭! ws对象: %s" % self._conn)
+                _log.debug("[botpy] ws连接已关闭! ws对象: %s", self._conn)
             else:
                 await self._conn.send_str(data=send_msg)
 
@@ -183,7 +323,7 @@ class BotWebSocket:
             },
         }
 
-        await self.send_msg(json.dumps(payload))
+        await self.send_msg(codec.dumps_str(payload))
 
     async def _ready_handler(self, message_event) -> gateway.ReadyEvent:
         data = message_event["d"]
@@ -203,9 +343,14 @@ class BotWebSocket:
         """
         event_op = message_event["op"]
         if event_op == self.WS_HELLO:
+            interval = (message_event.get("d") or {}).get("heartbeat_interval")
+            if interval:
+                # 服务端下发的心跳间隔单位为毫秒
+                self.heartbeat_interval = interval / 1000
             await self.on_connected(ws)
             return True
         if event_op == self.WS_HEARTBEAT_ACK:
+            self._on_heartbeat_ack()
             return True
         if event_op == self.WS_RECONNECT:
             self._can_reconnect = True
@@ -215,12 +360,26 @@ class BotWebSocket:
             return True
         return False
 
+    def _start_heartbeat(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        self._heartbeat_task = self._connection.loop.create_task(self._send_heart(self.heartbeat_interval))
+
+    def _on_heartbeat_ack(self):
+        if self._heartbeat_sent is None:
+            return
+        self.latency = time.monotonic() - self._heartbeat_sent
+        self._heartbeat_sent = None
+        self.missed_acks = 0
+        self._heartbeat_acked.set()
+        _log.debug("[botpy] 收到心跳ACK, 耗时: %.3fs", self.latency)
+
     async def _send_heart(self, interval):
         """
         心跳包
         :param interval: 间隔时间
         """
-        _log.info("[botpy] 心跳维持启动...")
+        _log.info("[botpy] 心跳维持启动, 间隔: %ss", interval)
         while True:
             payload = {
                 "op": self.WS_HEARTBEAT,
@@ -231,8 +390,34 @@ class BotWebSocket:
                 _log.debug("[botpy] 连接已关闭!")
                 return
             if self._conn.closed:
-                _log.debug("[botpy] ws连接已关闭, 心跳检测停止，ws对象: %s" % self._conn)
+                _log.debug("[botpy] ws连接已关闭, 心跳检测停止，ws对象: %s", self._conn)
                 return
 
-            await self.send_msg(json.dumps(payload))
-            await asyncio.sleep(interval)
+            self._heartbeat_acked.clear()
+            self._heartbeat_sent = sent = time.monotonic()
+            await self.send_msg(codec.dumps_str(payload))
+            timeout = min(self.HEARTBEAT_ACK_TIMEOUT, interval)
+            try:
+                await asyncio.wait_for(self._heartbeat_acked.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.missed_acks += 1
+                _log.warning("[botpy] 心跳超过 %ss 没有收到ACK, 连续丢失: %s", timeout, self.missed_acks)
+                if self.missed_acks >= self.MAX_MISSED_ACKS:
+                    await self._close_dead_connection()
+                    return
+                # 丢失 ACK 后立即再次发送心跳确认连接状态
+                continue
+            # 心跳间隔从发送时开始计算
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - sent)))
+
+    async def _close_dead_connection(self):
+        """连续丢失 ACK 时主动关闭连接，接收循环随后交给 ConnectionSession 重连"""
+        _log.warning("[botpy] 连续 %s 次心跳没有收到ACK, 连接可能已经失效, 断开重连...", self.missed_acks)
+        try:
+            await asyncio.wait_for(
+                self._conn.close(code=self.HEARTBEAT_TIMEOUT_CLOSE_CODE, message=b"heartbeat ack timeout"),
+                self.CLOSE_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            # 超时后 aiohttp 会直接关闭底层连接
+            _log.debug("[botpy] 等待关闭握手超时, 已直接关闭连接")
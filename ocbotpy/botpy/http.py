@@ -1,14 +1,26 @@
 # -*- coding: utf-8 -*-
 import asyncio
-from json.decoder import JSONDecodeError
-from ssl import SSLContext
-from typing import Any, Optional, ClassVar, Union, Dict
+import binascii
+import heapq
+import itertools
+import os
+import random
+import ssl
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from string import Formatter
+from typing import Any, Awaitable, Callable, Optional, ClassVar, Union, Deque, Dict, Tuple, FrozenSet, Iterable
 
 import aiohttp
-from aiohttp import ClientResponse, FormData, TCPConnector, multipart, hdrs, payload
+from aiohttp import ClientResponse, FormData, TCPConnector, hdrs
+from aiohttp.payload import Payload
 
-from . import logging
-from .errors import HttpErrorDict, ServerError
+from . import codec, logging
+from .cache import ResponseCache
+from .errors import CircuitOpenError, DeadlineExceededError, HttpErrorDict, RequestFailedError, ServerError
+from .metrics import Metrics, RouteMetrics
 from .robot import Token
 from .types import robot
 
@@ -19,64 +31,327 @@ _log = logging.get_logger()
 # 请求成功的返回码
 HTTP_OK_STATUS = [200, 202, 204]
 
+# 限频相关的返回码和响应头
+HTTP_TOO_MANY_REQUESTS = 429
+RATE_LIMIT_LIMIT = "X-RateLimit-Limit"
+RATE_LIMIT_REMAINING = "X-RateLimit-Remaining"
+RATE_LIMIT_RESET_AFTER = "X-RateLimit-Reset-After"
+RATE_LIMIT_GLOBAL = "X-RateLimit-Global"
+RETRY_AFTER = "Retry-After"
 
-class _FormData(FormData):
-    def _gen_form_data(self) -> multipart.MultipartWriter:
-        """Encode a list of fields using the multipart/form-data MIME format"""
-        if self._is_processed:
-            return self._writer  # rewrite this part of FormData object to enable retry of request
-        for dispparams, headers, value in self._fields:
+# 服务端异常时可以重试的返回码
+RETRYABLE_STATUS = (500, 502, 503, 504)
+
+# 携带相同 msg_id + msg_seq 重发时服务端会去重的消息接口，这类POST可以安全重试
+SEQ_IDEMPOTENT_ROUTES = frozenset(
+    {
+        "POST /v2/groups/{group_openid}/messages",
+        "POST /v2/users/{openid}/messages",
+    }
+)
+
+# 请求优先级，数值越小越先发送
+PRIORITY_INTERACTIVE = 0  # 被动回复等需要及时送达的请求
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2  # 批量同步、公告、成员遍历等后台任务
+
+# 携带 msg_id/event_id 时属于被动回复的消息接口，默认使用 PRIORITY_INTERACTIVE
+REPLY_ROUTES = frozenset(
+    {
+        "POST /channels/{channel_id}/messages",
+        "POST /dms/{guild_id}/messages",
+        "POST /v2/groups/{group_openid}/messages",
+        "POST /v2/users/{openid}/messages",
+    }
+)
+
+_request_priority: ContextVar = ContextVar("botpy_request_priority", default=None)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """为代码块内(包括其中创建的 task)发起的请求指定优先级
+
+    用法::
+
+        with request_priority(PRIORITY_BACKGROUND):
+            async for member in api.iter_guild_members(guild_id):
+                ...
+    """
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+# 被动回复的有效期(秒)，超过后服务端会拒绝携带 msg_id/event_id 的回复
+PASSIVE_REPLY_WINDOW = 300
+
+_request_deadline: ContextVar = ContextVar("botpy_request_deadline", default=None)
+
+# deadline_fallback(http, route, kwargs): 请求超过截止时间后代替原请求执行，返回值作为请求结果
+DeadlineFallback = Callable[["BotHttp", "Route", Dict[str, Any]], Awaitable[Any]]
+
+
+@contextmanager
+def request_deadline(deadline: Optional[float]):
+    """为代码块内发起的请求指定截止时间(time.time() 的时间戳)，为 None 时取消截止时间
+
+    用法::
+
+        with request_deadline(message.deadline):
+            await api.post_group_message(...)
+    """
+    token = _request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+async def send_as_active(http: "BotHttp", route: "Route", kwargs: Dict[str, Any]):
+    """
+    deadline_fallback 的一种实现：被动回复超过截止时间后，去掉 msg_id/event_id/msg_seq 改为发送主动消息
+
+    主动消息会占用主动消息的额度；不是消息接口的请求仍然抛出 DeadlineExceededError。
+    """
+    payload = kwargs.get("json")
+    if route.template.key not in REPLY_ROUTES or not isinstance(payload, dict):
+        raise DeadlineExceededError("[botpy] 请求超过截止时间，不再发送: %s" % route.url)
+    kwargs = dict(kwargs)
+    kwargs["json"] = {k: v for k, v in payload.items() if k not in ("msg_id", "event_id", "msg_seq")}
+    _log.info("[botpy] 被动回复已过期，改为发送主动消息: %s", route.url)
+    with request_deadline(None):
+        return await http.request(route, priority=PRIORITY_NORMAL, **kwargs)
+
+
+# 上传文件时每次读取的块大小
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# base64 编码时每块的原始字节数，是 3 的倍数，编码后为 64KiB
+BASE64_CHUNK_SIZE = 48 * 1024
+
+# 决定限频桶归属的路由参数，同一个接口在不同群/子频道下的额度相互独立
+MAJOR_PARAMETERS = ("guild_id", "channel_id", "group_openid", "openid")
+
+
+class _UploadReadError(Exception):
+    """发送过程中读取本地上传内容失败
+
+    aiohttp 会把写请求体时的异常包装为 ClientOSError 等连接异常，用这个类型把本地的 IO 错误与网络异常区分开。
+    """
+
+    def __init__(self, error: OSError):
+        super().__init__(error)
+        self.error = error
+
+
+def _upload_error(e: BaseException) -> Optional[OSError]:
+    """连接异常由读取本地上传内容失败引起时返回原始的 IO 错误"""
+    while e is not None:
+        if isinstance(e, _UploadReadError):
+            return e.error
+        e = e.__cause__
+    return None
+
+
+async def _read_file(file, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """在线程池中按块读取文件对象，避免阻塞事件循环"""
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            chunk = await loop.run_in_executor(None, file.read, chunk_size)
+        except OSError as e:
+            raise _UploadReadError(e) from e
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _read_path(path, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    loop = asyncio.get_event_loop()
+    try:
+        file = await loop.run_in_executor(None, open, path, "rb")
+    except OSError as e:
+        raise _UploadReadError(e) from e
+    try:
+        async for chunk in _read_file(file, chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+
+def _is_upload(value: Any) -> bool:
+    return isinstance(value, (bytes, bytearray, memoryview, str, os.PathLike)) or (
+        hasattr(value, "read") or hasattr(value, "__aiter__")
+    )
+
+
+class _Upload:
+    """multipart 请求中的文件字段
+
+    文件路径、文件对象和异步迭代器在发送时按块写入请求体(分块传输)，不会整个读入内存。
+    路径和可以 seek 的文件对象每次重试都从头重新读取；不可 seek 的文件对象和异步迭代器只能发送一次。
+    传入的文件对象不会被关闭。
+    路径在创建时先打开一次，文件不存在或没有权限时直接向调用方抛出 OSError，不会当作连接异常重试或计入熔断。
+    """
+
+    __slots__ = ("source", "position", "replayable")
+
+    def __init__(self, source: Any):
+        self.source = source
+        self.position = None
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb"):
+                pass
+            self.replayable = True
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self.replayable = True
+        elif hasattr(source, "read"):
             try:
-                if hdrs.CONTENT_TYPE in headers:
-                    part = payload.get_payload(
-                        value,
-                        content_type=headers[hdrs.CONTENT_TYPE],
-                        headers=headers,
-                        encoding=self._charset,
-                    )
-                else:
-                    part = payload.get_payload(
-                        value,
-                        headers=headers,
-                        encoding=self._charset,
-                    )
-            except Exception as exc:
-                print(value)
-                raise TypeError(
-                    "Can not serialize value type: %r\n " "headers: %r\n value: %r" % (type(value), headers, value)
-                ) from exc
-
-            if dispparams:
-                part.set_content_disposition(
-                    "form-data",
-                    quote_fields=self._quote_fields,
-                    **dispparams,
-                )
-                assert part.headers is not None
-                part.headers.popall(hdrs.CONTENT_LENGTH, None)
+                self.position = source.tell()
+            except (AttributeError, OSError):
+                pass
+            self.replayable = self.position is not None
+        else:
+            self.replayable = False
+
+    def payload(self) -> Any:
+        source = self.source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return source
+        if isinstance(source, (str, os.PathLike)):
+            return _read_path(source)
+        if hasattr(source, "read"):
+            if self.position is not None:
+                source.seek(self.position)
+            return _read_file(source)
+        return source
+
+
+def _as_buffer(value: Any) -> Optional[memoryview]:
+    """bytes、bytearray、memoryview、mmap 等支持缓冲区协议的对象返回按字节访问的 memoryview，不复制数据"""
+    if isinstance(value, str):
+        return None
+    try:
+        return memoryview(value).cast("B")
+    except TypeError:
+        return None
+
+
+def _is_media_data(value: Any) -> bool:
+    """file_data 是否为需要在发送时编码为 base64 的二进制内容(str 视为已经编码好的 base64)"""
+    if value is None or isinstance(value, str):
+        return False
+    return isinstance(value, os.PathLike) or hasattr(value, "read") or _as_buffer(value) is not None
+
+
+def _media_size(source: Any) -> Optional[int]:
+    """二进制内容的字节数，无法预先得知时返回 None"""
+    view = _as_buffer(source)
+    if view is not None:
+        return view.nbytes
+    if isinstance(source, os.PathLike):
+        return os.path.getsize(source)
+    try:
+        position = source.tell()
+        size = source.seek(0, os.SEEK_END) - position
+        source.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
 
-            self._writer.append_payload(part)
 
-        self._is_processed = True
-        return self._writer
+async def _b64encode_chunks(source: Any):
+    """按块将二进制内容编码为 base64，每块的长度都是 3 的倍数(最后一块除外)，拼接后与整体编码的结果一致"""
+    view = _as_buffer(source)
+    if view is not None:
+        for start in range(0, view.nbytes, BASE64_CHUNK_SIZE):
+            yield binascii.b2a_base64(view[start:start + BASE64_CHUNK_SIZE], newline=False)
+        return
+    rest = b""
+    async for chunk in source:
+        view = memoryview(chunk)
+        if rest:
+            # 补齐上一块剩下的不足 3 个字节
+            need = 3 - len(rest)
+            rest, view = rest + bytes(view[:need]), view[need:]
+            if len(rest) < 3:
+                continue
+            yield binascii.b2a_base64(rest, newline=False)
+        cut = len(view) - len(view) % 3
+        rest = bytes(view[cut:])
+        if cut:
+            yield binascii.b2a_base64(view[:cut], newline=False)
+    if rest:
+        yield binascii.b2a_base64(rest, newline=False)
+
+
+class _Base64Payload(Payload):
+    """
+    其中一个字段为二进制内容 base64 编码的 JSON 请求体
+
+    发送时按块编码并直接写入连接，不会生成完整的 base64 字符串和请求体；
+    请求体长度可以预先算出，仍然以 Content-Length 发送。
+    """
+
+    def __init__(self, head: bytes, upload: _Upload, size: Optional[int]):
+        super().__init__(upload.source, content_type="application/json")
+        # head 以 '"file_data":"' 结尾，之后依次写入 base64 内容和 '"}'
+        self._head = head
+        self._upload = upload
+        if size is not None:
+            self._size = len(head) + 4 * ((size + 2) // 3) + 2
+
+    async def write(self, writer) -> None:
+        await writer.write(self._head)
+        source = self._upload.source
+        # 内存中的内容(包括 mmap)直接按切片编码，文件和路径按块读取
+        if _as_buffer(source) is None:
+            source = self._upload.payload()
+        async for chunk in _b64encode_chunks(source):
+            await writer.write(chunk)
+        await writer.write(b'"}')
+
+    def decode(self, encoding: str = "utf-8", errors: str = "strict") -> str:
+        view = _as_buffer(self._upload.source)
+        if view is None:
+            raise TypeError("流式的请求体无法直接解码")
+        return (self._head + binascii.b2a_base64(view, newline=False) + b'"}').decode(encoding, errors)
+
+
+def _media_body(payload: Dict[str, Any], field: str) -> Tuple[bytes, _Upload, Optional[int]]:
+    """拆分出 JSON 请求体中 field 之前的部分，field 放在最后发送"""
+    rest = codec.dumps_payload({k: v for k, v in payload.items() if k != field})
+    head = rest[:-1] + (b"," if len(rest) > 2 else b"") + codec.dumps(field) + b':"'
+    source = payload[field]
+    return head, _Upload(source), _media_size(source)
 
 
 async def _handle_response(response: ClientResponse) -> Union[Dict[str, Any], str]:
     url = response.request_info.url
     try:
-        condition = response.headers["content-type"] == "application/json"
-        # note that when content-type is application/json, aiohttp will directly auto-sub encoding to be utf-8
-        data = await response.json() if condition else await response.text()
-    except (KeyError, JSONDecodeError):
+        body = await response.read()
+        if hdrs.CONTENT_TYPE not in response.headers:
+            data = None
+        elif response.content_type == "application/json":
+            data = codec.loads(body) if body else None
+        else:
+            data = body.decode(response.get_encoding())
+    except (codec.DecodeError, LookupError):
         data = None
     if response.status in HTTP_OK_STATUS:
-        _log.debug(f"[botpy] 请求成功, 请求连接: {url}, 返回内容: {data}, trace_id:{response.headers.get(X_TPS_TRACE_ID)}")
+        if logging.payload_enabled(_log):
+            _log.debug(
+                "[botpy] 请求成功, 请求连接: %s, 返回内容: %s, trace_id:%s",
+                url, logging.Payload(data), response.headers.get(X_TPS_TRACE_ID),
+            )
         return data
     else:
         _log.error(
-            f"[botpy] 接口请求异常，请求连接: {url}, "
-            f"错误代码: {response.status}, 返回内容: {data}, trace_id:{response.headers.get(X_TPS_TRACE_ID)}"
+            "[botpy] 接口请求异常，请求连接: %s, 错误代码: %s, 返回内容: %s, trace_id:%s",
             # trace_id 用于定位接口问题
+            url, response.status, logging.Payload(data), response.headers.get(X_TPS_TRACE_ID),
         )
         error_dict_get = HttpErrorDict.get(response.status)
         # type of data should be dict or str or None, so there should be a condition to check and prevent bug
@@ -86,60 +361,755 @@ async def _handle_response(response: ClientResponse) -> Union[Dict[str, Any], st
         raise error_dict_get(msg=message) from None
 
 
+class RouteTemplate:
+    """预编译的路由模板
+
+    每个 "请求方式 + 路径模板" 只解析一次，之后创建的 :class:`Route` 共用同一个模板对象，
+    绑定参数时只需按解析好的片段拼接字符串，``key`` 也可以作为路由的稳定标识用于限频和统计。
+    """
+
+    __slots__ = ("method", "path", "key", "major_parameters", "_literals", "_fields")
+
+    _templates: ClassVar[Dict[Tuple[str, str], "RouteTemplate"]] = {}
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.key = "{} {}".format(method, path)
+        self._literals = []
+        self._fields = []
+        for literal, field, _, _ in Formatter().parse(path):
+            self._literals.append(literal)
+            if field is not None:
+                self._fields.append(field)
+        self.major_parameters = tuple(k for k in MAJOR_PARAMETERS if k in self._fields)
+
+    @classmethod
+    def get(cls, method: str, path: str) -> "RouteTemplate":
+        template = cls._templates.get((method, path))
+        if template is None:
+            template = cls._templates[(method, path)] = cls(method, path)
+        return template
+
+    def bind(self, parameters: Dict[str, Any]) -> str:
+        """将参数填入路径模板"""
+        if not self._fields:
+            return self.path
+        parts = []
+        for literal, field in zip(self._literals, self._fields):
+            parts.append(literal)
+            parts.append(str(parameters[field]))
+        parts.extend(self._literals[len(self._fields) :])
+        return "".join(parts)
+
+    def bucket(self, parameters: Dict[str, Any]) -> str:
+        """限频桶的标识: 请求方式 + 路径模板 + 主要参数"""
+        major = ":".join(str(parameters[k]) for k in self.major_parameters if k in parameters)
+        return "{}:{}".format(self.key, major)
+
+
 class Route:
     DOMAIN: ClassVar[str] = "api.sgroup.qq.com"
     SANDBOX_DOMAIN: ClassVar[str] = "sandbox.api.sgroup.qq.com"
     SCHEME: ClassVar[str] = "https"
 
+    _base_urls: ClassVar[Dict[Tuple[str, str], str]] = {}
+
     def __init__(self, method: str, path: str, is_sandbox: str = False, **parameters: Any) -> None:
+        self.template: RouteTemplate = RouteTemplate.get(method, path)
         self.method: str = method
         self.path: str = path
         self.is_sandbox = is_sandbox
         self.parameters = parameters
+        self._path: Optional[str] = None
+        self._bucket: Optional[str] = None
+
+    @classmethod
+    def base_url(cls, is_sandbox: bool = False) -> str:
+        key = (cls.SCHEME, cls.SANDBOX_DOMAIN if is_sandbox else cls.DOMAIN)
+        base_url = cls._base_urls.get(key)
+        if base_url is None:
+            base_url = cls._base_urls[key] = "{}://{}".format(*key)
+        return base_url
+
+    @property
+    def bucket(self) -> str:
+        if self._bucket is None:
+            self._bucket = self.template.bucket(self.parameters)
+        return self._bucket
 
     @property
     def url(self):
-        if self.is_sandbox:
-            d = self.SANDBOX_DOMAIN
-        else:
-            d = self.DOMAIN
-        _url = "{}://{}{}".format(self.SCHEME, d, self.path)
+        # path的参数只需要绑定一次
+        if self._path is None:
+            self._path = self.template.bind(self.parameters)
+        return self.base_url(self.is_sandbox) + self._path
+
+
+def _header_float(headers, name: str) -> Optional[float]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class _Bucket:
+    """单个限频桶
+
+    同一个桶内的请求通过锁按先后顺序排队，桶内额度耗尽时持锁等待到窗口重置后再依次放行。
+    额度优先从响应头学习；服务端未下发限频头时，根据429前窗口内放行的请求数估算上限，
+    之后每个未触发429的窗口将上限加一，逐步逼近服务端的真实额度。
+    """
+
+    # 还没有学习到窗口时，最多记录的放行时间数
+    MAX_RECENT_SENDS: ClassVar[int] = 4096
+
+    def __init__(self, key: str, default_retry_after: float, max_retry_after: float):
+        self.key = key
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        # 当前窗口的重置时间和窗口长度(秒)，都为0表示尚未学习到
+        self.reset_at: float = 0.0
+        self.window: float = 0.0
+        self.last_used: float = time.monotonic()
+        self._default_retry_after = default_retry_after
+        self._max_retry_after = max_retry_after
+        # 连续429的次数，用于在没有Retry-After时逐步拉长等待
+        self._strikes = 0
+        # 当前窗口已放行的请求数
+        self._sent = 0
+        # 还没有学习到窗口时各请求的放行时间，第一次429时按 Retry-After 统计窗口内的请求数
+        self._recent: Deque[float] = deque(maxlen=self.MAX_RECENT_SENDS)
+        self._lock = asyncio.Lock()
+
+    @property
+    def waiting(self) -> bool:
+        return self._lock.locked()
+
+    @property
+    def available(self) -> bool:
+        """当前是否无需排队即可放行一个请求"""
+        if self.waiting:
+            return False
+        if not self.reset_at or self.remaining is None:
+            return True
+        return self.remaining > 0 or time.monotonic() >= self.reset_at
+
+    def _reset_window(self, now: float) -> None:
+        if self.limit is not None and self._strikes == 0 and self._sent >= self.limit:
+            # 上个窗口额度用满也没有触发429，说明上限还能再提高
+            self.limit += 1
+        self.remaining = self.limit
+        self._sent = 0
+        self.reset_at = now + self.window if self.limit is not None else 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.reset_at and now >= self.reset_at:
+                    self._reset_window(now)
+                if not self.reset_at or self.remaining is None or self.remaining > 0:
+                    break
+                await asyncio.sleep(self.reset_at - now)
+            if self.remaining is not None:
+                self.remaining -= 1
+            self._sent += 1
+            self.last_used = now = time.monotonic()
+            if not self.reset_at:
+                recent = self._recent
+                recent.append(now)
+                while recent[0] < now - self._max_retry_after:
+                    recent.popleft()
+
+    def update(self, status: int, headers) -> float:
+        """根据响应更新桶的额度
+
+        Returns:
+          触发429时需要等待的秒数，其余情况返回0
+        """
+        now = time.monotonic()
+        windowed = bool(self.reset_at)
+        limit = _header_float(headers, RATE_LIMIT_LIMIT)
+        remaining = _header_float(headers, RATE_LIMIT_REMAINING)
+        reset_after = _header_float(headers, RATE_LIMIT_RESET_AFTER)
+        if limit is not None:
+            self.limit = int(limit)
+        if remaining is not None:
+            self.remaining = int(remaining) if self.remaining is None else min(self.remaining, int(remaining))
+        if reset_after is not None:
+            self.reset_at = now + reset_after
+            self.window = max(self.window, reset_after)
+
+        if status != HTTP_TOO_MANY_REQUESTS:
+            self._strikes = 0
+            return 0.0
+
+        retry_after = _header_float(headers, RETRY_AFTER) or reset_after
+        if retry_after is None:
+            retry_after = min(self._default_retry_after * (2**self._strikes), self._max_retry_after)
+        if limit is None:
+            # 服务端没有告知额度，以本窗口触发429前放行的请求数作为新的上限
+            sent = self._sent if windowed else sum(1 for t in self._recent if t >= now - retry_after)
+            self.limit = max(1, sent - 1)
+            self._recent.clear()
+        if not self.window:
+            self.window = retry_after
+        self._strikes += 1
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, now + retry_after)
+        return retry_after
+
+
+class _RateLimiter:
+    """按 :attr:`Route.bucket` 划分的限频桶集合"""
+
+    # 桶数量超过该值时清理空闲的桶，避免群数量很多时无限增长
+    MAX_BUCKETS: ClassVar[int] = 4096
+    IDLE_SECONDS: ClassVar[int] = 300
+
+    def __init__(self, default_retry_after: float = 1.0, max_retry_after: float = 60.0):
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self._buckets: Dict[str, _Bucket] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def get_bucket(self, key: str) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                self._prune()
+            bucket = self._buckets[key] = _Bucket(key, self.default_retry_after, self.max_retry_after)
+        return bucket
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for key, bucket in list(self._buckets.items()):
+            if not bucket.waiting and bucket.reset_at <= now and now - bucket.last_used > self.IDLE_SECONDS:
+                del self._buckets[key]
+
+
+class _PriorityGate:
+    """按优先级放行请求的并发闸门
+
+    并发数达到 limit 后，后续请求排队，有空位时先放行优先级高的请求。
+    为了避免低优先级请求饿死，排队的请求按 (入队时间 + 优先级 * aging) 排序，
+    即低一级的请求最多比之后到达的高优先级请求多等待 aging 秒。
+    limit 为 0 时不限制并发。
+    """
+
+    def __init__(self, limit: int, aging: float = 2.0):
+        self.limit = limit
+        self.aging = aging
+        self._active = 0
+        self._waiters: list = []
+        self._counter = itertools.count()
+
+    def __call__(self, priority: int) -> "_PriorityGate._Slot":
+        return self._Slot(self, priority)
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int) -> None:
+        if not self.limit or (self._active < self.limit and not self._waiters):
+            self._active += 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (time.monotonic() + priority * self.aging, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已经分到空位但在恢复执行前被取消，需要把空位让出去
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # 空位直接转交给排队的请求
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    class _Slot:
+        __slots__ = ("gate", "priority")
 
-        # path的参数:
-        if self.parameters:
-            _url = _url.format_map(self.parameters)
-        return _url
+        def __init__(self, gate: "_PriorityGate", priority: int):
+            self.gate = gate
+            self.priority = priority
+
+        async def __aenter__(self) -> float:
+            await self.gate.acquire(self.priority)
+            # 返回拿到空位的时间，用于统计不含排队时间的请求耗时
+            return time.monotonic()
+
+        async def __aexit__(self, *exc_info):
+            self.gate.release()
+
+
+class RetryRule:
+    """单条重试规则，未设置的字段沿用 :class:`RetryPolicy` 的默认值
+
+    Args:
+      max_retries (int): 最大重试次数，0 表示不重试
+      base_delay (float): 第一次重试前的基础等待秒数，之后按指数增长
+      max_delay (float): 单次等待的上限秒数
+      idempotent (bool): 强制指定该规则下的请求是否可以安全重复发送
+    """
+
+    __slots__ = ("max_retries", "base_delay", "max_delay", "idempotent")
+
+    def __init__(
+        self,
+        max_retries: int = None,
+        base_delay: float = None,
+        max_delay: float = None,
+        idempotent: bool = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idempotent = idempotent
+
+
+class _RetryBudget:
+    """重试预算
+
+    每个新请求存入 ``ratio`` 个令牌，每次重试取出一个，另外每秒固定补充 ``min_per_second`` 个，
+    保证故障期间的重试量不会超过正常流量的固定比例，避免重试风暴拖垮服务端。
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, capacity: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._balance = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._balance = min(self.capacity, self._balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self) -> None:
+        self._refill()
+        self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+    @property
+    def balance(self) -> float:
+        self._refill()
+        return self._balance
+
+
+class RetryPolicy:
+    """OpenAPI 请求的重试策略
+
+    只对可以安全重复发送的请求做重试: GET 请求总是可以重试；
+    群聊/单聊消息的 POST 在携带 msg_id 和 msg_seq 时可以重试，服务端会对相同序号去重；
+    连接尚未建立就失败的请求没有到达服务端，任何方法都可以重试。
+
+    规则的匹配优先级为: 路由规则(``"POST /v2/groups/{group_openid}/files"``) > 请求方式规则(``"GET"``) > 默认值。
+
+    Args:
+      max_retries (int): 默认最大重试次数。. Defaults to 2
+      base_delay (float): 指数退避的基础等待秒数。. Defaults to 0.2
+      max_delay (float): 单次等待的上限秒数。. Defaults to 5
+      retry_status (Tuple[int]): 可以重试的返回码。. Defaults to RETRYABLE_STATUS
+      method_rules (Dict[str, RetryRule]): 按请求方式配置的规则
+      route_rules (Dict[str, RetryRule]): 按"请求方式 路径模板"配置的规则
+      budget_ratio (float): 每个请求为重试预算贡献的令牌数。. Defaults to 0.2
+      budget_min_per_second (float): 重试预算每秒固定补充的令牌数。. Defaults to 1
+      budget_capacity (float): 重试预算的令牌上限。. Defaults to 10
+    """
+
+    IDEMPOTENT_METHODS: ClassVar[FrozenSet[str]] = frozenset({"GET", "HEAD", "OPTIONS"})
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        base_delay: float = 0.2,
+        max_delay: float = 5.0,
+        retry_status: Tuple[int, ...] = RETRYABLE_STATUS,
+        method_rules: Dict[str, RetryRule] = None,
+        route_rules: Dict[str, RetryRule] = None,
+        budget_ratio: float = 0.2,
+        budget_min_per_second: float = 1.0,
+        budget_capacity: float = 10.0,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_status = frozenset(retry_status)
+        self.method_rules: Dict[str, RetryRule] = {k.upper(): v for k, v in (method_rules or {}).items()}
+        self.route_rules: Dict[str, RetryRule] = dict(route_rules or {})
+        self.budget = _RetryBudget(budget_ratio, budget_min_per_second, budget_capacity)
+
+    def _lookup(self, route: "Route", field: str):
+        for rule in (self.route_rules.get(route.template.key), self.method_rules.get(route.method)):
+            if rule is not None and getattr(rule, field) is not None:
+                return getattr(rule, field)
+        return None
+
+    def is_idempotent(self, route: "Route", payload: Any = None) -> bool:
+        """判断请求重复发送是否安全"""
+        forced = self._lookup(route, "idempotent")
+        if forced is not None:
+            return forced
+        if route.method in self.IDEMPOTENT_METHODS:
+            return True
+        if route.template.key in SEQ_IDEMPOTENT_ROUTES and isinstance(payload, dict):
+            return bool(payload.get("msg_id")) and payload.get("msg_seq") is not None
+        return False
+
+    def max_retries_for(self, route: "Route") -> int:
+        max_retries = self._lookup(route, "max_retries")
+        return self.max_retries if max_retries is None else max_retries
+
+    def backoff(self, route: "Route", attempt: int) -> float:
+        """第 attempt 次重试前的等待秒数，使用 full jitter 打散同时失败的请求"""
+        base_delay = self._lookup(route, "base_delay")
+        max_delay = self._lookup(route, "max_delay")
+        base_delay = self.base_delay if base_delay is None else base_delay
+        max_delay = self.max_delay if max_delay is None else max_delay
+        return random.uniform(0, min(max_delay, base_delay * (2**attempt)))
+
+    def should_retry(self, route: "Route", attempt: int, idempotent: bool) -> bool:
+        """attempt 为已经重试的次数"""
+        if not idempotent or attempt >= self.max_retries_for(route):
+            return False
+        return self.budget.withdraw()
+
+
+class _Circuit:
+    """单个路由模板的熔断状态"""
+
+    __slots__ = ("state", "failures", "opened_at", "trials", "trial_at")
+
+    def __init__(self):
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # 半开状态下已放行的试探请求数
+        self.trials = 0
+        self.trial_at = 0.0
+
+
+class CircuitBreaker:
+    """
+    按路由模板熔断
+
+    - closed: 正常放行，连续失败(超时、连接异常、5xx) failure_threshold 次后进入 open
+    - open: 直接抛出 CircuitOpenError 而不发出请求，recovery_timeout 秒后进入 half_open
+    - half_open: 最多放行 half_open_max_calls 个试探请求，成功则恢复 closed，失败则重新 open
+
+    某个接口异常时快速失败，不再占用连接和等待超时，避免拖慢其他接口。
+
+    Args:
+      failure_threshold (int): 连续失败多少次后熔断，为 0 时不熔断。. Defaults to 5
+      recovery_timeout (float): 熔断后多少秒开始试探恢复。. Defaults to 10.0
+      half_open_max_calls (int): 半开状态下同时放行的试探请求数。. Defaults to 1
+      route_rules (Dict[str, Tuple[int, float]]): 路由模板 -> (failure_threshold, recovery_timeout)，覆盖默认配置
+    """
+
+    CLOSED: ClassVar[str] = "closed"
+    OPEN: ClassVar[str] = "open"
+    HALF_OPEN: ClassVar[str] = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 10.0,
+        half_open_max_calls: int = 1,
+        route_rules: Dict[str, Tuple[int, float]] = None,
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.route_rules = dict(route_rules or {})
+        self._circuits: Dict[str, _Circuit] = {}
+
+    def _rule(self, template: str) -> Tuple[int, float]:
+        return self.route_rules.get(template, (self.failure_threshold, self.recovery_timeout))
+
+    def state(self, template: str) -> str:
+        circuit = self._circuits.get(template)
+        return circuit.state if circuit is not None else self.CLOSED
+
+    def allow(self, template: str) -> float:
+        """请求发出前检查，返回 0 表示放行，熔断中返回建议等待的秒数"""
+        circuit = self._circuits.get(template)
+        if circuit is None or circuit.state == self.CLOSED:
+            return 0.0
+        now = time.monotonic()
+        recovery_timeout = self._rule(template)[1]
+        if circuit.state == self.OPEN:
+            retry_after = circuit.opened_at + recovery_timeout - now
+            if retry_after > 0:
+                return retry_after
+            circuit.state = self.HALF_OPEN
+            circuit.trials = 0
+        # 试探请求没有结果(如被取消)时，超过 recovery_timeout 后允许新的试探
+        if circuit.trials >= self.half_open_max_calls and now - circuit.trial_at < recovery_timeout:
+            return circuit.trial_at + recovery_timeout - now
+        circuit.trials += 1
+        circuit.trial_at = now
+        return 0.0
+
+    def record_success(self, template: str) -> None:
+        circuit = self._circuits.get(template)
+        if circuit is not None and (circuit.failures or circuit.state != self.CLOSED):
+            if circuit.state != self.CLOSED:
+                _log.info("[botpy] 接口恢复正常，结束熔断: %s", template)
+            circuit.state = self.CLOSED
+            circuit.failures = 0
+
+    def record_failure(self, template: str) -> None:
+        threshold = self._rule(template)[0]
+        if threshold <= 0:
+            return
+        circuit = self._circuits.get(template)
+        if circuit is None:
+            circuit = self._circuits[template] = _Circuit()
+        circuit.failures += 1
+        if circuit.state == self.HALF_OPEN or (circuit.state == self.CLOSED and circuit.failures >= threshold):
+            _log.warning("[botpy] 接口连续失败%s次，熔断%s秒: %s", circuit.failures, self._rule(template)[1], template)
+            circuit.state = self.OPEN
+            circuit.opened_at = time.monotonic()
+
+
+class HedgePolicy:
+    """
+    对冲请求策略
+
+    可以安全重复发送的 GET 请求在 delay 秒内没有返回时，再发出一个相同的请求，
+    以先成功返回的为准并取消另一个，用少量额外请求换取更低的尾延迟。
+    delay 取该路由历史耗时的 percentile 分位数，并限制在 [min_delay, max_delay] 之间。
+    对冲请求同样经过限频桶：桶内额度不足、全局限频或熔断时不发出对冲请求；
+    另外按照与重试预算相同的方式限制对冲请求占正常请求的比例。
+
+    Args:
+      routes (Iterable[str]): 允许对冲的路由模板，如 ``"GET /guilds/{guild_id}/members/{user_id}"``，
+        为空时所有可以安全重复发送的 GET 请求都允许对冲
+      percentile (float): 计算 delay 使用的耗时分位数，取值 0-1。. Defaults to 0.95
+      min_delay (float): delay 的下限秒数。. Defaults to 0.05
+      max_delay (float): delay 的上限秒数。. Defaults to 2.0
+      min_samples (int): 路由的耗时样本数达到该值后才开始对冲。. Defaults to 20
+      budget_ratio (float): 每个请求为对冲预算贡献的令牌数。. Defaults to 0.1
+      budget_min_per_second (float): 对冲预算每秒固定补充的令牌数。. Defaults to 1
+      budget_capacity (float): 对冲预算的令牌上限。. Defaults to 10
+    """
+
+    def __init__(
+        self,
+        routes: Iterable[str] = None,
+        percentile: float = 0.95,
+        min_delay: float = 0.05,
+        max_delay: float = 2.0,
+        min_samples: int = 20,
+        budget_ratio: float = 0.1,
+        budget_min_per_second: float = 1.0,
+        budget_capacity: float = 10.0,
+    ):
+        self.routes: Optional[FrozenSet[str]] = None if routes is None else frozenset(routes)
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.budget = _RetryBudget(budget_ratio, budget_min_per_second, budget_capacity)
+
+    def applies(self, route: "Route") -> bool:
+        if route.method != "GET":
+            return False
+        return self.routes is None or route.template.key in self.routes
+
+    def delay(self, stats: RouteMetrics) -> Optional[float]:
+        """发出对冲请求前等待的秒数，样本不足时返回 None 表示不对冲"""
+        if stats.count < self.min_samples:
+            return None
+        return min(self.max_delay, max(self.min_delay, stats.percentile(self.percentile)))
+
+
+class ConnectionPool:
+    """OpenAPI 请求使用的长连接池
+
+    由 Client 创建一次，OpenAPI 请求、获取 access_token 和 websocket 连接都共用这个池的
+    ClientSession(连接器和 DNS 缓存)，重连和刷新 token 时不需要重新创建会话。
+    连接在请求结束后保持打开并放回池中复用，复用已有连接的请求无需重新进行 TCP 和 TLS 握手；
+    新建的连接仍需完整握手(不复用 TLS 会话)。DNS 解析结果会在 ``dns_cache_ttl`` 内缓存。
+    空闲超过 ``keepalive_timeout`` 的连接会被回收，避免复用到已被服务端关闭的连接。
+
+    Args:
+      limit (int): 连接池的总连接数上限，0 表示不限制。. Defaults to 500
+      limit_per_host (int): 单个域名的连接数上限，0 表示不限制。. Defaults to 0
+      keepalive_timeout (float): 空闲连接的保留秒数。. Defaults to 15
+      dns_cache_ttl (int): DNS 解析结果的缓存秒数，None 表示永久缓存。. Defaults to 300
+      warmup_connections (int): login 时预先建立的连接数。. Defaults to 0
+      force_close (bool): 每个请求结束后关闭连接(旧版本的行为)。. Defaults to False
+      verify_ssl (bool): 是否校验服务端证书，仅在本地调试代理等无法通过校验的环境中关闭。. Defaults to True
+    """
+
+    def __init__(
+        self,
+        limit: int = 500,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 15.0,
+        dns_cache_ttl: Optional[int] = 300,
+        warmup_connections: int = 0,
+        force_close: bool = False,
+        verify_ssl: bool = True,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.warmup_connections = warmup_connections
+        self.force_close = force_close
+        self.ssl_context = ssl.create_default_context()
+        if not verify_ssl:
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 调用 close 后不再重新创建会话
+        self._shut_down = False
+
+    @property
+    def closed(self) -> bool:
+        return self._shut_down or self._session is None or self._session.closed
+
+    @property
+    def shut_down(self) -> bool:
+        """是否已经调用过 close，关闭后 session() 会抛出 RuntimeError"""
+        return self._shut_down
+
+    def session(self) -> aiohttp.ClientSession:
+        """获取连接池对应的 ClientSession，需要在事件循环中调用"""
+        if self._shut_down:
+            raise RuntimeError("[botpy] 连接池已关闭")
+        if self._session is None or self._session.closed:
+            if self.force_close:
+                connector = TCPConnector(limit=self.limit, ssl=self.ssl_context, force_close=True)
+            else:
+                connector = TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    ssl=self.ssl_context,
+                    use_dns_cache=True,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                    keepalive_timeout=self.keepalive_timeout,
+                )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def warmup(self, url: str, connections: int = None) -> int:
+        """并发请求 url 以预先建立连接，返回成功建立的连接数"""
+        connections = self.warmup_connections if connections is None else connections
+        if connections <= 0 or self.force_close:
+            return 0
+        session = self.session()
+
+        async def _open():
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                await response.read()
+
+        results = await asyncio.gather(*(_open() for _ in range(connections)), return_exceptions=True)
+        opened = sum(1 for result in results if not isinstance(result, BaseException))
+        _log.debug("[botpy] 连接池预热完成, 建立连接数: %s/%s", opened, connections)
+        return opened
+
+    async def close(self) -> None:
+        self._shut_down = True
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
 
 
 class BotHttp:
     """
-    TODO 增加请求重试功能 @veehou
-    TODO 增加并发请求的锁控制 @veehou
+    机器人的 OpenAPI 请求客户端
+
+    请求按照 :attr:`Route.bucket` 分桶限频：桶内额度耗尽或收到429时，后续请求在本地排队，
+    等到额度恢复后再按顺序发出；收到429的请求会在等待后重新发送，而不是直接丢弃。
+    超时、连接断开和服务端5xx异常按照 :class:`RetryPolicy` 退避重试，
+    超时和连接异常在重试次数用完或不能安全重试时抛出 :class:`RequestFailedError`。
+
+    同时发出的请求数超过 max_concurrency 后按优先级排队，被动回复先于后台任务发出。
+    优先级只在这一处排队时生效，同一个限频桶内的排队仍按先后顺序。
     """
 
+    # 单个请求因为429最多重新发送的次数
+    MAX_RATE_LIMIT_RETRIES: ClassVar[int] = 5
+    # 默认的并发上限，远低于连接池的连接数上限，排队发生在按优先级放行的闸门中，
+    # 而不是在不区分优先级、与 websocket 和获取 token 共用的连接池中
+    DEFAULT_MAX_CONCURRENCY: ClassVar[int] = 32
+
     def __init__(
         self,
         timeout: int,
         is_sandbox: bool = False,
         app_id: str = None,
         secret: str = None,
+        retry_policy: RetryPolicy = None,
+        pool: ConnectionPool = None,
+        coalesce_requests: bool = False,
+        cache: ResponseCache = None,
+        max_concurrency: int = None,
+        priority_aging: float = 2.0,
+        metrics: Metrics = None,
+        circuit_breaker: CircuitBreaker = None,
+        hedge_policy: HedgePolicy = None,
+        deadline_fallback: DeadlineFallback = None,
     ):
         self.timeout = timeout
         self.is_sandbox = is_sandbox
+        self.ratelimiter = _RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.pool = pool or ConnectionPool()
+        self.coalesce_requests = coalesce_requests
+        self.cache = cache
+        # 同时发出的请求数上限，排队时按优先级放行
+        if max_concurrency is None:
+            max_concurrency = self.DEFAULT_MAX_CONCURRENCY
+            if self.pool.limit:
+                max_concurrency = max(1, min(max_concurrency, self.pool.limit // 2))
+        self.gate = _PriorityGate(max_concurrency, priority_aging)
+        # 按路由模板统计的请求指标
+        self.metrics = metrics or Metrics()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        # 对冲请求默认不启用
+        self.hedge_policy = hedge_policy
+        # 请求超过截止时间后的处理，为空时抛出 DeadlineExceededError
+        self.deadline_fallback = deadline_fallback
+
+        # 进行中的GET请求，key为(url, 查询参数)
+        self._inflight: Dict[Tuple[str, Tuple], asyncio.Future] = {}
 
-        self._token: Optional[Token] = None if not app_id else Token(app_id=app_id, secret=secret)
+        self._token: Optional[Token] = None if not app_id else Token(app_id=app_id, secret=secret, pool=self.pool)
         self._session: Optional[aiohttp.ClientSession] = None
-        self._global_over: Optional[asyncio.Event] = None
+        # 全局限频期间清除，未 login 直接使用时也需要处于放行状态
+        self._global_over = asyncio.Event()
+        self._global_over.set()
         self._headers: Optional[dict] = None
-
-    def __del__(self):
-        if self._session and not self._session.closed:
-            _loop = asyncio.get_event_loop()
-            _loop.create_task(self._session.close())
+        self._json_headers: Optional[dict] = None
 
     async def close(self) -> None:
-        if self._session and not self._session.closed:
-            await self._session.close()
+        if self._token is not None:
+            await self._token.close()
+        await self.pool.close()
 
     async def check_session(self):
         await self._token.check_token()
@@ -147,60 +1117,326 @@ class BotHttp:
             "Authorization": self._token.get_string(),
             "X-Union-Appid": self._token.app_id,
         }
+        self._json_headers = dict(self._headers)
+        self._json_headers[hdrs.CONTENT_TYPE] = "application/json"
 
         if not self._session or self._session.closed:
-            self._session = aiohttp.ClientSession(
-                connector=TCPConnector(limit=500, ssl=SSLContext(), force_close=True),
-            )
+            self._session = self.pool.session()
 
-    async def request(self, route: Route, retry_time: int = 0, **kwargs: Any):
-        if retry_time > 2:
-            return
+    async def request(self, route: Route, priority: int = None, deadline: float = None, **kwargs: Any):
+        """
+        发送请求
+
+        Args:
+          route (Route): 请求的路由
+          priority (int): 请求优先级，为空时使用 request_priority 指定的优先级，
+            都没有指定时被动回复为 PRIORITY_INTERACTIVE，其他请求为 PRIORITY_NORMAL
+          deadline (float): 截止时间(time.time() 的时间戳)，为空时使用 request_deadline 指定的截止时间。
+            超过截止时间(包括排队和重试期间)后不再发出请求，交给 deadline_fallback 处理，
+            没有配置 deadline_fallback 时抛出 DeadlineExceededError
+          kwargs: 透传给 aiohttp 的参数，如 json、params
+        """
+        route.is_sandbox = self.is_sandbox
+        if priority is None:
+            priority = self._priority(route, kwargs.get("json"))
+        if deadline is None:
+            deadline = _request_deadline.get()
+        if deadline is None:
+            return await self._dispatch(route, priority, None, **kwargs)
+        try:
+            return await self._dispatch(route, priority, deadline, **kwargs)
+        except DeadlineExceededError:
+            if self.deadline_fallback is None:
+                raise
+            return await self.deadline_fallback(self, route, kwargs)
+
+    async def _dispatch(self, route: Route, priority: int, deadline: Optional[float], **kwargs: Any):
+        cache = self.cache
+        if cache is not None:
+            template = route.template.key
+            if route.method != "GET":
+                data = await self._request(route, priority, deadline, **kwargs)
+                cache.invalidate_for_write(template, route.parameters)
+                return data
+            if cache.cacheable(template) and set(kwargs) <= {"params"}:
+                params = kwargs.get("params")
+                data = cache.get(template, route.url, params)
+                if data is None:
+                    data = await self._coalesce(route, priority, deadline, **kwargs)
+                    cache.set(template, route.url, route.parameters, params, data)
+                return data
+        return await self._coalesce(route, priority, deadline, **kwargs)
+
+    @staticmethod
+    def _priority(route: Route, payload: Optional[dict]) -> int:
+        priority = _request_priority.get()
+        if priority is not None:
+            return priority
+        if payload and route.template.key in REPLY_ROUTES and (payload.get("msg_id") or payload.get("event_id")):
+            return PRIORITY_INTERACTIVE
+        return PRIORITY_NORMAL
+
+    async def _coalesce(self, route: Route, priority: int, deadline: Optional[float], **kwargs: Any):
+        if (
+            not self.coalesce_requests
+            or route.method != "GET"
+            or (kwargs and set(kwargs) != {"params"})
+            # 带截止时间的请求不与其他调用方共享，避免继承别人的截止时间或被别人的截止时间拖累
+            or deadline is not None
+        ):
+            return await self._request(route, priority, deadline, **kwargs)
+
+        # 合并同时发起的相同GET请求，所有调用方共享同一次请求的结果(返回的是同一个对象，请勿修改)
+        # 只合并优先级相同的请求，高优先级的调用方不会跟着低优先级的请求排队
+        params = kwargs.get("params")
+        key = (route.url, tuple(sorted(params.items())) if params else (), priority)
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._request(route, priority, deadline, **kwargs))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            _log.debug("[botpy] 合并相同的请求: %s", key[0])
+        # 单个调用方被取消时不影响其他等待同一请求的调用方
+        return await asyncio.shield(future)
+
+    async def _request(self, route: Route, priority: int = PRIORITY_NORMAL, deadline: float = None, **kwargs: Any):
+        stats = self.metrics.route(route.template.key)
+        stats.in_flight += 1
+        try:
+            hedge = self.hedge_policy
+            if (
+                hedge is not None
+                and hedge.applies(route)
+                and set(kwargs) <= {"params"}
+                and self.retry_policy.is_idempotent(route)
+            ):
+                hedge.budget.deposit()
+                delay = hedge.delay(stats)
+                if delay is not None:
+                    return await self._hedged(route, priority, stats, deadline, delay, **kwargs)
+            return await self._send(route, priority, stats, deadline, **kwargs)
+        finally:
+            stats.in_flight -= 1
+
+    def _can_hedge(self, route: Route) -> bool:
+        """对冲请求不能挤占限频额度，也不发往熔断中的接口"""
+        if not self._global_over.is_set():
+            return False
+        if self.circuit_breaker.state(route.template.key) != CircuitBreaker.CLOSED:
+            return False
+        if not self.ratelimiter.get_bucket(route.bucket).available:
+            return False
+        return self.hedge_policy.budget.withdraw()
+
+    async def _hedged(
+        self, route: Route, priority: int, stats: RouteMetrics, deadline: Optional[float], delay: float, **kwargs: Any
+    ):
+        primary = asyncio.ensure_future(self._send(route, priority, stats, deadline, **kwargs))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not self._can_hedge(route):
+                return await primary
+            stats.hedges += 1
+            _log.debug("[botpy] 请求%.3f秒未返回，发出对冲请求: %s", delay, route.url)
+            hedge = asyncio.ensure_future(self._send(route, priority, stats, deadline, **kwargs))
+            pending.add(hedge)
+            # 以先成功返回的为准；先返回的失败(抛出异常或返回空响应)时继续等待另一个
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None and task.result() is not None]
+                if succeeded:
+                    if succeeded[0] is hedge:
+                        stats.hedge_wins += 1
+                    return succeeded[0].result()
+                if not pending:
+                    return primary.result()
+        finally:
+            # 取消未完成的一方
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    async def _send(self, route: Route, priority: int, stats: RouteMetrics, deadline: Optional[float], **kwargs: Any):
+        url = route.url
+        payload = kwargs.get("json")
+        is_json = False
         # some checking if it's a JSON request
+        # multipart 请求的字段，每次发送(包括重试)时重新生成请求体
+        fields = None
+        media = None
         if "json" in kwargs:
             json_ = kwargs["json"]
-            json__get = json_.get("file_image")
-            if json__get and isinstance(json__get, bytes):
-                kwargs["data"] = _FormData()
+            file_image = json_.get("file_image")
+            if file_image is not None and _is_upload(file_image):
+                fields = []
                 for k, v in kwargs.pop("json").items():
+                    if isinstance(v, codec.Fragment):
+                        v = v.value
                     if v:
                         if isinstance(v, dict):
                             if k == "message_reference":
                                 _log.error(
-                                    f"[botpy] 接口参数传入异常, 请求连接: {route.url}, "
-                                    f"错误原因: file_image与message_reference不能同时传入，"
-                                    f"备注: sdk已按照优先级，去除message_reference参数"
+                                    "[botpy] 接口参数传入异常, 请求连接: %s, "
+                                    "错误原因: file_image与message_reference不能同时传入，"
+                                    "备注: sdk已按照优先级，去除message_reference参数",
+                                    url,
                                 )
+                        elif k == "file_image":
+                            fields.append((k, _Upload(v)))
                         else:
-                            kwargs["data"].add_field(k, v)
+                            fields.append((k, v))
+            elif _is_media_data(json_.get("file_data")):
+                # 二进制的 file_data 在发送时才编码为 base64，每次发送(包括重试)时重新生成请求体
+                media = _media_body(kwargs.pop("json"), "file_data")
+                is_json = True
+            else:
+                # 使用统一的 codec 编码为 bytes 发送，重试时不需要再次编码
+                kwargs["data"] = codec.dumps_payload(kwargs.pop("json"))
+                is_json = True
 
-        await self.check_session()
-        route.is_sandbox = self.is_sandbox
-        _log.debug(f"[botpy] 请求头部: {self._headers}, 请求方式: {route.method}, 请求url: {route.url}")
-        _log.debug(self._session)
+        bucket = self.ratelimiter.get_bucket(route.bucket)
+        policy = self.retry_policy
+        # 只能读取一次的上传内容无法重新发送
+        replayable = fields is None or all(v.replayable for _, v in fields if isinstance(v, _Upload))
+        if media is not None:
+            replayable = media[1].replayable
+        idempotent = replayable and policy.is_idempotent(route, payload)
+        policy.budget.deposit()
+        breaker = self.circuit_breaker
+        template = route.template.key
+        retries = 0
+        rate_limited = 0
+        while True:
+            open_for = breaker.allow(template)
+            if open_for:
+                stats.rejected += 1
+                raise CircuitOpenError("[botpy] 接口熔断中: %s, %.1f秒后恢复" % (url, open_for), open_for)
+            self._check_deadline(deadline, stats, url)
+            await self._global_over.wait()
+            await bucket.acquire()
+            # 在限频桶中排队期间可能已经过了截止时间
+            self._check_deadline(deadline, stats, url)
+            try:
+                await self.check_session()
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError, ConnectionResetError) as e:
+                # 获取 access_token 失败与当前接口无关，不计入该接口的指标和熔断
+                _log.warning("[botpy] 获取 access_token 失败: %r, 请求连接: %s", e, url)
+                raise RequestFailedError("[botpy] 获取 access_token 失败: %r, 请求连接: %s" % (e, url), url, retries) from e
+            if fields is not None:
+                kwargs["data"] = self._form_data(fields)
+            elif media is not None:
+                kwargs["data"] = _Base64Payload(*media)
+            # 请求头部含有 access_token，不输出到日志
+            _log.debug("[botpy] 请求方式: %s, 请求url: %s", route.method, url)
+            global_retry_after = None
+            # 只有接口本身的 5xx、超时和连接异常计入熔断
+            try:
+                async with self.gate(priority) as sent_at, self._session.request(
+                    method=route.method,
+                    url=url,
+                    headers=self._json_headers if is_json else self._headers,
+                    timeout=(aiohttp.ClientTimeout(total=self.timeout)),
+                    **kwargs,
+                ) as response:
+                    _log.debug("[botpy] 返回状态: %s, 请求url: %s", response.status, url)
+                    retry_after = bucket.update(response.status, response.headers)
+                    trace_id = response.headers.get(X_TPS_TRACE_ID)
+                    self.metrics.observe(stats, time.monotonic() - sent_at, response.status, url, trace_id)
+                    if response.status >= 500:
+                        breaker.record_failure(template)
+                    else:
+                        breaker.record_success(template)
+                    if (
+                        response.status == HTTP_TOO_MANY_REQUESTS
+                        and rate_limited < self.MAX_RATE_LIMIT_RETRIES
+                        and replayable
+                    ):
+                        # 429的请求没有被服务端处理，无论什么方法都可以重新发送
+                        rate_limited += 1
+                        stats.rate_limited += 1
+                        _log.warning(
+                            "[botpy] 请求被限频, 请求连接: %s, %.2f秒后重试, trace_id:%s", url, retry_after, trace_id
+                        )
+                        if not response.headers.get(RATE_LIMIT_GLOBAL):
+                            continue
+                        global_retry_after = retry_after
+                    elif response.status in policy.retry_status and policy.should_retry(route, retries, idempotent):
+                        delay = policy.backoff(route, retries)
+                        retries += 1
+                        stats.retries += 1
+                        _log.warning(
+                            "[botpy] 接口返回异常, 请求连接: %s, 错误代码: %s, %.2f秒后进行第%s次重试, trace_id:%s",
+                            url, response.status, delay, retries, trace_id,
+                        )
+                    else:
+                        return await _handle_response(response)
+                if global_retry_after is not None:
+                    # 释放并发名额和响应后再等待全局限频结束
+                    await self._global_rate_limited(global_retry_after)
+                    continue
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError, ConnectionResetError) as e:
+                local_error = _upload_error(e)
+                if local_error is not None:
+                    # 读取本地文件失败，不是接口的问题，不重试也不计入指标和熔断
+                    raise local_error from e
+                if isinstance(e, asyncio.TimeoutError):
+                    stats.timeouts += 1
+                else:
+                    stats.connection_errors += 1
+                breaker.record_failure(template)
+                # 连接没有建立成功时请求未到达服务端，重试不会造成重复发送
+                unsent = replayable and isinstance(e, aiohttp.ClientConnectorError)
+                if not policy.should_retry(route, retries, idempotent or unsent):
+                    reason = "请求超时" if isinstance(e, asyncio.TimeoutError) else "连接异常"
+                    _log.warning("[botpy] %s，请求连接: %s, 已重试%s次", reason, url, retries)
+                    raise RequestFailedError("[botpy] %s: %r, 请求连接: %s" % (reason, e, url), url, retries) from e
+                delay = policy.backoff(route, retries)
+                retries += 1
+                stats.retries += 1
+                _log.warning("[botpy] 请求失败: %r, 请求连接: %s, %.2f秒后进行第%s次重试", e, url, delay, retries)
+            # 等待后已经超过截止时间的重试不再等待
+            self._check_deadline(deadline, stats, url, delay)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _check_deadline(deadline: Optional[float], stats: RouteMetrics, url: str, delay: float = 0.0) -> None:
+        if deadline is not None and time.time() + delay >= deadline:
+            stats.expired += 1
+            _log.warning("[botpy] 请求超过截止时间，不再发送: %s", url)
+            raise DeadlineExceededError("[botpy] 请求超过截止时间，不再发送: %s" % url, deadline)
+
+    @staticmethod
+    def _form_data(fields) -> FormData:
+        form = FormData()
+        for k, v in fields:
+            if isinstance(v, _Upload):
+                form.add_field(k, v.payload(), filename=k, content_type="application/octet-stream")
+            else:
+                form.add_field(k, v)
+        return form
+
+    async def _global_rate_limited(self, retry_after: float) -> None:
+        """全局限频时暂停所有请求"""
+        if not self._global_over.is_set():
+            # 已经有请求在等待全局限频结束
+            return
+        self._global_over.clear()
         try:
-            async with self._session.request(
-                method=route.method,
-                url=route.url,
-                headers=self._headers,
-                timeout=(aiohttp.ClientTimeout(total=self.timeout)),
-                **kwargs,
-            ) as response:
-                _log.debug(response)
-                return await _handle_response(response)
-        except asyncio.TimeoutError:
-            _log.warning(f"请求超时，请求连接: {route.url}")
-        except ConnectionResetError:
-            _log.debug("session connection broken retry")
-            await self.request(route, retry_time + 1, **kwargs)
+            await asyncio.sleep(retry_after)
+        finally:
+            self._global_over.set()
 
     async def login(self, token: Token) -> robot.Robot:
         """login后保存token和session"""
 
         self._token = token
+        # 获取 access_token 的请求与 OpenAPI 请求共用连接池
+        if token.pool is None:
+            token.pool = self.pool
         await self.check_session()
-        self._global_over = asyncio.Event()
-        self._global_over.set()
+        await self.pool.warmup(Route.base_url(self.is_sandbox))
 
         data = await self.request(Route("GET", "/users/@me"))
         # TODO 检查机器人token错误的raise exception @veehou
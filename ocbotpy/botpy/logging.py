@@ -3,6 +3,7 @@
 import os
 import sys
 import json
+import itertools
 import yaml
 import logging
 import logging.config
@@ -38,6 +39,15 @@ DEFAULT_FILE_HANDLER = {
     "filename": os.path.join(os.getcwd(), "%(name)s.log"),
 }
 
+# debug 日志中报文(消息体、返回内容)的最大输出长度，<=0 为不截断
+DEFAULT_PAYLOAD_LIMIT = 1024
+# 报文采样：每 N 条报文输出 1 条，1 为全部输出
+DEFAULT_PAYLOAD_SAMPLE = 1
+
+_payload_limit = DEFAULT_PAYLOAD_LIMIT
+_payload_sample = DEFAULT_PAYLOAD_SAMPLE
+_payload_counter = itertools.count()
+
 # 存放已经获取的Logger
 logs: Dict[str, logging.Logger] = {}
 
@@ -97,13 +107,43 @@ def get_logger(name=None):
     return logger
 
 
+class Payload:
+    """延迟格式化的报文，只有日志真正输出时才转为字符串并按 payload_limit 截断
+
+    用法: ``_log.debug("[botpy] 接收消息: %s", Payload(message))``
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = bytes(value).decode("utf-8", "replace")
+        text = value if isinstance(value, str) else str(value)
+        if 0 < _payload_limit < len(text):
+            return "%s...(共%s字符)" % (text[:_payload_limit], len(text))
+        return text
+
+
+def payload_enabled(logger: logging.Logger) -> bool:
+    """是否输出报文类的 debug 日志，未开启 DEBUG 时只有一次级别判断的开销"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    return _payload_sample <= 1 or next(_payload_counter) % _payload_sample == 0
+
+
 def configure_logging(
         config: Union[str, dict] = None,
         _format: str = None,
         level: int = None,
         bot_log: Union[bool, None] = True,
         ext_handlers: Union[dict, List, bool] = None,
-        force: bool = False
+        force: bool = False,
+        payload_limit: int = None,
+        payload_sample: int = None
 ) -> None:
     """
     修改日志配置
@@ -113,8 +153,16 @@ def configure_logging(
     :param bot_log: 是否启用bot日志 True/启用 None/禁用拓展 False/禁用拓展+控制台输出
     :param ext_handlers: 额外的handler，格式参考 DEFAULT_FILE_HANDLER。Default to True(使用默认handler)
     :param force: 是否在已追加handler(_ext_handlers)不为空时继续追加(避免因多次实例化Client类导致重复添加)
+    :param payload_limit: debug 日志中报文的最大输出长度，<=0 为不截断。Default to DEFAULT_PAYLOAD_LIMIT
+    :param payload_sample: 报文采样，每 N 条报文输出 1 条。Default to DEFAULT_PAYLOAD_SAMPLE
     """
-    global _ext_handlers
+    global _ext_handlers, _payload_limit, _payload_sample
+
+    if payload_limit is not None:
+        _payload_limit = payload_limit
+
+    if payload_sample is not None:
+        _payload_sample = max(1, payload_sample)
 
     if config is not None:
         if isinstance(config, dict):
@@ -1,8 +1,50 @@
+import time
+from datetime import datetime
+from typing import Optional
+
 from .api import BotAPI
+from .http import PASSIVE_REPLY_WINDOW, request_deadline
 from .types import gateway
 
 
-class Message:
+def _parse_timestamp(timestamp) -> Optional[float]:
+    """将消息的 timestamp(ISO 8601 字符串或秒级时间戳)转换为 time.time() 的时间戳"""
+    if timestamp is None or timestamp == "":
+        return None
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        if timestamp.isdigit():
+            return float(timestamp)
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class _ReplyDeadline:
+    """被动回复的截止时间，超过后 reply 会在本地被拒绝或交给 deadline_fallback 处理，不再占用请求"""
+
+    __slots__ = ()
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """被动回复的截止时间(time.time() 的时间戳)，消息没有 timestamp 时为 None"""
+        sent_at = _parse_timestamp(self.timestamp)
+        return None if sent_at is None else sent_at + PASSIVE_REPLY_WINDOW
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """距离被动回复截止还剩的秒数，已经过期时为负数，消息没有 timestamp 时为 None"""
+        deadline = self.deadline
+        return None if deadline is None else deadline - time.time()
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining
+        return remaining is not None and remaining <= 0
+
+
+class Message(_ReplyDeadline):
     __slots__ = (
         "_api",
         "author",
@@ -81,10 +123,11 @@ class Message:
             return str(self.__dict__)
 
     async def reply(self, **kwargs):
-        return await self._api.post_message(channel_id=self.channel_id, msg_id=self.id, **kwargs)
+        with request_deadline(self.deadline):
+            return await self._api.post_message(channel_id=self.channel_id, msg_id=self.id, **kwargs)
 
 
-class DirectMessage:
+class DirectMessage(_ReplyDeadline):
     __slots__ = (
         "_api",
         "author",
@@ -161,7 +204,8 @@ class DirectMessage:
             return str(self.__dict__)
 
     async def reply(self, **kwargs):
-        return await self._api.post_dms(guild_id=self.guild_id, msg_id=self.id, **kwargs)
+        with request_deadline(self.deadline):
+            return await self._api.post_dms(guild_id=self.guild_id, msg_id=self.id, **kwargs)
 
 
 class MessageAudit:
@@ -187,7 +231,7 @@ class MessageAudit:
         return str({items: str(getattr(self, items)) for items in self.__slots__ if not items.startswith("_")})
 
 
-class BaseMessage:
+class BaseMessage(_ReplyDeadline):
     __slots__ = (
         "_api",
         "content",
@@ -258,7 +302,8 @@ class GroupMessage(BaseMessage):
             return str(self.__dict__)
 
     async def reply(self, **kwargs):
-        return await self._api.post_group_message(group_openid=self.group_openid, msg_id=self.id, **kwargs)
+        with request_deadline(self.deadline):
+            return await self._api.post_group_message(group_openid=self.group_openid, msg_id=self.id, **kwargs)
     
 class C2CMessage(BaseMessage):
     __slots__ = ("author",)
@@ -280,4 +325,5 @@ class C2CMessage(BaseMessage):
             return str(self.__dict__)
 
     async def reply(self, **kwargs):
-        return await self._api.post_c2c_message(openid=self.author.user_openid, msg_id=self.id, **kwargs)
+        with request_deadline(self.deadline):
+            return await self._api.post_c2c_message(openid=self.author.user_openid, msg_id=self.id, **kwargs)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP 请求指标
+
+BotHttp 按路由模板(如 ``GET /guilds/{guild_id}``)统计每次发出的请求：
+耗时直方图、返回码计数、重试/限频/超时/连接异常/熔断拒绝/对冲/过期次数、进行中的请求数，以及慢请求的 trace_id。
+通过 ``client.metrics`` 读取，可以导出为 dict(:meth:`Metrics.as_dict`)
+或 Prometheus 文本格式(:meth:`Metrics.to_prometheus`)。
+每次请求只有几次计数和一次二分查找的开销，可以在生产环境常开。
+"""
+
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+# 耗时直方图的分桶上界(秒)
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RouteMetrics:
+    """单个路由模板的指标"""
+
+    __slots__ = (
+        "template",
+        "bounds",
+        "buckets",
+        "count",
+        "latency_sum",
+        "latency_max",
+        "statuses",
+        "retries",
+        "rate_limited",
+        "timeouts",
+        "connection_errors",
+        "rejected",
+        "hedges",
+        "hedge_wins",
+        "expired",
+        "in_flight",
+    )
+
+    def __init__(self, template: str, bounds: Tuple[float, ...]):
+        self.template = template
+        self.bounds = bounds
+        # 最后一个桶为 +Inf
+        self.buckets: List[int] = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.statuses: Dict[int, int] = {}
+        self.retries = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+        self.connection_errors = 0
+        # 熔断中被直接拒绝的请求数
+        self.rejected = 0
+        # 对冲请求发出的次数，以及对冲请求先于原请求返回的次数
+        self.hedges = 0
+        self.hedge_wins = 0
+        # 超过截止时间而没有发出的请求数
+        self.expired = 0
+        self.in_flight = 0
+
+    def observe(self, latency: float, status: int) -> None:
+        self.buckets[bisect_left(self.bounds, latency)] += 1
+        self.count += 1
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    @property
+    def errors(self) -> int:
+        """返回码不是 2xx 的请求数"""
+        return sum(n for status, n in self.statuses.items() if not 200 <= status < 300)
+
+    def percentile(self, q: float) -> float:
+        """按直方图估算耗时分位数(秒)，q 取值 0-1，没有数据时返回 0"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, n in enumerate(self.buckets):
+            if not n:
+                continue
+            if cumulative + n >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.latency_max
+                upper = min(upper, self.latency_max)
+                return lower + (upper - lower) * max(0.0, rank - cumulative) / n
+            cumulative += n
+        return self.latency_max
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "in_flight": self.in_flight,
+            "latency_avg": self.latency_sum / self.count if self.count else 0.0,
+            "latency_max": self.latency_max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "statuses": dict(self.statuses),
+            "errors": self.errors,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "timeouts": self.timeouts,
+            "connection_errors": self.connection_errors,
+            "rejected": self.rejected,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "expired": self.expired,
+        }
+
+
+def _label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    """HTTP 请求指标的注册表
+
+    Args:
+      buckets (Tuple[float, ...]): 耗时直方图的分桶上界(秒)。. Defaults to DEFAULT_BUCKETS
+      slow_threshold (float): 超过该耗时(秒)的请求记录为慢请求。. Defaults to 1.0
+      max_slow_calls (int): 最多保留的慢请求数。. Defaults to 50
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, slow_threshold: float = 1.0,
+                 max_slow_calls: int = 50):
+        self.bounds = tuple(sorted(buckets))
+        self.slow_threshold = slow_threshold
+        self.routes: Dict[str, RouteMetrics] = {}
+        # (记录时间, 路由模板, url, 返回码, 耗时, trace_id)
+        self.slow_calls: Deque[Tuple[float, str, str, int, float, str]] = deque(maxlen=max_slow_calls)
+
+    def route(self, template: str) -> RouteMetrics:
+        metrics = self.routes.get(template)
+        if metrics is None:
+            metrics = self.routes[template] = RouteMetrics(template, self.bounds)
+        return metrics
+
+    def observe(self, metrics: RouteMetrics, latency: float, status: int, url: str, trace_id: str = None) -> None:
+        metrics.observe(latency, status)
+        if latency >= self.slow_threshold:
+            self.slow_calls.append((time.time(), metrics.template, url, status, latency, trace_id))
+
+    def reset(self) -> None:
+        self.routes.clear()
+        self.slow_calls.clear()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "routes": {template: metrics.as_dict() for template, metrics in self.routes.items()},
+            "slow_calls": [
+                {"time": t, "route": template, "url": url, "status": status, "latency": latency, "trace_id": trace_id}
+                for t, template, url, status, latency, trace_id in self.slow_calls
+            ],
+        }
+
+    def to_prometheus(self, prefix: str = "botpy_http") -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = [
+            "# HELP %s_request_duration_seconds OpenAPI request latency." % prefix,
+            "# TYPE %s_request_duration_seconds histogram" % prefix,
+        ]
+        for template, metrics in self.routes.items():
+            route = _label(template)
+            cumulative = 0
+            for bound, n in zip(self.bounds + (float("inf"),), metrics.buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    '%s_request_duration_seconds_bucket{route="%s",le="%s"} %s' % (prefix, route, le, cumulative)
+                )
+            lines.append('%s_request_duration_seconds_sum{route="%s"} %s' % (prefix, route, metrics.latency_sum))
+            lines.append('%s_request_duration_seconds_count{route="%s"} %s' % (prefix, route, metrics.count))
+
+        lines.append("# TYPE %s_responses_total counter" % prefix)
+        for template, metrics in self.routes.items():
+            for status, n in sorted(metrics.statuses.items()):
+                lines.append('%s_responses_total{route="%s",status="%s"} %s' % (prefix, _label(template), status, n))
+
+        for name, kind in (
+            ("retries_total", "counter"),
+            ("rate_limited_total", "counter"),
+            ("timeouts_total", "counter"),
+            ("connection_errors_total", "counter"),
+            ("rejected_total", "counter"),
+            ("hedges_total", "counter"),
+            ("hedge_wins_total", "counter"),
+            ("expired_total", "counter"),
+            ("in_flight", "gauge"),
+        ):
+            attr = name[:-6] if name.endswith("_total") else name
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for template, metrics in self.routes.items():
+                lines.append('%s_%s{route="%s"} %s' % (prefix, name, _label(template), getattr(metrics, attr)))
+        return "\n".join(lines) + "\n"
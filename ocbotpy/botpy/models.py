@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+OpenAPI 返回值的轻量视图
+
+``BotAPI(http, response_models=True)`` (或 ``Client(response_models=True)``)时，
+部分只读接口不再直接返回解码后的 dict，而是返回包装它的视图::
+
+    members = await client.api.get_guild_members(guild_id, limit=400)
+    for member in members:
+        print(member.user.id, member.nick)
+
+视图只保存对原始数据的引用(``__slots__``，不带 ``__dict__``)，字段在访问时才转换，
+列表中的元素在取出时才包装，长期保存大量成员或子频道时不需要复制一份自己的数据结构。
+视图同时实现了只读的 Mapping 接口，``member["user"]["id"]`` 这样按 dict 使用的代码不需要修改。
+开启了响应缓存或请求合并时，多个调用方拿到的是同一份数据，视图是只读的，请勿修改 ``raw``。
+"""
+
+from collections.abc import Mapping, Sequence
+from enum import Enum
+from typing import Any, Callable, Dict, Iterator, List, Optional, Type, TypeVar, Union
+
+from .types.channel import ChannelSubType, ChannelType, PrivateType, SpeakPermission
+
+M = TypeVar("M", bound="Model")
+
+
+class Field:
+    """
+    视图的字段，读取时才从原始数据中取值并转换
+
+    Args:
+      key (str): 原始数据中的字段名，为空时与属性名相同
+      convert (Callable): 非 None 值的转换函数，为空时直接返回原始值
+    """
+
+    __slots__ = ("key", "convert")
+
+    def __init__(self, key: str = None, convert: Callable[[Any], Any] = None):
+        self.key = key
+        self.convert = convert
+
+    def __set_name__(self, owner, name: str) -> None:
+        if self.key is None:
+            self.key = name
+
+    def __get__(self, instance: Optional["Model"], owner=None) -> Any:
+        if instance is None:
+            return self
+        value = instance.raw.get(self.key)
+        if value is None or self.convert is None:
+            return value
+        return self.convert(value)
+
+
+class Model(Mapping):
+    """
+    包装一个解码后的 JSON 对象的只读视图
+
+    Args:
+      raw (dict): 解码后的 JSON 对象
+    """
+
+    __slots__ = ("raw",)
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.raw = raw
+
+    def __getitem__(self, key: str) -> Any:
+        return self.raw[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.raw)
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Model):
+            other = other.raw
+        return self.raw == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return "<%s %r>" % (self.__class__.__name__, self.raw)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """返回原始数据的浅拷贝"""
+        return dict(self.raw)
+
+
+class ModelList(Sequence):
+    """
+    包装 JSON 数组的只读视图，元素在取出时才包装为 model
+
+    Args:
+      raw (list): 解码后的 JSON 数组
+      model (Type[Model]): 元素的视图类型
+    """
+
+    __slots__ = ("raw", "model")
+
+    def __init__(self, raw: List[Dict[str, Any]], model: Type[M]):
+        self.raw = raw
+        self.model = model
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return ModelList(self.raw[index], self.model)
+        return self.model(self.raw[index])
+
+    def __iter__(self) -> Iterator[M]:
+        model = self.model
+        for item in self.raw:
+            yield model(item)
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, ModelList):
+            other = other.raw
+        return self.raw == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return "<ModelList of %s: %s items>" % (self.model.__name__, len(self.raw))
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """返回原始数据的浅拷贝"""
+        return list(self.raw)
+
+
+def list_of(model: Type[M]) -> Callable[[List[Any]], ModelList]:
+    def convert(value: List[Any]) -> ModelList:
+        return ModelList(value, model)
+
+    return convert
+
+
+def enum_of(enum: Type[Enum]) -> Callable[[Any], Any]:
+    # 服务端新增的枚举值不在 SDK 中时返回原始值，而不是抛出异常
+    def convert(value: Any) -> Any:
+        try:
+            return enum(value)
+        except ValueError:
+            return value
+
+    return convert
+
+
+def wrap(model: Type[M], data: Any) -> Any:
+    """按返回值的类型包装为视图，请求失败返回的 None 或字符串原样返回"""
+    if isinstance(data, dict):
+        return model(data)
+    if isinstance(data, list):
+        return ModelList(data, model)
+    return data
+
+
+class User(Model):
+    __slots__ = ()
+
+    id: str = Field()
+    username: str = Field()
+    avatar: str = Field()
+    bot: bool = Field()
+    union_openid: str = Field()
+    union_user_account: str = Field()
+
+
+class Member(Model):
+    __slots__ = ()
+
+    user: User = Field(convert=User)
+    nick: str = Field()
+    roles: List[str] = Field()
+    joined_at: str = Field()
+    guild_id: str = Field()
+
+
+class Role(Model):
+    __slots__ = ()
+
+    id: str = Field()
+    name: str = Field()
+    color: int = Field()
+    hoist: int = Field()
+    number: int = Field()
+    number_limit: int = Field()
+
+
+class GuildRoles(Model):
+    __slots__ = ()
+
+    guild_id: str = Field()
+    roles: ModelList = Field(convert=list_of(Role))
+    role_num_limit: str = Field()
+
+
+class RoleMembers(Model):
+    __slots__ = ()
+
+    data: ModelList = Field(convert=list_of(Member))
+    next: str = Field()
+
+
+class Guild(Model):
+    __slots__ = ()
+
+    id: str = Field()
+    name: str = Field()
+    icon: str = Field()
+    owner_id: str = Field()
+    owner: bool = Field()
+    member_count: int = Field()
+    max_members: int = Field()
+    description: str = Field()
+    joined_at: str = Field()
+
+
+class Channel(Model):
+    __slots__ = ()
+
+    id: str = Field()
+    guild_id: str = Field()
+    name: str = Field()
+    type: ChannelType = Field(convert=enum_of(ChannelType))
+    sub_type: ChannelSubType = Field(convert=enum_of(ChannelSubType))
+    position: int = Field()
+    parent_id: str = Field()
+    owner_id: str = Field()
+    private_type: PrivateType = Field(convert=enum_of(PrivateType))
+    speak_permission: SpeakPermission = Field(convert=enum_of(SpeakPermission))
+    application_id: str = Field()
+    permissions: str = Field()
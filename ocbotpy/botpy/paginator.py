@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+分页接口的异步迭代器
+
+用法::
+
+    async for member in api.iter_guild_members(guild_id):
+        ...
+
+迭代当前页的同时会在后台请求下一页；中途 break 即可提前停止，
+``paginator.cursor`` 记录了当前页的分页参数，可以传给新的迭代器从这一页继续拉取。
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from . import logging, models
+
+_log = logging.get_logger()
+
+# fetch(cursor, remaining) -> (本页数据, 下一页的分页参数)，分页参数为 None 表示没有下一页；
+# remaining 为还需要的条数(不限制时为 None)，fetcher 据此减小最后一页的请求条数
+PageFetcher = Callable[[Any, Optional[int]], Awaitable[Tuple[List[Any], Any]]]
+
+
+class Paginator:
+    """通用的分页迭代器
+
+    Args:
+      fetch (PageFetcher): 拉取一页数据的协程函数
+      cursor: 第一页的分页参数
+      limit (int): 最多返回的条数，为空时不限制
+      prefetch (bool): 是否在迭代当前页时预取下一页。. Defaults to True
+    """
+
+    def __init__(self, fetch: PageFetcher, cursor: Any = None, limit: int = None, prefetch: bool = True):
+        self._fetch = fetch
+        self.cursor = cursor
+        self.limit = limit
+        self.prefetch = prefetch
+        # 是否已经拉取到最后一页
+        self.done = False
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self._iterate()
+
+    def _remaining(self, count: int) -> Optional[int]:
+        return None if self.limit is None else self.limit - count
+
+    async def _iterate(self) -> AsyncIterator[Any]:
+        count = 0
+        task: Optional[asyncio.Future] = None
+        if self.done:
+            return
+        try:
+            task = asyncio.ensure_future(self._fetch(self.cursor, self._remaining(count)))
+            while True:
+                items, next_cursor = await task
+                task = None
+                # 当前页已经足够 limit 时不再预取
+                remaining = self._remaining(count + len(items))
+                if next_cursor is not None and self.prefetch and (remaining is None or remaining > 0):
+                    task = asyncio.ensure_future(self._fetch(next_cursor, remaining))
+
+                for item in items:
+                    if self.limit is not None and count >= self.limit:
+                        return
+                    count += 1
+                    yield item
+
+                if next_cursor is None:
+                    self.done = True
+                    return
+                self.cursor = next_cursor
+                if self.limit is not None and count >= self.limit:
+                    return
+                if task is None:
+                    task = asyncio.ensure_future(self._fetch(next_cursor, self._remaining(count)))
+        finally:
+            # 提前停止时取消预取的请求
+            if task is not None:
+                if task.done():
+                    if not task.cancelled():
+                        task.exception()
+                else:
+                    task.cancel()
+
+    async def flatten(self) -> List[Any]:
+        """拉取所有数据并返回列表"""
+        return [item async for item in self]
+
+
+def _page_size(page_size: int, remaining: Optional[int]) -> int:
+    return page_size if remaining is None else max(1, min(page_size, remaining))
+
+
+def _page(data: Any, route: str) -> Any:
+    if data is None:
+        # 服务端返回空响应时停止翻页而不是无限重试；请求超时等异常直接抛给迭代的调用方
+        _log.warning("[botpy] 分页请求没有返回数据，停止翻页: %s", route)
+    return data
+
+
+def guild_members_fetcher(api, guild_id: str, page_size: int) -> PageFetcher:
+    last_ids = set()
+
+    async def fetch(after: str, remaining: Optional[int]) -> Tuple[List[Any], Any]:
+        nonlocal last_ids
+        if remaining is not None and after != "0":
+            # 翻页时通常会再次返回 after 对应的成员，多请求一条
+            remaining += 1
+        limit = _page_size(page_size, remaining)
+        members = _page(await api.get_guild_members(guild_id, after=after, limit=limit), "guild_members") or []
+        if not members:
+            return [], None
+        # 翻页时可能返回上一页已经返回过的成员(包括 after 本身)，按 user id 去重
+        page = [member for member in members if member["user"]["id"] not in last_ids and member["user"]["id"] != after]
+        last_ids = {member["user"]["id"] for member in members}
+        next_after = members[-1]["user"]["id"]
+        # 只返回了重复的成员时翻页参数不会前进，视为最后一页
+        return page, next_after if next_after != after else None
+
+    return fetch
+
+
+def guild_role_members_fetcher(api, guild_id: str, role_id: str, page_size: int) -> PageFetcher:
+    async def fetch(start_index: str, remaining: Optional[int]) -> Tuple[List[Any], Any]:
+        limit = _page_size(page_size, remaining)
+        data = _page(
+            await api.get_guild_role_members(guild_id, role_id, start_index=start_index, limit=limit),
+            "guild_role_members",
+        ) or {}
+        members = (data.data if isinstance(data, models.RoleMembers) else data.get("data")) or []
+        return members, (data.get("next") or None) if members else None
+
+    return fetch
+
+
+def reaction_users_fetcher(api, channel_id: str, message_id: str, emoji_type, emoji_id: str, page_size: int):
+    async def fetch(cookie: str, remaining: Optional[int]) -> Tuple[List[Any], Any]:
+        limit = _page_size(page_size, remaining)
+        data = _page(
+            await api.get_reaction_users(channel_id, message_id, emoji_type, emoji_id, cookie=cookie, limit=limit),
+            "reaction_users",
+        ) or {}
+        next_cookie = None if data.get("is_end", True) else data.get("cookie") or None
+        return data.get("users") or [], next_cookie
+
+    return fetch
+
+
+def me_guilds_fetcher(api, desc: bool, page_size: int) -> PageFetcher:
+    async def fetch(guild_id: str, remaining: Optional[int]) -> Tuple[List[Any], Any]:
+        limit = _page_size(page_size, remaining)
+        guilds = _page(await api.me_guilds(guild_id=guild_id, limit=limit, desc=desc), "me_guilds") or []
+        # 返回不足一页时说明已经是最后一页
+        if len(guilds) < limit:
+            return guilds, None
+        return guilds, guilds[-1]["id"]
+
+    return fetch
@@ -1,11 +1,15 @@
 import asyncio
 import time
+from typing import TYPE_CHECKING, Optional
 
 import aiohttp
 
 from .logging import get_logger
 from botpy.types import robot
 
+if TYPE_CHECKING:  # pragma: no cover
+    from .http import ConnectionPool
+
 _log = get_logger()
 
 
@@ -23,31 +27,94 @@ class Token:
     TYPE_BOT = "QQBot"
     TYPE_NORMAL = "Bearer"
 
-    def __init__(self, app_id: str, secret: str):
+    # 后台刷新失败后的重试间隔(秒)
+    REFRESH_RETRY_INTERVAL = 10
+
+    # 获取 access_token 的接口地址，本地测试时可以指向 botpy.ext.mock_openapi
+    TOKEN_URL = "https://bots.qq.com/app/getAppAccessToken"
+
+    def __init__(self, app_id: str, secret: str, refresh_margin: int = 60, pool: "ConnectionPool" = None):
         """
         :param app_id:
             机器人appid
         :param secret:
             机器人密钥
+        :param refresh_margin:
+            提前刷新的安全余量(秒)，access_token 在过期前 refresh_margin 秒内会在后台刷新，
+            最多为服务端返回的有效期的一半
+        :param pool:
+            获取 token 使用的连接池，为空时使用 token 自己的 ClientSession。
+            登录后 BotHttp 会将其设置为与 OpenAPI 请求共用的连接池
         """
         self.app_id = app_id
         self.secret = secret
         self.access_token = None
         self.expires_in = 0
         self.Type = self.TYPE_BOT
+        self.refresh_margin = refresh_margin
+        # 最近一次获取到的 token 的剩余有效期(秒)
+        self._lifetime: Optional[float] = None
+
+        # 正在进行中的刷新，所有并发调用方共享同一次刷新的结果
+        self._refreshing: Optional[asyncio.Future] = None
+        self._refresh_handle: Optional[asyncio.TimerHandle] = None
+        self.pool = pool
+        # 没有共用的连接池时使用的 ClientSession
+        self._session: Optional[aiohttp.ClientSession] = None
 
     async def check_token(self):
-        if self.access_token is None or int(time.time()) >= self.expires_in:
+        if self.access_token is None or time.time() >= self.expires_in:
             await self.update_access_token()
+        elif time.time() >= self.expires_in - self._margin():
+            # token 仍然有效，不阻塞当前请求，在后台完成刷新
+            self._start_refresh()
 
     async def update_access_token(self):
-        session = aiohttp.ClientSession()
+        await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Future:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._fetch_access_token())
+            self._refreshing.add_done_callback(self._on_refreshed)
+        return self._refreshing
+
+    def _margin(self) -> float:
+        # 服务端在 token 过期前的最后 60 秒内才会返回新的 token，在此之前返回的仍是当前 token，
+        # 安全余量不超过有效期的一半，避免刚刷新完又进入余量而反复请求
+        if self._lifetime is None:
+            return self.refresh_margin
+        return min(self.refresh_margin, self._lifetime / 2)
+
+    def _on_refreshed(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            delay = self.REFRESH_RETRY_INTERVAL
+            _log.warning("[botpy] access_token 刷新失败: %r, %s秒后重试", future.exception(), delay)
+        else:
+            self._lifetime = max(self.expires_in - time.time(), 0)
+            delay = max(self._lifetime - self._margin(), self.REFRESH_RETRY_INTERVAL)
+        self._schedule_refresh(delay)
+
+    def _schedule_refresh(self, delay: float) -> None:
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+        loop = asyncio.get_event_loop()
+        self._refresh_handle = loop.call_later(delay, self._start_refresh)
+
+    def _client_session(self) -> aiohttp.ClientSession:
+        if self.pool is not None:
+            return self.pool.session()
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def _fetch_access_token(self):
         data = None
-        # TODO 增加超时重试
         try:
-            async with session.post(
+            async with self._client_session().post(
                 ssl=False,
-                url="https://bots.qq.com/app/getAppAccessToken",
+                url=self.TOKEN_URL,
                 timeout=(aiohttp.ClientTimeout(total=20)),
                 json={
                     "appId": self.app_id,
@@ -56,17 +123,25 @@ class Token:
             ) as response:
                 data = await response.json()
         except asyncio.TimeoutError as e:
-            _log.info("[botpy] access_token TimeoutError:" + str(e))
+            _log.info("[botpy] access_token TimeoutError: %s", e)
             raise
-        finally:
-            await session.close()
         if "access_token" not in data or "expires_in" not in data:
             _log.error("[botpy] 获取token失败，请检查appid和secret填写是否正确！")
             raise RuntimeError(str(data))
-        _log.info("[botpy] access_token expires_in " + data["expires_in"])
+        _log.info("[botpy] access_token expires_in %s", data["expires_in"])
         self.access_token = data["access_token"]
         self.expires_in = int(data["expires_in"]) + int(time.time())
 
+    async def close(self):
+        """停止后台刷新，并关闭 token 自己的连接(共用的连接池由其所有者关闭)"""
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+        if self._refreshing is not None and not self._refreshing.done():
+            self._refreshing.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
     # BotToken 机器人身份的 token
     def bot_token(self):
         return self
@@ -4,9 +4,9 @@ import pilk
 import tempfile
 import av
 import io
-import base64
 import botpy
 from botpy import logging
+from botpy.cache import MediaCache
 from botpy.message import GroupMessage
 from botpy.ext.cog_yaml import read
 import requests
@@ -214,14 +214,8 @@ def convert_to_silk_from_buffer(audio_buffer: bytes, in_format: str) -> bytes:
 
     return silk_buffer
 
-def convert_silk_to_base64(silk_data: bytes) -> str:
-    """将 Silk 数据 (字节串) 转换为 Base64 编码的字符串"""
-    base64_encoded_data = base64.b64encode(silk_data)
-    base64_string = base64_encoded_data.decode('utf-8')
-    return base64_string
-
-async def synthesize_speech_to_silk_base64(text: str) -> str:
-    """合成语音，转换为 Silk 格式，并返回 Base64 编码"""
+async def synthesize_speech_to_silk(text: str) -> bytes:
+    """合成语音，转换为 Silk 格式并返回 Silk 数据(上传时由 SDK 编码为 base64)"""
     # 添加条件，检查 speech_key 和 speech_region 是否都存在
     if not all([speech_key, speech_region]):
       _log.warning("由于 SPEECH_KEY 和 SPEECH_REGION 未配置，无法合成语音.")
@@ -268,10 +262,7 @@ async def synthesize_speech_to_silk_base64(text: str) -> str:
         os.remove(temp_wav_filename)
 
         # 将 WAV 转换为 Silk
-        silk_data = convert_to_silk_from_buffer(audio_buffer, "wav")
-        # 将 Silk 转换为 Base64
-        base64_string = convert_silk_to_base64(silk_data)
-        return base64_string
+        return convert_to_silk_from_buffer(audio_buffer, "wav")
     else:
         print(f"Speech synthesis failed: {synthesis_result.error_details}")
         return None
@@ -339,6 +330,10 @@ class MyClient(botpy.Client):
         # 获取群消息的内容
         query = message.content
         answer = await call_api(query)
+        # 接口响应较慢时被动回复可能已经过期(消息发出 5 分钟后)，过期后不再上传和发送
+        if message.expired:
+            _log.warning(f"被动回复已过期 {-message.remaining:.0f} 秒，不再发送")
+            return
         if api_call_lock.locked():
             print("正在处理总结，请稍后再试")
             return
@@ -347,15 +342,15 @@ class MyClient(botpy.Client):
             asyncio.create_task(process_memory(query, answer))
         if answer:
             if "-v" in query:  # 检查 query 中是否包含 "-v"
-                # 将 answer 作为输入，合成语音并转换为 Base64
-                base64_audio = await synthesize_speech_to_silk_base64(answer)
-                if base64_audio:
+                # 将 answer 作为输入，合成 Silk 语音
+                silk_audio = await synthesize_speech_to_silk(answer)
+                if silk_audio:
                     # 调用 API 发送群消息
                     try:
                          uploadMedia = await message._api.post_group_file(
                              group_openid=message.group_openid,
                              file_type=3,
-                             file_data=base64_audio
+                             file_data=silk_audio
                          )
                          _log.info(f"uploadMedia: {uploadMedia}")
 
@@ -393,7 +388,6 @@ class MyClient(botpy.Client):
                 # 分割 answer
                 paragraphs = re.split(r"\n\s*\n+", answer.strip())
 
-                current_msg_seq = 21314
                 messages_to_send = []  # 存储待发送的消息，可以是文本或媒体消息
                 for paragraph in paragraphs:
                     # 替换情绪词为 base64 图片标记
@@ -407,31 +401,23 @@ class MyClient(botpy.Client):
                            if media_message:
                               messages_to_send.append(("media", media_message))
 
-                # 循环发送所有消息
-                for msg_type, msg_content in messages_to_send:
-                    try:
-                         if msg_type == "text":
-                            messageResult = await message._api.post_group_message(
-                                group_openid=message.group_openid,
-                                msg_type=0,
-                                msg_id=message.id,
-                                content=msg_content,
-                                msg_seq=current_msg_seq
-                            )
-                            _log.info(f"文本消息发送结果：{messageResult}, msg_seq: {current_msg_seq}")
-                         elif msg_type == "media":
-                            messageResult = await message._api.post_group_message(
-                                group_openid=message.group_openid,
-                                msg_type=7,  # 7 表示富媒体
-                                msg_id=message.id,
-                                media=msg_content,
-                                msg_seq=current_msg_seq
-                            )
-                            _log.info(f"媒体消息发送结果：{messageResult}, msg_seq: {current_msg_seq}")
-                         current_msg_seq += 5
-                    except Exception as e:
-                        _log.error(f"发送消息时发生异常: {e}")
-                        print(f"发送消息时发生异常: {e}")
+                # 批量发送所有消息，msg_seq 由 SDK 分配，按顺序逐条送达
+                parts = [
+                    {"msg_type": 0, "content": msg_content} if msg_type == "text"
+                    else {"msg_type": 7, "media": msg_content}  # 7 表示富媒体
+                    for msg_type, msg_content in messages_to_send
+                ]
+                results = await message._api.post_group_messages(
+                    group_openid=message.group_openid,
+                    parts=parts,
+                    msg_id=message.id,
+                )
+                for (msg_type, _), messageResult in zip(messages_to_send, results):
+                    if isinstance(messageResult, Exception):
+                        _log.error(f"发送消息时发生异常: {messageResult}")
+                        print(f"发送消息时发生异常: {messageResult}")
+                    else:
+                        _log.info(f"{msg_type} 消息发送结果：{messageResult}")
                 _log.info(f"成功发送 {len(messages_to_send)} 条消息.")
                 print(f"成功发送 {len(messages_to_send)} 条消息.")
 
@@ -441,5 +427,6 @@ class MyClient(botpy.Client):
 
 if __name__ == "__main__":
     intents = botpy.Intents(public_messages=True)
-    client = MyClient(intents=intents)
+    # 相同的表情图片在有效期内不重复上传
+    client = MyClient(intents=intents, media_cache=MediaCache())
     client.run(appid=test_config["appid"], secret=test_config["secret"])
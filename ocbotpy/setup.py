@@ -18,6 +18,8 @@ setup(
     license="Tencent",
     # 安装依赖
     install_requires=["aiohttp>=3.7.4,<4", "PyYAML", "APScheduler"],
+    # 可选依赖，安装后自动使用更快的 JSON 编解码
+    extras_require={"speedups": ["orjson"]},
     # 分类
     classifiers=[
         # 发展时期,常见的如下
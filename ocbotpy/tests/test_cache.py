@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from botpy.cache import MediaCache, ResponseCache, TTLCache
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.set("c", 3)
+        # b 最久未使用，被淘汰
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    def test_expire(self):
+        cache = TTLCache(ttl=0.05)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=60)
+        self.assertIn("a", cache)
+        time.sleep(0.06)
+        self.assertNotIn("a", cache)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(2, cache.get("b"))
+        self.assertEqual(0, cache.expire())
+
+    def test_unbounded(self):
+        cache = TTLCache(maxsize=None, ttl=0.05)
+        for i in range(5000):
+            cache.set(i, i)
+        # 不按条数淘汰
+        self.assertEqual(0, cache.get(0))
+        self.assertEqual(5000, len(cache))
+        time.sleep(0.06)
+        # 写入时清理开头已经过期的条目
+        cache.set("new", 1)
+        self.assertEqual(1, len(cache))
+        self.assertEqual(0, cache.stats()["evictions"])
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = ResponseCache()
+        self.channel = "GET /channels/{channel_id}"
+        self.channels = "GET /guilds/{guild_id}/channels"
+        self.cache.set(self.channel, "/channels/1", {"channel_id": "1"}, None, {"id": "1"})
+        self.cache.set(self.channel, "/channels/2", {"channel_id": "2"}, None, {"id": "2"})
+        self.cache.set(self.channels, "/guilds/g/channels", {"guild_id": "g"}, None, [{"id": "1"}])
+
+    def test_get(self):
+        self.assertEqual({"id": "1"}, self.cache.get(self.channel, "/channels/1"))
+        self.assertIsNone(self.cache.get(self.channel, "/channels/3"))
+        self.assertEqual({"hits": 1, "misses": 1}, self.cache.stats()["templates"][self.channel])
+
+    def test_not_cacheable(self):
+        template = "GET /guilds/{guild_id}/members"
+        self.assertFalse(self.cache.cacheable(template))
+        self.cache.set(template, "/guilds/g/members", {"guild_id": "g"}, None, [])
+        self.assertEqual(3, len(self.cache))
+
+    def test_invalidate_by_parameters(self):
+        self.assertEqual(1, self.cache.invalidate(channel_id="1"))
+        self.assertIsNone(self.cache.get(self.channel, "/channels/1"))
+        # 没有 channel_id 参数的缓存不受影响
+        self.assertIsNotNone(self.cache.get(self.channels, "/guilds/g/channels"))
+
+    def test_invalidate_for_write(self):
+        parameters = {"channel_id": "2"}
+        self.assertEqual(2, self.cache.invalidate_for_write("PATCH /channels/{channel_id}", parameters))
+        self.assertIsNotNone(self.cache.get(self.channel, "/channels/1"))
+        self.assertEqual(0, self.cache.invalidate_for_write("POST /channels/{channel_id}/messages", parameters))
+
+
+class MediaCacheTestCase(unittest.TestCase):
+    def test_key(self):
+        key = MediaCache.key("group", "g", 1, "aGVsbG8=")
+        self.assertEqual(key, MediaCache.key("group", "g", 1, b"aGVsbG8="))
+        self.assertNotEqual(key, MediaCache.key("c2c", "g", 1, "aGVsbG8="))
+        self.assertNotEqual(key, MediaCache.key("group", "g", 2, "aGVsbG8="))
+
+    def test_ttl(self):
+        cache = MediaCache(max_ttl=100, margin=30)
+        cache.set("short", {"file_info": "a", "ttl": 20})
+        cache.set("long", {"file_info": "b", "ttl": 0})
+        cache.set("normal", {"file_info": "c", "ttl": 3600})
+        cache.set("failed", {"code": 1})
+        self.assertIsNone(cache.get("short"))
+        self.assertIsNone(cache.get("failed"))
+        self.assertEqual("b", cache.get("long")["file_info"])
+        self.assertEqual("c", cache.get("normal")["file_info"])
+
+
+if __name__ == "__main__":
+    unittest.main()
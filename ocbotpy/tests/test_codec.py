@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import unittest
+
+from botpy import codec
+
+
+class CodecTestCase(unittest.TestCase):
+    def test_dumps_bytes(self):
+        data = codec.dumps({"content": "你好", "msg_seq": 1})
+        self.assertIsInstance(data, bytes)
+        self.assertEqual({"content": "你好", "msg_seq": 1}, codec.loads(data))
+        # 紧凑编码，不带多余空格
+        self.assertNotIn(b": ", data)
+
+    def test_loads_str(self):
+        self.assertEqual({"op": 10}, codec.loads('{"op": 10}'))
+        self.assertEqual('{"op":11}', codec.dumps_str({"op": 11}))
+
+    def test_std_fallback(self):
+        self.assertEqual(codec.loads(codec.dumps({"id": 1 << 70})), codec.loads(codec._std_dumps({"id": 1 << 70})))
+
+    def test_decode_error(self):
+        with self.assertRaises(codec.DecodeError):
+            codec.loads(b"{not json")
+
+    def test_compact(self):
+        payload = {"self": object(), "content": "hi", "msg_id": None, "msg_seq": 1, "msg_type": 0}
+        self.assertEqual({"content": "hi", "msg_seq": 1, "msg_type": 0}, codec.compact(payload))
+
+    def test_dumps_payload_fragment(self):
+        keyboard = codec.Fragment({"id": "kb", "content": {"rows": []}})
+        data = codec.dumps_payload({"content": "hi", "keyboard": keyboard, "msg_seq": 2})
+        self.assertEqual({"content": "hi", "keyboard": {"id": "kb", "content": {"rows": []}}, "msg_seq": 2},
+                         codec.loads(data))
+        # 只有 Fragment 字段时不会多出逗号
+        self.assertEqual({"keyboard": keyboard.value}, codec.loads(codec.dumps_payload({"keyboard": keyboard})))
+        # 没有 Fragment 字段时与 dumps 相同
+        self.assertEqual(codec.dumps({"a": 1}), codec.dumps_payload({"a": 1}))
+
+
+if __name__ == "__main__":
+    unittest.main()
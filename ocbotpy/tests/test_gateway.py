@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import unittest
+import zlib
+
+from aiohttp import WSMsgType, web
+from aiohttp.test_utils import TestServer
+
+from botpy.gateway import BotWebSocket, GatewayStats, _ZlibStream
+from botpy.http import ConnectionPool
+
+
+class FakeConnection:
+    parser = None
+
+    def __init__(self):
+        self.sessions = []
+
+    def add(self, session):
+        self.sessions.append(session)
+
+
+class GatewayTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.connections = 0
+        self.app = web.Application()
+        self.app.router.add_get("/websocket", self.websocket)
+        self.server = TestServer(self.app, loop=self.loop)
+        self.loop.run_until_complete(self.server.start_server())
+        self.addCleanup(lambda: self.loop.run_until_complete(self.server.close()))
+
+    async def websocket(self, request):
+        self.connections += 1
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.close(code=4009, message=b"session timed out")
+        return ws
+
+    def make_session(self):
+        return {
+            "session_id": "s",
+            "last_seq": 0,
+            "intent": 1,
+            "token": None,
+            "url": str(self.server.make_url("/websocket")).replace("http", "ws", 1),
+            "shards": {"shard_id": 0, "shard_count": 1},
+        }
+
+
+class SharedPoolTestCase(GatewayTestCase):
+    def test_reconnect_reuses_pool_session(self):
+        pool = ConnectionPool()
+        connection = FakeConnection()
+        session = self.make_session()
+
+        async def run():
+            try:
+                await BotWebSocket(session, connection, pool=pool).ws_connect()
+                shared = pool.session()
+                # 断线重连使用同一个 ClientSession，不再重新创建连接器
+                await BotWebSocket(session, connection, pool=pool).ws_connect()
+                self.assertIs(shared, pool.session())
+                self.assertFalse(pool.closed)
+            finally:
+                await pool.close()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(2, self.connections)
+        # 每次关闭后 session 都交还给 ConnectionSession 等待重连
+        self.assertEqual([session, session], connection.sessions)
+
+    def test_closed_pool_stops_reconnect(self):
+        pool = ConnectionPool()
+        connection = FakeConnection()
+
+        async def run():
+            pool.session()
+            await pool.close()
+            await BotWebSocket(self.make_session(), connection, pool=pool).ws_connect()
+
+        self.loop.run_until_complete(run())
+        # Client 关闭后待执行的重连不再建立连接，也不再交还 session
+        self.assertEqual(0, self.connections)
+        self.assertEqual([], connection.sessions)
+
+
+class FakeToken:
+    async def check_token(self):
+        pass
+
+    def get_string(self):
+        return "QQBot token"
+
+
+class HeartbeatTestCase(GatewayTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        # 服务端只回复前 acks 次心跳，之后模拟半断开的连接
+        self.acks = 2
+        self.heartbeats = []
+
+    async def websocket(self, request):
+        self.connections += 1
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({"op": 10, "d": {"heartbeat_interval": 200}})
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                break
+            data = msg.json()
+            if data["op"] == 6:
+                await ws.send_json({"op": 0, "s": 1, "t": "RESUMED", "d": {}})
+            elif data["op"] == 1:
+                self.heartbeats.append(asyncio.get_event_loop().time())
+                if len(self.heartbeats) <= self.acks:
+                    await ws.send_json({"op": 11})
+        return ws
+
+    def test_interval_ack_and_dead_connection(self):
+        connection = FakeConnection()
+        connection.loop = self.loop
+        connection.parser = {"resumed": lambda msg: None}
+        session = self.make_session()
+        session["token"] = FakeToken()
+
+        class FastWebSocket(BotWebSocket):
+            HEARTBEAT_ACK_TIMEOUT = 0.1
+            CLOSE_TIMEOUT = 0.2
+
+        websocket = FastWebSocket(session, connection)
+
+        async def run():
+            await asyncio.wait_for(websocket.ws_connect(), 5)
+
+        self.loop.run_until_complete(run())
+        # 按 HELLO 下发的间隔(毫秒)发送心跳
+        self.assertEqual(0.2, websocket.heartbeat_interval)
+        self.assertAlmostEqual(0.2, self.heartbeats[1] - self.heartbeats[0], delta=0.08)
+        self.assertIsNotNone(websocket.latency)
+        # 连续丢失 2 次 ACK 后主动断开，丢失后立即重发心跳
+        self.assertEqual(4, len(self.heartbeats))
+        self.assertLess(self.heartbeats[3] - self.heartbeats[2], 0.15)
+        self.assertEqual(2, websocket.missed_acks)
+        # 断开后 session 交给 ConnectionSession 用于 resume
+        self.assertEqual([session], connection.sessions)
+        self.assertEqual("s", session["session_id"])
+
+
+class CompressionTestCase(GatewayTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.events = []
+        self.query = None
+        self.negotiated = None
+        self.event = {"op": 0, "s": 2, "t": "AT_MESSAGE_CREATE", "d": {"content": "你好" * 500, "id": "m"}}
+
+    async def websocket(self, request):
+        self.query = dict(request.query)
+        ws = web.WebSocketResponse(compress=True)
+        await ws.prepare(request)
+        self.negotiated = ws.compress
+        if request.query.get("compress") == "zlib-stream":
+            deflate = zlib.compressobj()
+            for payload in ({"op": 10, "d": {"heartbeat_interval": 45000}}, self.event):
+                data = deflate.compress(json.dumps(payload).encode()) + deflate.flush(zlib.Z_SYNC_FLUSH)
+                # 一条消息拆成两个帧发送
+                await ws.send_bytes(data[:10])
+                await ws.send_bytes(data[10:])
+        else:
+            await ws.send_json({"op": 10, "d": {"heartbeat_interval": 45000}})
+            await ws.send_json(self.event)
+        await ws.close(code=4009, message=b"session timed out")
+        return ws
+
+    def connect(self, compress: str) -> GatewayStats:
+        connection = FakeConnection()
+        connection.loop = self.loop
+        connection.parser = {"at_message_create": self.events.append}
+        session = self.make_session()
+        session["session_id"] = ""
+        session["token"] = FakeToken()
+        websocket = BotWebSocket(session, connection, compress=compress)
+        self.loop.run_until_complete(asyncio.wait_for(websocket.ws_connect(), 5))
+        self.assertEqual([session], connection.sessions)
+        return websocket.stats
+
+    def test_zlib_stream(self):
+        stats = self.connect("zlib-stream")
+        self.assertEqual({"compress": "zlib-stream"}, self.query)
+        self.assertEqual([self.event], self.events)
+        self.assertEqual(2, stats.messages)
+        self.assertGreater(stats.bytes_saved, 0)
+        self.assertLess(stats.wire_bytes, stats.payload_bytes)
+
+    def test_permessage_deflate(self):
+        stats = self.connect("deflate")
+        self.assertEqual({}, self.query)
+        self.assertEqual(15, self.negotiated)
+        self.assertEqual([self.event], self.events)
+        self.assertEqual(2, stats.messages)
+
+    def test_uncompressed(self):
+        self.connect(None)
+        self.assertFalse(self.negotiated)
+        self.assertEqual([self.event], self.events)
+
+    def test_unknown_compress(self):
+        with self.assertRaises(ValueError):
+            BotWebSocket(self.make_session(), FakeConnection(), compress="gzip")
+
+
+class ZlibStreamTestCase(unittest.TestCase):
+    def test_shared_context(self):
+        deflate = zlib.compressobj()
+        stream = _ZlibStream()
+        for text in (b'{"op":11}', b'{"op":0,"d":{}}', b'{"op":11}'):
+            data = deflate.compress(text) + deflate.flush(zlib.Z_SYNC_FLUSH)
+            self.assertIsNone(stream.feed(data[:3]))
+            self.assertEqual(text, stream.feed(data[3:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
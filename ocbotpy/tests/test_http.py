@@ -0,0 +1,1002 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import base64
+import io
+import mmap
+import os
+import pathlib
+import ssl
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from botpy.api import BotAPI
+from botpy.message import GroupMessage
+from botpy.cache import MediaCache, ResponseCache
+from botpy.errors import CircuitOpenError, DeadlineExceededError, RequestFailedError, SequenceNumberError, ServerError
+from botpy.robot import Token
+from botpy import codec
+from botpy import http as botpy_http
+from botpy.http import BotHttp, CircuitBreaker, ConnectionPool, HedgePolicy, Route, RouteTemplate
+from botpy.http import RetryPolicy, RetryRule, send_as_active
+from botpy.http import _Bucket, _PriorityGate, _RateLimiter, request_priority
+
+
+class RouteTestCase(unittest.TestCase):
+    def test_bucket_major_parameters(self):
+        route = Route("POST", "/v2/groups/{group_openid}/messages", group_openid="g1")
+        self.assertEqual("POST /v2/groups/{group_openid}/messages:g1", route.bucket)
+
+        other = Route("POST", "/v2/groups/{group_openid}/messages", group_openid="g2")
+        self.assertNotEqual(route.bucket, other.bucket)
+
+    def test_url(self):
+        route = Route("GET", "/channels/{channel_id}/messages/{message_id}", channel_id=1, message_id="m")
+        self.assertEqual("https://api.sgroup.qq.com/channels/1/messages/m", route.url)
+        route.is_sandbox = True
+        self.assertEqual("https://sandbox.api.sgroup.qq.com/channels/1/messages/m", route.url)
+        self.assertEqual("https://api.sgroup.qq.com/users/@me", Route("GET", "/users/@me").url)
+
+    def test_template_compiled_once(self):
+        a = Route("GET", "/guilds/{guild_id}", guild_id="1")
+        b = Route("GET", "/guilds/{guild_id}", guild_id="2")
+        self.assertIs(a.template, b.template)
+        self.assertIs(a.template, RouteTemplate.get("GET", "/guilds/{guild_id}"))
+        self.assertEqual("GET /guilds/{guild_id}", a.template.key)
+        self.assertEqual(("guild_id",), a.template.major_parameters)
+
+    def test_bucket_ignores_minor_parameters(self):
+        a = Route("GET", "/guilds/{guild_id}/members/{user_id}", guild_id="1", user_id="a")
+        b = Route("GET", "/guilds/{guild_id}/members/{user_id}", guild_id="1", user_id="b")
+        self.assertEqual(a.bucket, b.bucket)
+
+
+class BucketTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def test_learn_from_headers(self):
+        bucket = _Bucket("test", 1.0, 60.0)
+        headers = {"X-RateLimit-Limit": "5", "X-RateLimit-Remaining": "0", "X-RateLimit-Reset-After": "0.2"}
+        self.assertEqual(0.0, bucket.update(200, headers))
+        self.assertEqual(5, bucket.limit)
+        self.assertEqual(0, bucket.remaining)
+
+        start = time.monotonic()
+        self.loop.run_until_complete(bucket.acquire())
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertEqual(4, bucket.remaining)
+
+    def test_learn_from_429(self):
+        bucket = _Bucket("test", 0.1, 60.0)
+
+        async def burst():
+            for _ in range(4):
+                await bucket.acquire()
+
+        self.loop.run_until_complete(burst())
+        retry_after = bucket.update(429, {})
+        self.assertAlmostEqual(0.1, retry_after)
+        # 429前放行了4个请求，上限估算为3
+        self.assertEqual(3, bucket.limit)
+        self.assertEqual(0, bucket.remaining)
+
+        start = time.monotonic()
+        self.loop.run_until_complete(bucket.acquire())
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(2, bucket.remaining)
+
+    def test_learn_from_429_after_earlier_traffic(self):
+        bucket = _Bucket("test", 0.1, 60.0)
+
+        async def traffic():
+            for _ in range(50):
+                await bucket.acquire()
+            await asyncio.sleep(0.15)
+            for _ in range(4):
+                await bucket.acquire()
+
+        self.loop.run_until_complete(traffic())
+        bucket.update(429, {})
+        # 只统计 Retry-After 窗口内放行的请求，更早的请求不计入上限
+        self.assertEqual(3, bucket.limit)
+
+    def test_retry_after_header(self):
+        bucket = _Bucket("test", 1.0, 60.0)
+        self.assertEqual(2.5, bucket.update(429, {"Retry-After": "2.5"}))
+
+    def test_ratelimiter_reuses_bucket(self):
+        limiter = _RateLimiter()
+        route = Route("GET", "/channels/{channel_id}", channel_id="1")
+        self.assertIs(limiter.get_bucket(route.bucket), limiter.get_bucket(route.bucket))
+        self.assertEqual(1, len(limiter))
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+    def test_idempotent(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_idempotent(Route("GET", "/guilds/{guild_id}", guild_id="1")))
+        self.assertFalse(policy.is_idempotent(Route("POST", "/channels/{channel_id}/messages", channel_id="1"), {}))
+
+        group = Route("POST", "/v2/groups/{group_openid}/messages", group_openid="g")
+        self.assertTrue(policy.is_idempotent(group, {"msg_id": "m", "msg_seq": 2}))
+        # 主动消息没有 msg_id，重发会造成重复消息
+        self.assertFalse(policy.is_idempotent(group, {"msg_id": None, "msg_seq": 1}))
+
+    def test_rules(self):
+        policy = RetryPolicy(
+            max_retries=2,
+            method_rules={"get": RetryRule(max_retries=4)},
+            route_rules={"GET /gateway/bot": RetryRule(max_retries=0)},
+        )
+        self.assertEqual(4, policy.max_retries_for(Route("GET", "/users/@me")))
+        self.assertEqual(0, policy.max_retries_for(Route("GET", "/gateway/bot")))
+        self.assertEqual(2, policy.max_retries_for(Route("DELETE", "/channels/{channel_id}", channel_id="1")))
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=0.5, max_delay=1.0)
+        route = Route("GET", "/users/@me")
+        for attempt in range(5):
+            delay = policy.backoff(route, attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(1.0, 0.5 * 2**attempt))
+
+    def test_budget(self):
+        policy = RetryPolicy(max_retries=100, budget_capacity=2, budget_min_per_second=0)
+        route = Route("GET", "/users/@me")
+        self.assertTrue(policy.should_retry(route, 0, True))
+        self.assertTrue(policy.should_retry(route, 1, True))
+        # 预算耗尽后不再重试
+        self.assertFalse(policy.should_retry(route, 2, True))
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def test_keepalive_and_warmup(self):
+        peers = set()
+
+        async def handler(request):
+            peers.add(request.transport.get_extra_info("peername"))
+            return web.Response()
+
+        async def run():
+            app = web.Application()
+            app.router.add_route("*", "/", handler)
+            server = TestServer(app)
+            await server.start_server()
+            pool = ConnectionPool(warmup_connections=3)
+            try:
+                url = str(server.make_url("/"))
+                self.assertEqual(3, await pool.warmup(url))
+                session = pool.session()
+                self.assertIs(session, pool.session())
+                for _ in range(6):
+                    async with session.get(url) as response:
+                        await response.read()
+            finally:
+                await pool.close()
+                await server.close()
+
+        self.loop.run_until_complete(run())
+        # 预热建立的3个连接被后续请求复用
+        self.assertEqual(3, len(peers))
+
+    def test_ssl_verification(self):
+        # 默认校验服务端证书，只有显式关闭时才不校验
+        context = ConnectionPool().ssl_context
+        self.assertEqual(ssl.CERT_REQUIRED, context.verify_mode)
+        self.assertTrue(context.check_hostname)
+        context = ConnectionPool(verify_ssl=False).ssl_context
+        self.assertEqual(ssl.CERT_NONE, context.verify_mode)
+        self.assertFalse(context.check_hostname)
+
+    def test_closed_pool_does_not_reopen(self):
+        async def run():
+            pool = ConnectionPool()
+            session = pool.session()
+            await pool.close()
+            self.assertTrue(session.closed)
+            self.assertTrue(pool.closed)
+            # 关闭后不再悄悄创建没有人负责关闭的新会话
+            with self.assertRaises(RuntimeError):
+                pool.session()
+
+        self.loop.run_until_complete(run())
+
+
+class PriorityGateTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def run_order(self, gate, arrivals):
+        order = []
+
+        async def worker(name, priority, delay):
+            await asyncio.sleep(delay)
+            async with gate(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            # 先占满并发数，后续请求都需要排队
+            async with gate(botpy_http.PRIORITY_NORMAL):
+                tasks = [asyncio.ensure_future(worker(*arrival)) for arrival in arrivals]
+                await asyncio.sleep(0.05)
+            await asyncio.gather(*tasks)
+
+        self.loop.run_until_complete(run())
+        return order
+
+    def test_priority_first(self):
+        gate = _PriorityGate(1, aging=10)
+        arrivals = [
+            ("bg1", botpy_http.PRIORITY_BACKGROUND, 0),
+            ("bg2", botpy_http.PRIORITY_BACKGROUND, 0.001),
+            ("reply", botpy_http.PRIORITY_INTERACTIVE, 0.02),
+        ]
+        self.assertEqual(["reply", "bg1", "bg2"], self.run_order(gate, arrivals))
+        self.assertEqual(0, gate._active)
+
+    def test_aging(self):
+        # 低优先级请求等待超过 aging 后排在新到达的高优先级请求之前
+        gate = _PriorityGate(1, aging=0.005)
+        arrivals = [
+            ("bg", botpy_http.PRIORITY_BACKGROUND, 0),
+            ("reply", botpy_http.PRIORITY_INTERACTIVE, 0.03),
+        ]
+        self.assertEqual(["bg", "reply"], self.run_order(gate, arrivals))
+
+    def test_cancelled_waiter(self):
+        gate = _PriorityGate(1)
+
+        async def run():
+            await gate.acquire(0)
+            waiter = asyncio.ensure_future(gate.acquire(0))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            gate.release()
+            self.assertEqual(0, gate._active)
+
+        self.loop.run_until_complete(run())
+
+    def test_default_priority(self):
+        group = Route("POST", "/v2/groups/{group_openid}/messages", group_openid="g")
+        self.assertEqual(botpy_http.PRIORITY_INTERACTIVE, BotHttp._priority(group, {"msg_id": "m"}))
+        self.assertEqual(botpy_http.PRIORITY_NORMAL, BotHttp._priority(group, {"msg_id": None}))
+        with request_priority(botpy_http.PRIORITY_BACKGROUND):
+            self.assertEqual(botpy_http.PRIORITY_BACKGROUND, BotHttp._priority(group, {"msg_id": "m"}))
+
+
+class ServerTestCase(unittest.TestCase):
+    """使用本地 aiohttp 服务端代替 OpenAPI 的测试基类"""
+
+    def setUp(self) -> None:
+        # cleanup 按注册的逆序执行，事件循环最后关闭
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.hits = 0
+        self.app = web.Application()
+        self.app.router.add_route("*", "/{tail:.*}", self.handler)
+        self.server = TestServer(self.app, loop=self.loop)
+        self.loop.run_until_complete(self.server.start_server())
+        self.addCleanup(lambda: self.loop.run_until_complete(self.server.close()))
+        patcher = mock.patch.multiple(Route, SCHEME="http", DOMAIN="%s:%s" % (self.server.host, self.server.port))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def handler(self, request):
+        self.hits += 1
+        await asyncio.sleep(0.05)
+        return web.json_response({"path": request.path, "hits": self.hits})
+
+    def make_http(self, **kwargs) -> BotHttp:
+        http = BotHttp(timeout=5, **kwargs)
+        token = Token("app", "secret")
+        token.access_token = "token"
+        token.expires_in = time.time() + 7200
+        http._token = token
+        self.addCleanup(lambda: self.loop.run_until_complete(http.close()))
+        return http
+
+
+class CoalesceTestCase(ServerTestCase):
+    def test_coalesce_identical_get(self):
+        http = self.make_http(coalesce_requests=True)
+
+        async def run():
+            route = lambda: Route("GET", "/guilds/{guild_id}/channels", guild_id="1")  # noqa: E731
+            return await asyncio.gather(*(http.request(route()) for _ in range(10)))
+
+        results = self.loop.run_until_complete(run())
+        self.assertEqual(1, self.hits)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_different_params_not_coalesced(self):
+        http = self.make_http(coalesce_requests=True)
+
+        async def run():
+            route = Route("GET", "/guilds/{guild_id}/members", guild_id="1")
+            await asyncio.gather(
+                http.request(route, params={"after": "0", "limit": 400}),
+                http.request(route, params={"after": "9", "limit": 400}),
+            )
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(2, self.hits)
+
+    def test_priority_and_deadline_not_shared(self):
+        http = self.make_http(coalesce_requests=True)
+
+        async def run():
+            route = lambda: Route("GET", "/guilds/{guild_id}", guild_id="1")  # noqa: E731
+            await asyncio.gather(
+                http.request(route(), priority=botpy_http.PRIORITY_BACKGROUND),
+                http.request(route(), priority=botpy_http.PRIORITY_INTERACTIVE),
+                http.request(route(), deadline=time.time() + 5),
+                http.request(route(), deadline=time.time() + 5),
+            )
+
+        self.loop.run_until_complete(run())
+        # 不同优先级分别请求，带截止时间的请求各自单独发送
+        self.assertEqual(4, self.hits)
+
+    def test_metrics(self):
+        http = self.make_http()
+        self.loop.run_until_complete(http.request(Route("GET", "/guilds/{guild_id}", guild_id="1")))
+        stats = http.metrics.routes["GET /guilds/{guild_id}"]
+        self.assertEqual({200: 1}, stats.statuses)
+        self.assertEqual(0, stats.in_flight)
+        self.assertGreaterEqual(stats.latency_sum, 0.05)
+
+
+class ResponseCacheTestCase(ServerTestCase):
+    def test_cache_hit_and_write_invalidation(self):
+        http = self.make_http(cache=ResponseCache())
+
+        async def run():
+            route = lambda: Route("GET", "/channels/{channel_id}", channel_id="1")  # noqa: E731
+            first = await http.request(route())
+            self.assertIs(first, await http.request(route()))
+            self.assertEqual(1, self.hits)
+
+            await http.request(Route("PATCH", "/channels/{channel_id}", channel_id="1"), json={"name": "new"})
+            await http.request(route())
+            self.assertEqual(3, self.hits)
+
+        self.loop.run_until_complete(run())
+
+
+class GlobalRateLimitTestCase(ServerTestCase):
+    async def handler(self, request):
+        self.hits += 1
+        if self.hits == 1:
+            body = {"code": 22009, "message": "global limit"}
+            return web.json_response(body, status=429, headers={"Retry-After": "0.2", "X-RateLimit-Global": "1"})
+        return web.json_response({"hits": self.hits})
+
+    def test_without_login(self):
+        # 未 login 直接使用 BotHttp，全局限频结束后请求继续发送而不是一直等待
+        http = self.make_http()
+        route = Route("GET", "/users/@me")
+
+        async def run():
+            first = asyncio.ensure_future(http.request(route))
+            await asyncio.sleep(0.1)
+            # 等待全局限频期间不占用并发名额
+            self.assertFalse(http._global_over.is_set())
+            self.assertEqual(0, http.gate._active)
+            self.assertEqual({"hits": 2}, await asyncio.wait_for(first, 2))
+            self.assertEqual({"hits": 3}, await asyncio.wait_for(http.request(route), 2))
+
+        self.loop.run_until_complete(run())
+        self.assertTrue(http._global_over.is_set())
+
+
+class PriorityTestCase(ServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.order = []
+        self.release = asyncio.Event()
+
+    async def handler(self, request):
+        index = len(self.order)
+        self.order.append(request.path)
+        await self.release.wait()
+        # 依次返回，每次只空出一个并发名额
+        await asyncio.sleep(0.02 * index)
+        return web.json_response({})
+
+    def test_reply_overtakes_background(self):
+        # 默认配置下请求在按优先级放行的闸门中排队，被动回复越过排队中的后台请求
+        http = self.make_http()
+        limit = http.gate.limit
+        self.assertLess(limit, http.pool.limit)
+
+        async def run():
+            with request_priority(botpy_http.PRIORITY_BACKGROUND):
+                background = [
+                    asyncio.ensure_future(http.request(Route("GET", "/guilds/{guild_id}", guild_id=str(i))))
+                    for i in range(limit + 3)
+                ]
+            while len(self.order) < limit:
+                await asyncio.sleep(0.01)
+            self.assertEqual(3, http.gate.waiting)
+            reply = Route("POST", "/v2/groups/{group_openid}/messages", group_openid="g")
+            task = asyncio.ensure_future(http.request(reply, json={"content": "hi", "msg_id": "m", "msg_seq": 1}))
+            await asyncio.sleep(0.05)
+            self.release.set()
+            await asyncio.gather(task, *background)
+
+        self.loop.run_until_complete(run())
+        self.assertEqual("/v2/groups/g/messages", self.order[limit])
+
+
+class UploadTestCase(ServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.limited = 0
+        self.data = os.urandom(300 * 1024)
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as file:
+            file.write(self.data)
+        self.addCleanup(os.remove, self.path)
+
+    async def handler(self, request):
+        self.hits += 1
+        if self.hits <= self.limited:
+            body = {"code": 22009, "message": "msg limit exceed"}
+            return web.json_response(body, status=429, headers={"Retry-After": "0.01"})
+        fields = {}
+        async for part in await request.multipart():
+            fields[part.name] = await part.read()
+        return web.json_response(
+            {"chunked": request.headers.get("Transfer-Encoding") == "chunked", "size": len(fields["file_image"]),
+             "same": fields["file_image"] == self.data, "content": fields["content"].decode()}
+        )
+
+    def send(self, file_image):
+        http = self.make_http()
+        route = Route("POST", "/channels/{channel_id}/messages", channel_id="1")
+        payload = {"content": "hi", "file_image": file_image, "msg_id": None}
+        return self.loop.run_until_complete(http.request(route, json=payload))
+
+    def test_stream_path(self):
+        result = self.send(self.path)
+        self.assertEqual({"chunked": True, "size": len(self.data), "same": True, "content": "hi"}, result)
+
+    def test_stream_async_iterator(self):
+        async def chunks():
+            for i in range(0, len(self.data), 4096):
+                yield self.data[i:i + 4096]
+
+        self.assertTrue(self.send(chunks())["same"])
+
+    def test_bytes(self):
+        self.assertTrue(self.send(self.data)["same"])
+
+    def test_replay_file_object(self):
+        self.limited = 1
+        with open(self.path, "rb") as file:
+            result = self.send(file)
+            self.assertFalse(file.closed)
+        self.assertTrue(result["same"])
+        self.assertEqual(2, self.hits)
+
+    def test_unseekable_not_replayed(self):
+        self.limited = 1
+
+        class Unseekable(io.RawIOBase):
+            def __init__(self, data):
+                self._buffer = io.BytesIO(data)
+
+            def readable(self):
+                return True
+
+            def read(self, size=-1):
+                return self._buffer.read(size)
+
+            def tell(self):
+                raise OSError("unseekable")
+
+        with self.assertRaises(SequenceNumberError):
+            self.send(Unseekable(self.data))
+        self.assertEqual(1, self.hits)
+
+    def test_missing_path(self):
+        http = self.make_http()
+        api = BotAPI(http)
+        missing = os.path.join(tempfile.gettempdir(), "botpy-missing-%s.png" % os.getpid())
+        # 本地文件的错误原样交给调用方，不当作连接异常重试或计入熔断
+        with self.assertRaises(FileNotFoundError):
+            self.loop.run_until_complete(api.post_message("c", content="hi", file_image=missing))
+        with self.assertRaises(FileNotFoundError):
+            self.loop.run_until_complete(api.post_dms("g", content="hi", file_image=pathlib.Path(missing)))
+        self.assertEqual(0, self.hits)
+        stats = http.metrics.route("POST /channels/{channel_id}/messages")
+        self.assertEqual(0, stats.connection_errors)
+        self.assertEqual(CircuitBreaker.CLOSED, http.circuit_breaker.state("POST /channels/{channel_id}/messages"))
+
+    def test_read_error_not_counted(self):
+        class Broken(io.BytesIO):
+            def read(self, size=-1):
+                raise OSError("disk error")
+
+        http = self.make_http()
+        route = Route("POST", "/channels/{channel_id}/messages", channel_id="1")
+        payload = {"content": "hi", "file_image": Broken(), "msg_id": None}
+        with self.assertRaises(OSError) as ctx:
+            self.loop.run_until_complete(http.request(route, json=payload))
+        self.assertEqual("disk error", str(ctx.exception))
+        stats = http.metrics.route(route.template.key)
+        self.assertEqual((0, 0), (stats.connection_errors, stats.retries))
+        self.assertEqual(CircuitBreaker.CLOSED, http.circuit_breaker.state(route.template.key))
+
+
+class Base64UploadTestCase(ServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.limited = 0
+        self.data = os.urandom(300 * 1024 + 1)
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as file:
+            file.write(self.data)
+        self.addCleanup(os.remove, self.path)
+
+    async def handler(self, request):
+        self.hits += 1
+        if self.hits <= self.limited:
+            body = {"code": 22009, "message": "msg limit exceed"}
+            return web.json_response(body, status=429, headers={"Retry-After": "0.01"})
+        body = await request.json()
+        return web.json_response(
+            {"length": request.content_length, "same": base64.b64decode(body.pop("file_data")) == self.data,
+             "body": body}
+        )
+
+    def upload(self, file_data):
+        http = self.make_http()
+        api = BotAPI(http, media_cache=MediaCache())
+        return self.loop.run_until_complete(api.post_group_file("g", file_type=1, file_data=file_data))
+
+    def test_buffers(self):
+        for file_data in (self.data, bytearray(self.data), memoryview(self.data)):
+            result = self.upload(file_data)
+            self.assertTrue(result["same"])
+            self.assertEqual({"group_openid": "g", "file_type": 1, "srv_send_msg": False}, result["body"])
+        # 内容相同的上传命中同一个 key
+        key = MediaCache.key("group", "g", 1, self.data)
+        self.assertEqual(key, MediaCache.key("group", "g", 1, memoryview(self.data)))
+
+    def test_mmap_and_path(self):
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            self.assertTrue(self.upload(mapped)["same"])
+        result = self.upload(pathlib.Path(self.path))
+        self.assertTrue(result["same"])
+        # 长度可以预先算出，不使用分块传输
+        self.assertIsNotNone(result["length"])
+
+    def test_replay_file_object(self):
+        self.limited = 1
+        with open(self.path, "rb") as file:
+            self.assertTrue(self.upload(file)["same"])
+        self.assertEqual(2, self.hits)
+
+    def test_str_unchanged(self):
+        result = self.upload(base64.b64encode(self.data).decode())
+        self.assertTrue(result["same"])
+
+    def test_encode_chunks(self):
+        async def chunks(sizes):
+            start = 0
+            for size in sizes:
+                yield self.data[start:start + size]
+                start += size
+
+        async def encode(source):
+            return b"".join([chunk async for chunk in botpy_http._b64encode_chunks(source)])
+
+        expected = base64.b64encode(self.data[:1000])
+        for sizes in ((1000,), (1, 1, 1, 997), (2, 500, 7, 491), (999, 1)):
+            self.assertEqual(expected, self.loop.run_until_complete(encode(chunks(sizes))))
+        self.assertEqual(base64.b64encode(self.data), self.loop.run_until_complete(encode(self.data)))
+
+
+class BatchSendTestCase(ServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.received = []
+        self.limited = set()
+
+    async def handler(self, request):
+        body = await request.json()
+        self.received.append(body)
+        await asyncio.sleep(0.1)
+        if body.get("content") in self.limited:
+            # 每条只限频一次
+            self.limited.discard(body["content"])
+            return web.json_response({"code": 22009, "message": "limit"}, status=429, headers={"Retry-After": "0.01"})
+        if body.get("content") == "bad":
+            return web.json_response({"code": 40054005, "message": "消息被去重"}, status=400)
+        return web.json_response({"id": "m%s" % body["msg_seq"]})
+
+    def test_ordered(self):
+        api = BotAPI(self.make_http())
+        parts = ["a", {"msg_type": 7, "media": {"file_info": "f"}}, "bad", "c"]
+        self.limited = {"a"}
+
+        async def run():
+            return await api.post_group_messages("g", parts, msg_id="m")
+
+        results = self.loop.run_until_complete(run())
+        # 第一条被限频重发时后面的消息等待，到达顺序与 parts 一致
+        self.assertEqual(["a", "a", None, "bad", "c"], [body.get("content") for body in self.received])
+        self.assertEqual([1, 1, 2, 3, 4], [body["msg_seq"] for body in self.received])
+        self.assertTrue(all(body["msg_id"] == "m" for body in self.received))
+        self.assertEqual({"id": "m1"}, results[0])
+        self.assertIsInstance(results[2], Exception)
+        self.assertEqual({"id": "m4"}, results[3])
+
+        # 同一个 msg_id 后续分配的序号不会重复
+        self.assertEqual(5, api.next_msg_seq("m"))
+        self.assertEqual(1, api.next_msg_seq(None))
+
+    def test_unordered_pipeline(self):
+        api = BotAPI(self.make_http())
+
+        async def run():
+            return await api.post_group_messages("g", ["a", "b", "c", "d"], msg_id="m", ordered=False)
+
+        start = time.monotonic()
+        results = self.loop.run_until_complete(run())
+        # 并发发出，总耗时远小于逐条发送的 4 * 0.1 秒
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertEqual([{"id": "m%s" % seq} for seq in range(1, 5)], results)
+
+    def test_many_msg_ids(self):
+        api = BotAPI(self.make_http())
+        self.assertEqual(1, api.next_msg_seq("m", 2))
+        for i in range(5000):
+            api.next_msg_seq("other-%s" % i)
+        # 有效期内回复过的 msg_id 不会因为条数过多被淘汰而重新从 1 开始
+        self.assertEqual(3, api.next_msg_seq("m"))
+
+    def test_reply_then_batch(self):
+        api = BotAPI(self.make_http())
+        message = GroupMessage(api, "e", {"id": "m", "group_openid": "g", "timestamp": str(int(time.time()))})
+
+        async def run():
+            await message.reply(content="first")
+            await api.post_group_messages("g", ["a", "b"], msg_id="m")
+            # 显式传入的序号也会被记录
+            await api.post_group_message("g", content="c", msg_id="m", msg_seq=10)
+            await message.reply(content="last")
+
+        self.loop.run_until_complete(run())
+        self.assertEqual([1, 2, 3, 10, 11], [body["msg_seq"] for body in self.received])
+
+
+class RequestFailedTestCase(ServerTestCase):
+    async def handler(self, request):
+        self.hits += 1
+        await asyncio.sleep(0.5)
+        return web.json_response({})
+
+    def test_timeout_raises(self):
+        http = self.make_http()
+        http.timeout = 0.1
+        api = BotAPI(http)
+        # 没有 msg_seq 的频道消息不能安全重试，超时后直接抛出而不是返回 None
+        with self.assertRaises(RequestFailedError) as ctx:
+            self.loop.run_until_complete(api.post_message("c", content="hi"))
+        self.assertEqual(1, self.hits)
+        self.assertEqual(0, ctx.exception.retries)
+        self.assertEqual(1, http.metrics.route("POST /channels/{channel_id}/messages").timeouts)
+
+        # 分页遍历时异常交给迭代的调用方
+        async def iterate():
+            return [member async for member in api.iter_guild_members("g")]
+
+        with self.assertRaises(RequestFailedError):
+            self.loop.run_until_complete(iterate())
+
+
+class CompactPayloadTestCase(ServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.received = []
+
+    async def handler(self, request):
+        self.received.append(await request.read())
+        return web.json_response({"id": "m"})
+
+    def test_drop_none_and_fragment(self):
+        api = BotAPI(self.make_http())
+        keyboard = codec.Fragment({"id": "kb"})
+
+        async def run():
+            await api.post_group_message("g", msg_type=2, markdown={"content": "# hi"}, keyboard=keyboard, msg_id="m")
+            await api.post_c2c_message("u", content="hi")
+
+        self.loop.run_until_complete(run())
+        group, c2c = [codec.loads(body) for body in self.received]
+        self.assertEqual(
+            {
+                "group_openid": "g",
+                "msg_type": 2,
+                "markdown": {"content": "# hi"},
+                "keyboard": {"id": "kb"},
+                "msg_id": "m",
+                "msg_seq": 1,
+            },
+            group,
+        )
+        self.assertEqual({"openid": "u", "msg_type": 0, "content": "hi"}, c2c)
+        self.assertNotIn(b"null", self.received[1])
+
+
+class MediaCacheTestCase(ServerTestCase):
+    async def handler(self, request):
+        self.hits += 1
+        await asyncio.sleep(0.05)
+        return web.json_response({"file_uuid": "u%s" % self.hits, "file_info": "info%s" % self.hits, "ttl": 3600})
+
+    def test_reuse_upload(self):
+        api = BotAPI(self.make_http(), media_cache=MediaCache())
+
+        async def run():
+            first = await asyncio.gather(*(api.post_group_file("g", 1, "aW1n") for _ in range(3)))
+            again = await api.post_group_file("g", 1, "aW1n")
+            other_group = await api.post_group_file("g2", 1, "aW1n")
+            sent = await api.post_group_file("g", 1, "aW1n", srv_send_msg=True)
+            return first, again, other_group, sent
+
+        first, again, other_group, sent = self.loop.run_until_complete(run())
+        self.assertEqual(["info1"] * 3, [media["file_info"] for media in first])
+        self.assertEqual("info1", again["file_info"])
+        self.assertEqual("info2", other_group["file_info"])
+        self.assertEqual("info3", sent["file_info"])
+        self.assertEqual(3, self.hits)
+
+
+class CircuitBreakerTestCase(ServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.healthy = False
+
+    async def handler(self, request):
+        self.hits += 1
+        if request.path.endswith("/files") and not self.healthy:
+            return web.json_response({"code": 500, "message": "busy"}, status=503)
+        return web.json_response({"path": request.path})
+
+    def test_open_and_recover(self):
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=0.2)
+        http = self.make_http(circuit_breaker=breaker, retry_policy=RetryPolicy(max_retries=0))
+        files = Route("POST", "/v2/groups/{group_openid}/files", group_openid="g")
+
+        async def run():
+            for _ in range(2):
+                with self.assertRaises(ServerError):
+                    await http.request(files, json={"file_type": 1})
+            self.assertEqual(CircuitBreaker.OPEN, breaker.state(files.template.key))
+            with self.assertRaises(CircuitOpenError):
+                await http.request(files, json={"file_type": 1})
+            self.assertEqual(2, self.hits)
+            # 其他接口不受影响
+            await http.request(Route("GET", "/users/@me"))
+
+            await asyncio.sleep(0.25)
+            self.healthy = True
+            await http.request(files, json={"file_type": 1})
+            self.assertEqual(CircuitBreaker.CLOSED, breaker.state(files.template.key))
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(1, http.metrics.routes[files.template.key].rejected)
+
+    def test_token_failure_not_counted(self):
+        class BrokenToken(Token):
+            async def check_token(self):
+                raise aiohttp.ClientConnectionError("token server down")
+
+        http = self.make_http(circuit_breaker=CircuitBreaker(failure_threshold=2))
+        token = http._token
+        http._token = BrokenToken("app", "secret")
+        route = Route("POST", "/channels/{channel_id}/messages", channel_id="1")
+
+        async def run():
+            for _ in range(3):
+                with self.assertRaises(RequestFailedError):
+                    await http.request(route, json={"content": "hi"})
+            # 获取 access_token 失败不算作接口故障，恢复后正常发送
+            self.assertEqual(CircuitBreaker.CLOSED, http.circuit_breaker.state(route.template.key))
+            http._token = token
+            await http.request(route, json={"content": "hi"})
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(1, self.hits)
+        self.assertEqual(0, http.metrics.routes[route.template.key].connection_errors)
+
+    def test_local_upload_failure_not_counted(self):
+        http = self.make_http(circuit_breaker=CircuitBreaker(failure_threshold=2))
+        api = BotAPI(http)
+
+        async def run():
+            with tempfile.TemporaryDirectory() as directory:
+                for _ in range(3):
+                    # 目录不能作为文件读取
+                    with self.assertRaises(OSError):
+                        await api.post_message("c1", content="hi", file_image=directory)
+            await api.post_message("c2", content="hi")
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(1, self.hits)
+        template = "POST /channels/{channel_id}/messages"
+        self.assertEqual(CircuitBreaker.CLOSED, http.circuit_breaker.state(template))
+
+
+class HedgeTestCase(ServerTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.slow = set()
+        self.cancelled = 0
+
+    async def handler(self, request):
+        self.hits += 1
+        if self.hits in self.slow:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        return web.json_response({"hits": self.hits})
+
+    def test_slow_request_hedged(self):
+        http = self.make_http(hedge_policy=HedgePolicy(min_samples=0, min_delay=0.05))
+        self.slow = {1}
+
+        async def run():
+            start = time.monotonic()
+            data = await http.request(Route("GET", "/channels/{channel_id}", channel_id="1"))
+            return data, time.monotonic() - start
+
+        data, elapsed = self.loop.run_until_complete(run())
+        self.assertEqual(2, data["hits"])
+        self.assertLess(elapsed, 0.5)
+        stats = http.metrics.routes["GET /channels/{channel_id}"]
+        self.assertEqual((1, 1), (stats.hedges, stats.hedge_wins))
+        self.assertEqual(0, stats.in_flight)
+
+    def test_fast_request_not_hedged(self):
+        http = self.make_http(hedge_policy=HedgePolicy(min_samples=0, min_delay=0.2))
+        self.loop.run_until_complete(http.request(Route("GET", "/channels/{channel_id}", channel_id="1")))
+        self.assertEqual(1, self.hits)
+
+    def test_hedge_respects_bucket_and_routes(self):
+        policy = HedgePolicy(routes=["GET /channels/{channel_id}"], min_samples=0, min_delay=0.05)
+        http = self.make_http(hedge_policy=policy)
+        self.slow = {1}
+
+        async def run():
+            route = Route("GET", "/channels/{channel_id}", channel_id="1")
+            # 桶内额度已经用完，对冲请求不能再占用额度
+            bucket = http.ratelimiter.get_bucket(route.bucket)
+            bucket.limit, bucket.remaining, bucket.reset_at = 1, 1, time.monotonic() + 60
+            await http.request(route)
+            # 不在 routes 内的接口和非 GET 请求不对冲
+            await http.request(Route("GET", "/guilds/{guild_id}", guild_id="1"))
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(2, self.hits)
+        self.assertEqual(0, http.metrics.routes["GET /channels/{channel_id}"].hedges)
+
+    def test_min_samples(self):
+        policy = HedgePolicy(min_samples=20)
+        http = self.make_http(hedge_policy=policy)
+        stats = http.metrics.route("GET /channels/{channel_id}")
+        self.assertIsNone(policy.delay(stats))
+        for _ in range(20):
+            http.metrics.observe(stats, 0.3, 200, "url")
+        self.assertTrue(0.05 <= policy.delay(stats) <= 0.3)
+
+
+class DeadlineTestCase(ServerTestCase):
+    async def handler(self, request):
+        self.hits += 1
+        if request.path.endswith("/busy"):
+            return web.json_response({"code": 500, "message": "busy"}, status=503)
+        body = await request.json() if request.can_read_body else None
+        return web.json_response({"path": request.path, "body": body})
+
+    def test_expired_rejected_locally(self):
+        http = self.make_http()
+        route = Route("POST", "/v2/groups/{group_openid}/messages", group_openid="g")
+        with self.assertRaises(DeadlineExceededError):
+            self.loop.run_until_complete(
+                http.request(route, deadline=time.time() - 1, json={"content": "hi", "msg_id": "m"})
+            )
+        self.assertEqual(0, self.hits)
+        self.assertEqual(1, http.metrics.routes[route.template.key].expired)
+        # 未过期的请求正常发送
+        data = self.loop.run_until_complete(http.request(route, deadline=time.time() + 60, json={"content": "hi"}))
+        self.assertEqual({"content": "hi"}, data["body"])
+
+    def test_send_as_active_fallback(self):
+        http = self.make_http(deadline_fallback=send_as_active)
+        route = Route("POST", "/v2/groups/{group_openid}/messages", group_openid="g")
+        data = self.loop.run_until_complete(
+            http.request(route, deadline=time.time() - 1, json={"content": "hi", "msg_id": "m", "msg_seq": 2})
+        )
+        self.assertEqual({"content": "hi"}, data["body"])
+        # 不是消息接口时不降级
+        with self.assertRaises(DeadlineExceededError):
+            self.loop.run_until_complete(
+                http.request(Route("GET", "/guilds/{guild_id}", guild_id="1"), deadline=time.time() - 1)
+            )
+        self.assertEqual(1, self.hits)
+
+    def test_retry_not_scheduled_past_deadline(self):
+        http = self.make_http(retry_policy=RetryPolicy(max_retries=3, base_delay=10, max_delay=10))
+        with mock.patch.object(botpy_http.random, "uniform", return_value=10):
+            with self.assertRaises(DeadlineExceededError):
+                self.loop.run_until_complete(
+                    http.request(Route("GET", "/guilds/{guild_id}", guild_id="busy"), deadline=time.time() + 2)
+                )
+        self.assertEqual(1, self.hits)
+
+    def test_message_reply_deadline(self):
+        http = self.make_http()
+        api = BotAPI(http)
+        stale = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(time.time() - 301))
+        message = GroupMessage(api, "e", {"id": "m", "group_openid": "g", "timestamp": stale, "author": {}})
+        self.assertTrue(message.expired)
+        self.assertLess(message.remaining, 0)
+        with self.assertRaises(DeadlineExceededError):
+            self.loop.run_until_complete(message.reply(content="late"))
+        self.assertEqual(0, self.hits)
+
+        fresh = GroupMessage(api, "e", {"id": "m", "group_openid": "g", "timestamp": str(int(time.time()))})
+        self.assertAlmostEqual(300, fresh.remaining, delta=2)
+        self.loop.run_until_complete(fresh.reply(content="hi"))
+        self.assertEqual(1, self.hits)
+        self.assertIsNone(GroupMessage(api, "e", {}).remaining)
+
+
+class CircuitBreakerUnitTestCase(unittest.TestCase):
+    def test_half_open_failure_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05, half_open_max_calls=1)
+        breaker.record_failure("t")
+        self.assertGreater(breaker.allow("t"), 0)
+        time.sleep(0.06)
+        self.assertEqual(0, breaker.allow("t"))
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state("t"))
+        # 同时只放行一个试探请求
+        self.assertGreater(breaker.allow("t"), 0)
+        breaker.record_failure("t")
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state("t"))
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(failure_threshold=0)
+        for _ in range(10):
+            breaker.record_failure("t")
+        self.assertEqual(0, breaker.allow("t"))
+
+
+if __name__ == "__main__":
+    unittest.main()
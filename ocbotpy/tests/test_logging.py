@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging as std_logging
+import unittest
+
+from botpy import logging
+
+
+class PayloadTestCase(unittest.TestCase):
+    def tearDown(self) -> None:
+        logging.configure_logging(
+            payload_limit=logging.DEFAULT_PAYLOAD_LIMIT, payload_sample=logging.DEFAULT_PAYLOAD_SAMPLE
+        )
+
+    def test_lazy(self):
+        class Unformattable:
+            def __str__(self):
+                raise AssertionError("不应被格式化")
+
+        logger = std_logging.getLogger("botpy.test.lazy")
+        logger.setLevel(std_logging.INFO)
+        self.assertFalse(logging.payload_enabled(logger))
+        logger.debug("%s", logging.Payload(Unformattable()))
+
+    def test_truncate(self):
+        logging.configure_logging(payload_limit=4)
+        self.assertEqual("abcd...(共6字符)", str(logging.Payload(b"abcdef")))
+        self.assertEqual("abc", str(logging.Payload("abc")))
+        logging.configure_logging(payload_limit=0)
+        self.assertEqual("abcdef", str(logging.Payload("abcdef")))
+
+    def test_sample(self):
+        logger = std_logging.getLogger("botpy.test.sample")
+        logger.setLevel(std_logging.DEBUG)
+        logging.configure_logging(payload_sample=4)
+        self.assertEqual(2, sum(logging.payload_enabled(logger) for _ in range(8)))
+
+
+if __name__ == "__main__":
+    unittest.main()
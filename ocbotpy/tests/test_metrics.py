@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import unittest
+
+from botpy.metrics import Metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.metrics = Metrics(buckets=(0.1, 0.5, 1.0), slow_threshold=0.8)
+        route = self.metrics.route("GET /users/@me")
+        for _ in range(90):
+            self.metrics.observe(route, 0.05, 200, "/users/@me")
+        for _ in range(9):
+            self.metrics.observe(route, 0.3, 200, "/users/@me")
+        self.metrics.observe(route, 0.9, 429, "/users/@me", "trace")
+        route.rate_limited += 1
+
+    def test_percentile(self):
+        route = self.metrics.route("GET /users/@me")
+        self.assertIs(route, self.metrics.routes["GET /users/@me"])
+        self.assertLessEqual(route.percentile(0.5), 0.1)
+        self.assertGreater(route.percentile(0.95), 0.1)
+        self.assertLessEqual(route.percentile(0.95), 0.5)
+        self.assertLessEqual(route.percentile(1.0), 0.9)
+        self.assertEqual(0.0, self.metrics.route("GET /gateway/bot").percentile(0.5))
+
+    def test_as_dict(self):
+        data = self.metrics.as_dict()
+        route = data["routes"]["GET /users/@me"]
+        self.assertEqual(100, route["count"])
+        self.assertEqual({200: 99, 429: 1}, route["statuses"])
+        self.assertEqual(1, route["errors"])
+        self.assertEqual(1, route["rate_limited"])
+        self.assertEqual("trace", data["slow_calls"][0]["trace_id"])
+
+    def test_prometheus(self):
+        text = self.metrics.to_prometheus()
+        self.assertIn('botpy_http_request_duration_seconds_bucket{route="GET /users/@me",le="0.1"} 90', text)
+        self.assertIn('botpy_http_request_duration_seconds_bucket{route="GET /users/@me",le="+Inf"} 100', text)
+        self.assertIn('botpy_http_responses_total{route="GET /users/@me",status="429"} 1', text)
+        self.assertIn('botpy_http_rate_limited_total{route="GET /users/@me"} 1', text)
+        self.assertIn('botpy_http_in_flight{route="GET /users/@me"} 0', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
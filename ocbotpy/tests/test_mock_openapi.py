@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+from botpy.api import BotAPI
+from botpy.ext.mock_openapi import MockOpenAPI
+from botpy.http import BotHttp, Route
+from botpy.robot import Token
+
+
+class MockOpenAPITestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_with_server(self, coro_func, **kwargs) -> MockOpenAPI:
+        async def run():
+            async with MockOpenAPI(**kwargs) as server:
+                http = BotHttp(timeout=5, app_id="app", secret="secret")
+                try:
+                    await coro_func(server, BotAPI(http))
+                finally:
+                    await http.close()
+            return server
+
+        return self.loop.run_until_complete(run())
+
+    def test_token_and_messages(self):
+        async def run(server, api):
+            self.assertEqual("http", Route.SCHEME)
+            me = await api.me()
+            self.assertEqual("mock-bot", me["username"])
+            result = await api.post_group_message("group", content="hello", msg_id="1")
+            self.assertTrue(result["id"].startswith("mock-"))
+            self.assertTrue(api._http._token.access_token.startswith("mock-token-"))
+            # 获取 token 与 OpenAPI 请求共用连接池，不再单独创建 ClientSession
+            self.assertIs(api._http.pool, api._http._token.pool)
+            self.assertIsNone(api._http._token._session)
+
+        server = self.run_with_server(run)
+        self.assertEqual(1, server.counts["POST /v2/groups/{group_openid}/messages"])
+        # 退出后恢复真实地址
+        self.assertEqual("https", Route.SCHEME)
+        self.assertEqual("https://bots.qq.com/app/getAppAccessToken", Token.TOKEN_URL)
+
+    def test_rate_limit_injection_retried(self):
+        async def run(server, api):
+            await api.me()
+            server.rate_limit_ratio = 0.5
+            results = await asyncio.gather(*(api.get_guild_members("g", limit=10) for _ in range(20)))
+            self.assertTrue(all(len(members) == 10 for members in results))
+            self.assertGreater(api._http.metrics.routes["GET /guilds/{guild_id}/members"].rate_limited, 0)
+
+        server = self.run_with_server(run, seed=1)
+        self.assertGreater(server.statuses[429], 0)
+
+    def test_upload(self):
+        async def run(server, api):
+            media = await api.post_group_file("group", file_type=1, file_data="aGVsbG8=")
+            self.assertEqual(3600, media["ttl"])
+            await api.post_message("channel", content="image", file_image=b"\x89PNG" * 1024)
+
+        server = self.run_with_server(run)
+        self.assertGreaterEqual(server.received_bytes, 4096)
+
+
+if __name__ == "__main__":
+    unittest.main()
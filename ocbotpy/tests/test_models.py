@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+from botpy import models
+from botpy.api import BotAPI
+from botpy.ext.mock_openapi import MockOpenAPI
+from botpy.http import BotHttp
+from botpy.types.channel import ChannelType
+
+
+class ModelTestCase(unittest.TestCase):
+    def test_lazy_fields(self):
+        raw = {"user": {"id": "1", "username": "a"}, "nick": "n", "roles": ["4"]}
+        member = models.Member(raw)
+        self.assertIs(raw, member.raw)
+        self.assertEqual("1", member.user.id)
+        self.assertIsInstance(member.user, models.User)
+        self.assertIsNone(member.joined_at)
+        # 兼容按 dict 读取
+        self.assertEqual("1", member["user"]["id"])
+        self.assertEqual("n", member.get("nick"))
+        self.assertIn("roles", member)
+        self.assertEqual(raw, member)
+        # 不带 __dict__，不能添加字段
+        with self.assertRaises(AttributeError):
+            member.extra = 1
+
+    def test_enum_fields(self):
+        channel = models.Channel({"id": "c", "type": 0, "private_type": 99})
+        self.assertIs(ChannelType.TEXT_CHANNEL, channel.type)
+        # 未知的枚举值原样返回
+        self.assertEqual(99, channel.private_type)
+
+    def test_model_list(self):
+        raw = [{"id": str(i)} for i in range(5)]
+        guilds = models.wrap(models.Guild, raw)
+        self.assertIsInstance(guilds, models.ModelList)
+        self.assertEqual(5, len(guilds))
+        self.assertEqual("4", guilds[-1].id)
+        self.assertEqual(["1", "2"], [guild.id for guild in guilds[1:3]])
+        self.assertEqual(raw, guilds)
+        # 请求失败时返回的 None 原样返回
+        self.assertIsNone(models.wrap(models.Guild, None))
+
+    def test_nested_list(self):
+        roles = models.GuildRoles({"guild_id": "g", "roles": [{"id": "1", "name": "admin"}]})
+        self.assertEqual("admin", roles.roles[0].name)
+
+
+class ResponseModelsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_api_returns_views(self):
+        async def run():
+            async with MockOpenAPI(member_count=30):
+                http = BotHttp(timeout=5, app_id="app", secret="secret")
+                try:
+                    api = BotAPI(http, response_models=True)
+                    me = await api.me()
+                    members = await api.get_guild_members("g", limit=10)
+                    iterated = [member.user.id async for member in api.iter_guild_members("g", page_size=8)]
+                    plain = await BotAPI(http).get_guild_members("g", limit=10)
+                finally:
+                    await http.close()
+            return me, members, iterated, plain
+
+        me, members, iterated, plain = self.loop.run_until_complete(run())
+        self.assertIsInstance(me, models.User)
+        self.assertEqual("mock-bot", me.username)
+        self.assertIsInstance(members, models.ModelList)
+        self.assertEqual("10", members[-1].user.id)
+        self.assertEqual([str(i) for i in range(1, 31)], iterated)
+        # 默认仍然返回 dict
+        self.assertIsInstance(plain, list)
+        self.assertIsInstance(plain[0], dict)
+
+
+if __name__ == "__main__":
+    unittest.main()
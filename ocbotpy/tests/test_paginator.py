@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+import unittest
+
+from botpy.paginator import Paginator, guild_members_fetcher, reaction_users_fetcher
+
+
+class FakeAPI:
+    """按 after 返回成员分页的假接口，每页有 0.05 秒延迟"""
+
+    def __init__(self, total: int):
+        self.ids = [str(i) for i in range(1, total + 1)]
+        self.calls = []
+
+    async def get_guild_members(self, guild_id, after="0", limit=1):
+        self.calls.append(after)
+        await asyncio.sleep(0.05)
+        start = self.ids.index(after) + 1 if after != "0" else 0
+        # 模拟服务端翻页时重复返回上一页的最后一个成员
+        start = max(0, start - 1)
+        return [{"user": {"id": i}} for i in self.ids[start:start + limit]]
+
+    async def get_reaction_users(self, channel_id, message_id, emoji_type, emoji_id, cookie=None, limit=20):
+        page = int(cookie or 0)
+        users = [{"id": "%s-%s" % (page, i)} for i in range(limit)]
+        return {"users": users, "cookie": str(page + 1), "is_end": page == 2}
+
+
+class PaginatorTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def test_members_dedup(self):
+        api = FakeAPI(25)
+        members = self.loop.run_until_complete(Paginator(guild_members_fetcher(api, "g", 10), "0").flatten())
+        self.assertEqual(api.ids, [member["user"]["id"] for member in members])
+
+    def test_prefetch(self):
+        api = FakeAPI(40)
+
+        async def run():
+            async for _ in Paginator(guild_members_fetcher(api, "g", 10), "0"):
+                # 处理每个成员都需要时间，下一页在处理当前页时已经拉取
+                await asyncio.sleep(0.005)
+
+        start = time.monotonic()
+        self.loop.run_until_complete(run())
+        elapsed = time.monotonic() - start
+        # 串行需要 5 页 * 0.05 + 40 * 0.005 = 0.45 秒
+        self.assertLess(elapsed, 0.4)
+
+    def test_early_stop_and_resume(self):
+        api = FakeAPI(30)
+        paginator = Paginator(guild_members_fetcher(api, "g", 10), "0", limit=15)
+
+        async def run():
+            first = [member["user"]["id"] async for member in paginator]
+            resumed = Paginator(guild_members_fetcher(api, "g", 10), paginator.cursor)
+            return first, [member["user"]["id"] async for member in resumed]
+
+        first, rest = self.loop.run_until_complete(run())
+        self.assertEqual(api.ids[:15], first)
+        self.assertFalse(paginator.done)
+        # 最后一页只请求了剩余的条数，正好取完，从下一页继续
+        self.assertEqual(api.ids[15:], rest)
+
+    def test_break_and_resume(self):
+        api = FakeAPI(30)
+        paginator = Paginator(guild_members_fetcher(api, "g", 10), "0")
+
+        async def run():
+            first = []
+            async for member in paginator:
+                first.append(member["user"]["id"])
+                if len(first) == 15:
+                    break
+            resumed = Paginator(guild_members_fetcher(api, "g", 10), paginator.cursor)
+            return first, [member["user"]["id"] async for member in resumed]
+
+        first, rest = self.loop.run_until_complete(run())
+        self.assertEqual(api.ids[:15], first)
+        # 从中断的那一页继续
+        self.assertEqual(api.ids[10:], rest)
+
+    def test_limit_bounds_requests(self):
+        api = FakeAPI(1000)
+        sizes = []
+        get_guild_members = api.get_guild_members
+
+        async def recording(guild_id, after="0", limit=1):
+            sizes.append(limit)
+            return await get_guild_members(guild_id, after=after, limit=limit)
+
+        api.get_guild_members = recording
+        members = self.loop.run_until_complete(
+            Paginator(guild_members_fetcher(api, "g", 400), "0", limit=400).flatten()
+        )
+        self.assertEqual(400, len(members))
+        # limit 正好是一页时不再预取下一页
+        self.assertEqual(["0"], api.calls)
+
+        sizes.clear()
+        api.calls.clear()
+        members = self.loop.run_until_complete(
+            Paginator(guild_members_fetcher(api, "g", 400), "0", limit=450).flatten()
+        )
+        self.assertEqual(api.ids[:450], [member["user"]["id"] for member in members])
+        # 最后一页只请求剩余的条数(加上重复返回的一条)
+        self.assertEqual([400, 51], sizes)
+
+    def test_reaction_cookie(self):
+        users = self.loop.run_until_complete(
+            Paginator(reaction_users_fetcher(FakeAPI(0), "c", "m", 1, "e", 5)).flatten()
+        )
+        self.assertEqual(15, len(users))
+        self.assertEqual("2-4", users[-1]["id"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
+import time
 import unittest
 
 from botpy.robot import Token
@@ -13,5 +15,80 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(token.secret, "123")
 
 
+class RefreshTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.token = Token("123", "123", refresh_margin=60)
+        self.fetches = 0
+
+        async def _fetch():
+            self.fetches += 1
+            await asyncio.sleep(0.01)
+            self.token.access_token = "token-%s" % self.fetches
+            self.token.expires_in = int(time.time()) + 7200
+
+        self.token._fetch_access_token = _fetch
+
+    def tearDown(self) -> None:
+        self.loop.run_until_complete(self.token.close())
+        self.loop.close()
+
+    def test_single_flight(self):
+        async def run():
+            await asyncio.gather(*(self.token.check_token() for _ in range(20)))
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(1, self.fetches)
+        self.assertEqual("QQBot token-1", self.token.get_string())
+
+    def test_refresh_in_background_before_expiry(self):
+        async def run():
+            await self.token.check_token()
+            # 进入安全余量内，token 仍然可用，刷新在后台进行
+            self.token.expires_in = int(time.time()) + 30
+            await self.token.check_token()
+            self.assertEqual("token-1", self.token.access_token)
+            await asyncio.sleep(0.05)
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(2, self.fetches)
+        self.assertEqual("token-2", self.token.access_token)
+
+    def test_short_lived_token(self):
+        # 余量大于服务端返回的有效期时，不会在刷新后立即再次刷新
+        self.token.refresh_margin = 300
+
+        async def _fetch():
+            self.fetches += 1
+            self.token.access_token = "token"
+            self.token.expires_in = int(time.time()) + 50
+
+        self.token._fetch_access_token = _fetch
+
+        async def run():
+            for _ in range(50):
+                await self.token.check_token()
+                await asyncio.sleep(0.01)
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(1, self.fetches)
+        self.assertGreaterEqual(self.token._refresh_handle.when() - self.loop.time(), 20)
+
+    def test_expired_token_refresh_has_floor(self):
+        async def _fetch():
+            self.fetches += 1
+            self.token.access_token = "token"
+            self.token.expires_in = int(time.time())
+
+        self.token._fetch_access_token = _fetch
+
+        async def run():
+            await self.token.check_token()
+            await asyncio.sleep(0.2)
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(1, self.fetches)
+
+
 if __name__ == "__main__":
     unittest.main()